@@ -0,0 +1,16 @@
+"""
+Celery application for core project.
+
+Workers are started with ``celery -A core worker``. Without a configured
+broker, tasks run eagerly in-process (see CELERY_* in settings).
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+app = Celery('core')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
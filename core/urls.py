@@ -17,10 +17,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path,include
 from core import views
+from paymentgateway.views import metrics
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("",views.home,name="home"),
     path("payment/",include("paymentgateway.urls")),
+    path("metrics", metrics, name="metrics"),
 ]
@@ -1,19 +1,113 @@
+import json
+import zlib
+
 from django.contrib import admin
-from .models import Order, PaymentLog
+from django.db.models import Q
+from django.utils.decorators import method_decorator
+
+from .db_routing import read_from_replica
+from .models import ArchivedPaymentLog, Order, PaymentLog, PaymentSettlement
+from .pagination import EstimatedCountPaginator
 
 # Register your models here.
 
+
+class ScalableAdminMixin:
+    """Changelist settings for tables with millions of rows.
+
+    Counts come from the planner estimate, the unfiltered total and filter
+    facets are never counted, and search only uses lookups an index can
+    answer: the default search wraps each field in ``UPPER(...) LIKE '%term%'``
+    and scans the table. Subclasses build the query in ``search_query``;
+    ``search_fields`` only switches the search box on. Listing pages read
+    from a replica; actions posted from them go to the primary.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    date_hierarchy = 'created_at'
+
+    def search_query(self, term):
+        raise NotImplementedError
+
+    @method_decorator(read_from_replica)
+    def changelist_view(self, request, extra_context=None):
+        return super().changelist_view(request, extra_context)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        return queryset.filter(self.search_query(term)), False
+
+
+def _order_pks(term):
+    # Order ids are generated upper-case, so an exact match can use the unique index
+    return Order.objects.filter(order_id=term.upper()).values('pk')
+
+
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['order_id', 'name', 'total_price', 'is_paid', 'payment_method', 'created_at']
-    list_filter = ['is_paid', 'payment_method', 'created_at']
-    search_fields = ['name', 'order_id']
+    list_filter = ['is_paid', 'payment_method']
+    search_fields = ['order_id', 'transaction_id', 'name']
+    search_help_text = "Exact order or transaction id, or the start of the customer's name"
     readonly_fields = ['order_id', 'created_at', 'updated_at']
 
+    def search_query(self, term):
+        return Q(order_id=term.upper()) | Q(transaction_id=term) | Q(name__startswith=term)
+
 
 @admin.register(PaymentLog)
-class PaymentLogAdmin(admin.ModelAdmin):
+class PaymentLogAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['order', 'payment_method', 'transaction_id', 'amount', 'status', 'created_at']
-    list_filter = ['payment_method', 'status', 'created_at']
+    list_filter = ['payment_method', 'status']
+    list_select_related = ['order']
     search_fields = ['order__order_id', 'transaction_id']
+    search_help_text = "Exact order id or gateway transaction id"
     readonly_fields = ['created_at']
+    raw_id_fields = ['order']
+
+    def search_query(self, term):
+        return Q(order__in=_order_pks(term)) | Q(transaction_id=term)
+
+
+@admin.register(PaymentSettlement)
+class PaymentSettlementAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ['key', 'order', 'payment_method', 'amount', 'created_at']
+    list_filter = ['payment_method']
+    list_select_related = ['order']
+    search_fields = ['key', 'order__order_id']
+    search_help_text = "Exact order id or gateway transaction id"
+    readonly_fields = ['created_at']
+    raw_id_fields = ['order']
+    date_hierarchy = None  # Settlements have no created_at index
+
+    def search_query(self, term):
+        keys = [term] + [f'{gateway}:{term}' for gateway in ('Khalti', 'eSewa')]
+        return Q(key__in=keys) | Q(order__in=_order_pks(term))
+
+
+@admin.register(ArchivedPaymentLog)
+class ArchivedPaymentLogAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    """Read-only view of logs moved out by the retention job; search by order id"""
+    list_display = ['order', 'payment_method', 'transaction_id', 'amount', 'status', 'created_at']
+    list_filter = ['payment_method', 'status']
+    list_select_related = ['order']
+    search_fields = ['order__order_id', 'transaction_id']
+    search_help_text = "Exact order id or gateway transaction id"
+    exclude = ['payload']
+    readonly_fields = ['details']
+
+    def search_query(self, term):
+        return Q(order__in=_order_pks(term)) | Q(transaction_id=term)
+
+    @admin.display(description='Archived fields')
+    def details(self, obj):
+        return json.dumps(json.loads(zlib.decompress(obj.payload)), indent=2)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
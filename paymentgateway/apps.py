@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class PaymentgatewayConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'paymentgateway'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from .metrics import install_query_timer
+
+        # Each thread has its own connections; time the ones sync_to_async threads open too
+        connection_created.connect(install_query_timer, dispatch_uid='paymentgateway.query_timer')
@@ -0,0 +1,180 @@
+import gzip
+import json
+import zlib
+import logging
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ArchivedPaymentLog, PaymentLog
+
+logger = logging.getLogger(__name__)
+
+# PaymentLog fields kept inside the compressed payload rather than as columns
+PAYLOAD_FIELDS = ('gateway_response', 'currency', 'ip_address', 'user_agent', 'gateway_fee', 'net_amount')
+COLUMN_FIELDS = ('id', 'order_id', 'payment_method', 'transaction_id', 'amount', 'status', 'created_at')
+
+
+def _month(value):
+    return date(value.year, value.month, 1)
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _entry(log):
+    """Plain-JSON form of a PaymentLog, as written to archive files"""
+    entry = {name: getattr(log, name) for name in COLUMN_FIELDS + PAYLOAD_FIELDS}
+    entry['created_at'] = log.created_at.isoformat()
+    entry['gateway_fee'] = str(log.gateway_fee)
+    entry['net_amount'] = str(log.net_amount)
+    return entry
+
+
+def _to_payment_log(entry):
+    """Unsaved PaymentLog rebuilt from an archive entry, for display alongside live logs"""
+    values = dict(entry)
+    values['created_at'] = parse_datetime(values['created_at'])
+    values['gateway_fee'] = Decimal(values.get('gateway_fee') or 0)
+    values['net_amount'] = Decimal(values.get('net_amount') or 0)
+    return PaymentLog(**values)
+
+
+class TableArchive:
+    """Archive into ArchivedPaymentLog rows with compressed payloads"""
+
+    def __init__(self):
+        self.partitioned = connection.vendor == 'postgresql'
+        self._partitions = set()
+
+    def _ensure_partitions(self, months):
+        table = ArchivedPaymentLog._meta.db_table
+        for month in sorted(set(months) - self._partitions):
+            try:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute(
+                        f'CREATE TABLE IF NOT EXISTS {table}_p{month:%Y%m} PARTITION OF {table} '
+                        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+                    )
+            except DatabaseError as e:
+                # Rows for this month already sit in the default partition; keep using it
+                logger.warning("Could not create archive partition for %s: %s", month, e)
+            self._partitions.add(month)
+
+    def write(self, logs):
+        if self.partitioned:
+            self._ensure_partitions(_month(log.created_at) for log in logs)
+        ArchivedPaymentLog.objects.bulk_create(
+            [self._row(log) for log in logs],
+            ignore_conflicts=True,  # A re-run after a crash may see rows it already copied
+        )
+
+    @staticmethod
+    def _row(log):
+        entry = _entry(log)
+        payload = json.dumps({name: entry[name] for name in PAYLOAD_FIELDS}, separators=(',', ':'), default=str)
+        return ArchivedPaymentLog(
+            id=log.id, order_id=log.order_id, payment_method=log.payment_method,
+            transaction_id=log.transaction_id, amount=log.amount, status=log.status,
+            created_at=log.created_at, payload=zlib.compress(payload.encode()),
+        )
+
+    @staticmethod
+    def read(order):
+        for row in ArchivedPaymentLog.objects.filter(order=order):
+            entry = {name: getattr(row, name) for name in COLUMN_FIELDS}
+            entry['created_at'] = row.created_at.isoformat()
+            entry.update(json.loads(zlib.decompress(row.payload)))
+            yield entry
+
+
+class FileArchive:
+    """Archive into one gzipped JSONL file per month, appended batch by batch"""
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory or getattr(settings, 'PAYMENT_LOG_ARCHIVE_DIR', 'payment_log_archive'))
+
+    def _path(self, month):
+        return self.directory / f'payment_logs_{month:%Y-%m}.jsonl.gz'
+
+    def write(self, logs):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        by_month = {}
+        for log in logs:
+            by_month.setdefault(_month(log.created_at), []).append(log)
+        for month, entries in by_month.items():
+            # Each append is a separate gzip member; readers see one continuous stream
+            with gzip.open(self._path(month), 'at') as archive:
+                for log in entries:
+                    archive.write(json.dumps(_entry(log), default=str) + '\n')
+
+    def read(self, order):
+        """Scan the months since the order was created.
+
+        The needle only skips parsing lines that cannot match; a gateway
+        payload may carry its own ``order_id``, so the parsed entry is checked.
+        """
+        needle = f'"order_id": {order.pk},'
+        seen = set()
+        month, last = _month(order.created_at), _month(timezone.now())
+        while month <= last:
+            path = self._path(month)
+            if path.exists():
+                with gzip.open(path, 'rt') as archive:
+                    for line in archive:
+                        if needle in line:
+                            entry = json.loads(line)
+                            if entry['order_id'] != order.pk:
+                                continue
+                            # An interrupted run can leave a batch in the file twice
+                            if entry['id'] not in seen:
+                                seen.add(entry['id'])
+                                yield entry
+            month = _next_month(month)
+
+
+def get_archive(backend=None):
+    backend = backend or getattr(settings, 'PAYMENT_LOG_ARCHIVE_BACKEND', 'table')
+    return FileArchive() if backend == 'files' else TableArchive()
+
+
+def archive_payment_logs(older_than_days=None, batch_size=None, backend=None):
+    """Move PaymentLog rows older than the retention period into the archive.
+
+    Each batch is copied and then deleted in one transaction, so a log is
+    never in neither place. Returns the number of logs moved.
+    """
+    days = older_than_days if older_than_days is not None else getattr(settings, 'PAYMENT_LOG_RETENTION_DAYS', 90)
+    batch_size = batch_size or getattr(settings, 'PAYMENT_LOG_ARCHIVE_BATCH_SIZE', 1000)
+    cutoff = timezone.now() - timedelta(days=days)
+    archive = get_archive(backend)
+
+    moved, last_pk = 0, 0
+    while True:
+        # Walk the primary key rather than sorting on created_at; ids grow with time
+        batch = list(PaymentLog.objects.filter(pk__gt=last_pk, created_at__lt=cutoff).order_by('pk')[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            archive.write(batch)
+            PaymentLog.objects.filter(pk__in=[log.pk for log in batch]).delete()
+        moved += len(batch)
+        last_pk = batch[-1].pk
+        logger.info("Archived %d payment logs (up to id %s)", moved, last_pk)
+    return moved
+
+
+def archived_logs_for(order):
+    """Archived PaymentLog entries for one order, newest first, as unsaved PaymentLog instances"""
+    entries = list(TableArchive.read(order))
+    file_archive = FileArchive()
+    if file_archive.directory.exists():
+        entries.extend(file_archive.read(order))
+    entries.sort(key=lambda entry: (entry['created_at'], entry['id']), reverse=True)
+    return [_to_payment_log(entry) for entry in entries]
@@ -0,0 +1,204 @@
+import json
+import logging
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from .models import Order
+from .log_sink import arecord_payment_log
+from .http_client import get_async_http_client
+from .circuit_breaker import CircuitOpenError
+from .payment_gateways import (
+    EsewaPaymentGateway, KhaltiPaymentGateway, circuit_open_error, esewa_settlement_result, esewa_status_result,
+    khalti_error_data, khalti_settlement_result, parse_khalti_lookup,
+)
+from .settlement import aalready_settled, asettle_payment
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncEsewaPaymentGateway(EsewaPaymentGateway):
+    """eSewa gateway for async views, using async ORM and non-blocking HTTP"""
+
+    async def agenerate_payment_data(self, order):
+        """Signed payment form for ``order``, cached like ``generate_payment_data``"""
+        key = self._form_cache_key(order)
+        payment_data = await cache.aget(key)
+        if payment_data is not None:
+            return payment_data
+
+        payment_data = self._build_payment_data(order, self.transaction_uuid(order))
+        if not await cache.aadd(key, payment_data, self.form_ttl):
+            return await cache.aget(key, payment_data)
+
+        await arecord_payment_log(
+            order=order,
+            payment_method='eSewa',
+            transaction_id=payment_data['transaction_uuid'],
+            amount=order.total_price,
+            status='Initiated',
+            gateway_response={'payment_data': payment_data}
+        )
+
+        return payment_data
+
+    async def astart_checkout(self, order):
+        return True, {'payment_url': self.payment_url, 'form': await self.agenerate_payment_data(order)}
+
+    async def averify_payment(self, request):
+        """Verify eSewa payment with proper API verification"""
+        params = self.parse_callback(request.GET)
+        if params is None:
+            logger.error("eSewa payment verification failed: missing or invalid parameters", extra={'gateway': 'eSewa'})
+            return False, "Missing or invalid payment details"
+        oid, amt, refId, transaction_uuid = params
+
+        if await aalready_settled('eSewa', refId, oid):
+            return True, "Payment verified successfully"
+
+        try:
+            order = await Order.objects.aget(order_id=oid)
+
+            if self.mode == 'production' and self.verify_url:
+                transaction_uuid = transaction_uuid or await sync_to_async(self._initiated_uuid)(order)
+                status = await self._averify_with_esewa_api(oid, amt, refId, transaction_uuid)
+                if status != 'COMPLETE':
+                    result, failure = esewa_status_result(status)
+                    if failure:
+                        await self._alog_failed_payment(order, refId, amt, failure)
+                    return result
+
+            outcome = await asettle_payment(*self._settlement_args(oid, amt, refId))
+            result, failure = esewa_settlement_result(outcome, oid, amt, refId)
+            if failure:
+                await self._alog_failed_payment(order, refId, amt, failure)
+            return result
+
+        except Order.DoesNotExist:
+            logger.error("eSewa payment verification failed: Order %s not found", oid, extra={'gateway': 'eSewa', 'order_id': oid})
+            return False, "Order not found"
+        except Exception as e:
+            logger.error("eSewa payment verification error: %s", e, extra={'gateway': 'eSewa', 'order_id': oid})
+            return False, f"Error: {str(e)}"
+
+    async def atransaction_status(self, transaction_uuid, total_amount, product_code=None):
+        """Status of one eSewa transaction, cached like ``transaction_status``"""
+        key = self._status_cache_key(product_code or self.scd, transaction_uuid)
+        result = await cache.aget(key)
+        if result is None:
+            response = await get_async_http_client().get(
+                self.verify_url, params=self._status_params(product_code, total_amount, transaction_uuid),
+            )
+            result = self._parse_status(transaction_uuid, response.status_code, self._json(response))
+            if result.final:
+                await cache.aset(key, result, self.status_ttl)
+        return result
+
+    async def _averify_with_esewa_api(self, oid, amt, refId, transaction_uuid=None):
+        """Check a callback with eSewa's transaction status API and return the status"""
+        if not transaction_uuid:
+            logger.warning("No eSewa transaction to check for order %s", oid, extra={'gateway': 'eSewa', 'order_id': oid})
+            return 'NOT_FOUND'
+        try:
+            result = await self.atransaction_status(transaction_uuid, amt)
+        except Exception as e:
+            logger.error("eSewa API verification exception: %s", e, extra={'gateway': 'eSewa', 'order_id': oid})
+            return 'ERROR'
+        return self._check_status(result, oid, refId)
+
+    async def _alog_failed_payment(self, order, refId, amt, reason):
+        """Log failed payment attempt"""
+        await arecord_payment_log(
+            order=order,
+            payment_method='eSewa',
+            transaction_id=refId or 'unknown',
+            amount=int(float(amt)) if amt else 0,
+            status='Failed',
+            gateway_response={'reason': reason},
+            reason=reason
+        )
+
+
+class AsyncKhaltiPaymentGateway(KhaltiPaymentGateway):
+    """Khalti gateway for async views, using async ORM and non-blocking HTTP"""
+
+    async def ainitiate_payment(self, order):
+        """Initiate Khalti payment with proper error handling"""
+        try:
+            response = await get_async_http_client().post(
+                self.payment_url,
+                headers=self._headers(),
+                content=json.dumps(self._build_initiate_data(order))
+            )
+
+            if response.status_code == 200:
+                data = response.json()
+                await self._alog(order, data.get('pidx', ''), 'Initiated', data)
+                logger.info("Khalti payment initiated for order %s", order.order_id, extra={'gateway': 'Khalti', 'order_id': order.order_id})
+                return True, data
+
+            error_data = khalti_error_data(response)
+            await self._alog(order, '', 'Failed', error_data, reason='http_error')
+            logger.error("Khalti payment initiation failed: %s", error_data, extra={'gateway': 'Khalti', 'order_id': order.order_id})
+            return False, error_data
+
+        except CircuitOpenError as e:
+            error_data = circuit_open_error(e)
+            await self._alog(order, '', 'Failed', error_data, reason='circuit_open')
+            logger.warning("Khalti payment initiation skipped: %s", e, extra={'gateway': 'Khalti', 'order_id': order.order_id})
+            return False, error_data
+        except httpx.HTTPError as e:
+            error_data = {"error": f"Network error: {str(e)}"}
+            await self._alog(order, '', 'Failed', error_data, reason='network_error')
+            logger.error("Khalti payment initiation exception: %s", e, extra={'gateway': 'Khalti', 'order_id': order.order_id})
+            return False, error_data
+        except Exception as e:
+            error_data = {"error": str(e)}
+            await self._alog(order, '', 'Failed', error_data, reason='unexpected_error')
+            logger.error("Khalti payment initiation unexpected error: %s", e, extra={'gateway': 'Khalti', 'order_id': order.order_id})
+            return False, error_data
+
+    async def astart_checkout(self, order):
+        return await self.ainitiate_payment(order)
+
+    async def alookup(self, pidx):
+        """``lookup`` without blocking the event loop"""
+        return await get_async_http_client().post(
+            self.verify_url,
+            headers=self._headers(),
+            content=json.dumps({"pidx": pidx}),
+            idempotent=True
+        )
+
+    async def averify_payment(self, pidx, order_id=None):
+        """Verify Khalti payment with comprehensive validation"""
+        try:
+            data, error_data = parse_khalti_lookup(await self.alookup(pidx), pidx)
+            if data is None:
+                return False, error_data
+
+            order_id = data.get('purchase_order_id') or order_id
+            outcome = await asettle_payment(order_id, 'Khalti', data.get('transaction_id'), data.get('total_amount', 0), data)
+            return khalti_settlement_result(outcome, order_id, pidx, data)
+
+        except Order.DoesNotExist:
+            logger.error("Khalti verification failed: Order not found for pidx %s", pidx, extra={'gateway': 'Khalti', 'pidx': pidx})
+            return False, {"error": "Order not found"}
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            logger.error("Khalti verification network error: %s", e, extra={'gateway': 'Khalti', 'pidx': pidx})
+            return False, {"error": f"Network error: {str(e)}"}
+        except Exception as e:
+            logger.error("Khalti verification unexpected error: %s", e, extra={'gateway': 'Khalti', 'pidx': pidx})
+            return False, {"error": str(e)}
+
+    async def _alog(self, order, transaction_id, status, gateway_response, reason=''):
+        await arecord_payment_log(
+            order=order,
+            payment_method='Khalti',
+            transaction_id=transaction_id,
+            amount=order.total_price,
+            status=status,
+            gateway_response=gateway_response,
+            reason=reason
+        )
@@ -0,0 +1,122 @@
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, aget_object_or_404
+from django.contrib import messages
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.conf import settings
+from .db_routing import read_from_replica
+from .models import Order
+from .gateway_registry import get_gateway
+from .history import with_payment_history
+from .status_cache import get_payment_status, last_modified, status_response
+from .tasks import mark_order_processing, verify_esewa_payment, verify_khalti_payment
+from .views import checkout_response
+
+# Async counterparts of the checkout, callback and status views. Served under
+# ASGI they keep gateway round-trips off worker threads entirely.
+
+
+async def order_checkout(request, order_id):
+    """Handle order checkout with payment gateway selection"""
+    order = await aget_object_or_404(with_payment_history(Order.objects.all()), id=order_id)
+
+    if request.method == "POST":
+        gateway = get_gateway(request.POST.get('payment_method'), asynchronous=True)
+
+        if gateway is None:
+            messages.error(request, "Please choose a supported payment method")
+        else:
+            success, response = await gateway.astart_checkout(order)
+            return checkout_response(request, order, gateway, success, response)
+
+    return render(request, "order_checkout.html", {"order": order})
+
+
+async def _enqueue_verification(order_id, task, *args):
+    """Mark the order processing, queue its verification and redirect to the waiting page"""
+    try:
+        order = await Order.objects.aget(order_id=order_id)
+    except Order.DoesNotExist:
+        return None
+
+    await sync_to_async(mark_order_processing)(order)
+    # Eager mode runs the task inline with the sync ORM, so keep it off the event loop
+    await sync_to_async(task.delay)(*args)
+    return redirect('payment_processing', order_id=order.id)
+
+
+async def esewa_success(request):
+    """Handle eSewa payment success callback"""
+    esewa = get_gateway('esewa', asynchronous=True)
+    params = esewa.parse_callback(request.GET)
+    if params is None:
+        messages.error(request, "Payment verification failed: Missing or invalid payment details")
+        return redirect('order_list')
+    oid, amt, refId, transaction_uuid = params
+
+    if getattr(settings, 'PAYMENT_QUEUE_VERIFICATION', True):
+        response = await _enqueue_verification(oid, verify_esewa_payment, oid, amt, refId, transaction_uuid)
+        if response is None:
+            messages.error(request, "Order not found")
+            return redirect('order_list')
+        return response
+
+    success, message = await esewa.averify_payment(request)
+
+    if success:
+        try:
+            order = await Order.objects.aget(order_id=oid)
+            messages.success(request, "Payment completed successfully!")
+            return redirect('order_success', order_id=order.id)
+        except Order.DoesNotExist:
+            messages.error(request, "Order not found")
+            return redirect('order_list')
+    elif success is None:
+        messages.warning(request, f"eSewa reports this payment as {message}; it will be checked again shortly")
+        return redirect('order_list')
+    else:
+        messages.error(request, f"Payment verification failed: {message}")
+        return redirect('order_list')
+
+
+async def khalti_success(request):
+    """Handle Khalti payment success callback"""
+    pidx = request.GET.get('pidx')
+    purchase_order_id = request.GET.get('purchase_order_id')
+
+    if not pidx:
+        messages.error(request, "Invalid payment session")
+        return redirect('order_list')
+
+    if getattr(settings, 'PAYMENT_QUEUE_VERIFICATION', True) and purchase_order_id:
+        response = await _enqueue_verification(purchase_order_id, verify_khalti_payment, pidx, purchase_order_id)
+        if response is None:
+            messages.error(request, "Order not found")
+            return redirect('order_list')
+        return response
+
+    success, response = await get_gateway('khalti', asynchronous=True).averify_payment(pidx, order_id=purchase_order_id)
+
+    if success:
+        try:
+            order = await Order.objects.aget(order_id=response.get('purchase_order_id') or purchase_order_id)
+            messages.success(request, "Payment completed successfully!")
+            return redirect('order_success', order_id=order.id)
+        except Order.DoesNotExist:
+            messages.error(request, "Order not found")
+            return redirect('order_list')
+    else:
+        messages.error(request, f"Payment verification failed: {response}")
+        return redirect('order_list')
+
+
+@method_decorator(read_from_replica, name='get')
+class PaymentStatusView(View):
+    """API endpoint to check payment status"""
+
+    async def get(self, request, order_id):
+        entry = await sync_to_async(get_payment_status)(order_id)
+        if entry is None:
+            return JsonResponse({'status': 'error', 'message': 'Order not found'})
+        return status_response(request, entry['payload'], entry['etag'], last_modified(entry))
@@ -0,0 +1,219 @@
+import threading
+import time
+import logging
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .metrics import CIRCUIT_REJECTIONS, CIRCUIT_STATE, GATEWAY_READ_TIMEOUT, gateway_label
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Fewer latency samples than this and the configured read timeout is used as is
+MIN_TIMEOUT_SAMPLES = 20
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of calling a gateway endpoint whose circuit is open.
+
+    It is a ``ConnectionError`` so callers that already retry or report
+    network failures treat it the same way, without waiting on a timeout.
+    """
+
+    def __init__(self, breaker, retry_after):
+        self.gateway = breaker.gateway
+        self.endpoint = breaker.endpoint
+        self.retry_after = retry_after
+        super().__init__(f"{breaker.gateway} {breaker.endpoint} is temporarily unavailable (circuit open)")
+
+
+class CircuitBreaker:
+    """Error-rate and latency circuit breaker for one gateway endpoint.
+
+    Call outcomes are counted in fixed windows in the cache, so every worker
+    sees the same rates and trips together. An open circuit fails calls fast
+    until ``open_seconds`` have passed; then one half-open probe is let
+    through and its outcome closes or re-opens the circuit. Recent latencies
+    are kept per process to size the read timeout.
+    """
+
+    def __init__(self, gateway, endpoint):
+        self.gateway = gateway
+        self.endpoint = endpoint
+        self.key = f'gateway-circuit:{gateway}:{endpoint}'
+        self.enabled = getattr(settings, 'GATEWAY_BREAKER_ENABLED', True)
+        self.window = getattr(settings, 'GATEWAY_BREAKER_WINDOW', 30)
+        self.min_calls = getattr(settings, 'GATEWAY_BREAKER_MIN_CALLS', 10)
+        self.error_rate = getattr(settings, 'GATEWAY_BREAKER_ERROR_RATE', 0.5)
+        self.slow_call_seconds = getattr(settings, 'GATEWAY_BREAKER_SLOW_CALL_SECONDS', 5)
+        self.slow_call_rate = getattr(settings, 'GATEWAY_BREAKER_SLOW_CALL_RATE', 0.5)
+        self.open_seconds = getattr(settings, 'GATEWAY_BREAKER_OPEN_SECONDS', 30)
+        self.adaptive_timeout = getattr(settings, 'GATEWAY_ADAPTIVE_TIMEOUT', True)
+        self.timeout_percentile = getattr(settings, 'GATEWAY_TIMEOUT_PERCENTILE', 99)
+        self.timeout_multiplier = getattr(settings, 'GATEWAY_TIMEOUT_MULTIPLIER', 3)
+        self.min_read_timeout = getattr(settings, 'GATEWAY_MIN_READ_TIMEOUT', 1)
+        # A probe holds the half-open slot at most this long, even if its worker dies
+        self.probe_ttl = int(getattr(settings, 'GATEWAY_HTTP_READ_TIMEOUT', 10)) + 5
+        self._latencies = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self._state_gauge = CIRCUIT_STATE.labels(gateway=gateway, endpoint=endpoint)
+
+    def state(self):
+        opened = cache.get(self.key)
+        if opened is None:
+            return CLOSED
+        return OPEN if time.time() < opened['until'] else HALF_OPEN
+
+    def before_call(self):
+        """Admit a call, returning True if it is the half-open probe.
+
+        Raises ``CircuitOpenError`` while the circuit is open, or while
+        another worker's probe is in flight.
+        """
+        if not self.enabled:
+            return False
+        opened = cache.get(self.key)
+        if opened is None:
+            self._state_gauge.set(STATE_VALUES[CLOSED])
+            return False
+
+        now = time.time()
+        if now >= opened['until'] and cache.add(f'{self.key}:probe', 1, self.probe_ttl):
+            self._state_gauge.set(STATE_VALUES[HALF_OPEN])
+            return True
+        self._state_gauge.set(STATE_VALUES[OPEN])
+        CIRCUIT_REJECTIONS.labels(gateway=self.gateway, endpoint=self.endpoint).inc()
+        raise CircuitOpenError(self, max(opened['until'] - now, 1))
+
+    def record(self, seconds, failed, probe=False):
+        """Count one call's outcome and trip the circuit if the window's rates are too high"""
+        with self._lock:
+            self._latencies.append(seconds)
+        if not self.enabled:
+            return
+
+        slow = seconds >= self.slow_call_seconds
+        if probe:
+            if failed or slow:
+                self._open("half-open probe failed")
+            else:
+                self._close()
+            return
+
+        prefix = self._window_prefix()
+        self._incr(f'{prefix}:calls')
+        if failed:
+            self._incr(f'{prefix}:failures')
+        if slow:
+            self._incr(f'{prefix}:slow')
+        if not (failed or slow):
+            return  # A good call can't push the rates over a threshold
+
+        counts = cache.get_many([f'{prefix}:calls', f'{prefix}:failures', f'{prefix}:slow'])
+        calls = counts.get(f'{prefix}:calls', 0)
+        if calls < self.min_calls:
+            return
+        if counts.get(f'{prefix}:failures', 0) / calls >= self.error_rate:
+            self._open(f"error rate over {self.error_rate:.0%} in {calls} calls")
+        elif counts.get(f'{prefix}:slow', 0) / calls >= self.slow_call_rate:
+            self._open(f"calls slower than {self.slow_call_seconds}s over {self.slow_call_rate:.0%} in {calls} calls")
+
+    async def abefore_call(self):
+        """``before_call`` for async callers, run off the event loop (the cache may be Redis)"""
+        return await sync_to_async(self.before_call, thread_sensitive=False)()
+
+    async def arecord(self, seconds, failed, probe=False):
+        await sync_to_async(self.record, thread_sensitive=False)(seconds, failed, probe)
+
+    def read_timeout(self, default):
+        """Read timeout of ``multiplier`` x the latency percentile, between the minimum and ``default``"""
+        if not self.adaptive_timeout:
+            return default
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < MIN_TIMEOUT_SAMPLES:
+            return default
+
+        observed = samples[min(int(len(samples) * self.timeout_percentile / 100), len(samples) - 1)]
+        timeout = min(max(observed * self.timeout_multiplier, self.min_read_timeout), default)
+        GATEWAY_READ_TIMEOUT.labels(gateway=self.gateway, endpoint=self.endpoint).set(timeout)
+        return timeout
+
+    def _window_prefix(self):
+        return f'{self.key}:{int(time.time() // self.window)}'
+
+    def _incr(self, key):
+        cache.add(key, 0, self.window * 2)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Expired between add and incr
+            cache.set(key, 1, self.window * 2)
+
+    def _open(self, reason):
+        # No expiry: only a probe closes the circuit, so a quiet gateway isn't trusted blindly
+        cache.set(self.key, {'until': time.time() + self.open_seconds}, None)
+        cache.delete(f'{self.key}:probe')
+        self._state_gauge.set(STATE_VALUES[OPEN])
+        logger.warning(
+            "Circuit opened for %s %s: %s", self.gateway, self.endpoint, reason,
+            extra={'gateway': self.gateway, 'endpoint': self.endpoint},
+        )
+
+    def _close(self):
+        prefix = self._window_prefix()
+        cache.delete_many([
+            self.key, f'{self.key}:probe', f'{prefix}:calls', f'{prefix}:failures', f'{prefix}:slow',
+        ])
+        self._state_gauge.set(STATE_VALUES[CLOSED])
+        logger.info(
+            "Circuit closed for %s %s", self.gateway, self.endpoint,
+            extra={'gateway': self.gateway, 'endpoint': self.endpoint},
+        )
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url):
+    """Return this process's breaker for the gateway endpoint a URL points at"""
+    key = (gateway_label(url), urlsplit(url).path)
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(key)
+            if breaker is None:
+                breaker = _breakers[key] = CircuitBreaker(*key)
+    return breaker
+
+
+def circuit_states():
+    """State and current read timeout of every breaker this process has used"""
+    read_timeout = getattr(settings, 'GATEWAY_HTTP_READ_TIMEOUT', 10)
+    return {
+        f'{breaker.gateway} {breaker.endpoint}': {
+            'state': breaker.state(),
+            'read_timeout': round(breaker.read_timeout(read_timeout), 3),
+        }
+        for breaker in list(_breakers.values())
+    }
+
+
+@receiver(setting_changed)
+def reset_breakers(setting=None, **kwargs):
+    """Rebuild breakers when gateway settings change (e.g. under override_settings)"""
+    if setting is None or setting.startswith(('GATEWAY_', 'KHALTI_', 'ESEWA_')):
+        with _breakers_lock:
+            _breakers.clear()
@@ -0,0 +1,124 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Set by replica_reads(); outside it every query goes to the primary
+_replica_reads = ContextVar('replica_reads', default=False)
+# Per-request RequestState installed by ReplicaPinningMiddleware
+_request_state = ContextVar('db_request_state', default=None)
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+class RequestState:
+    """Whether this request must read from the primary, and whether it has written.
+
+    Mutated in place, so a write inside ``sync_to_async`` is seen by the
+    request that started it.
+    """
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def pin_seconds():
+    return getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 5)
+
+
+class ReplicaRouter:
+    """Send reads inside ``replica_reads()`` to a replica; everything else to the primary.
+
+    Reads stay on the primary once the request has written, while the
+    client is pinned after a recent write, and inside a transaction.
+    """
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or not _replica_reads.get():
+            return None
+        state = _request_state.get()
+        if state is not None and (state.pinned or state.wrote):
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
+
+
+def start_request(pinned=False):
+    """Install routing state for the current request and return it"""
+    state = RequestState(pinned)
+    _request_state.set(state)
+    return state
+
+
+def end_request():
+    _request_state.set(None)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def read_from_replica(view):
+    """View decorator: GET and HEAD queries go to a replica.
+
+    Template responses are rendered inside the decorator, because lazy
+    querysets in their context are only read while rendering.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            with replica_reads(request.method in SAFE_METHODS):
+                return await view(request, *args, **kwargs)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with replica_reads(request.method in SAFE_METHODS):
+                response = view(request, *args, **kwargs)
+                if callable(getattr(response, 'render', None)) and not response.is_rendered:
+                    response.render()
+                return response
+    return wrapper
+
+
+def _pin_key(order_pk):
+    return f"db-pin:order:{order_pk}"
+
+
+def pin_orders(order_pks):
+    """Read these orders from the primary until replicas have caught up with a write"""
+    if replicas():
+        cache.set_many({_pin_key(pk): 1 for pk in order_pks}, pin_seconds())
+
+
+def orders_pinned(order_pks):
+    return bool(replicas()) and bool(cache.get_many([_pin_key(pk) for pk in order_pks]))
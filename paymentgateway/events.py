@@ -0,0 +1,288 @@
+import asyncio
+import json
+import queue
+import time
+import threading
+import logging
+
+import redis
+import redis.asyncio as aioredis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Channel every status change is published on, for dashboards
+DASHBOARD_CHANNEL = 'orders'
+
+
+def order_channel(order_pk):
+    return f'order:{order_pk}'
+
+
+class Subscription:
+    """Blocking subscription for WSGI streams"""
+
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.channels = channels
+        self._queue = queue.Queue(maxsize=100)
+
+    def deliver(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            logger.warning("Dropping payment event for slow subscriber on %s", self.channels)
+
+    def get(self, timeout):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    """Subscription read from an event loop without tying up a thread"""
+
+    def __init__(self, broker, channels):
+        super().__init__(broker, channels)
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=100)
+
+    def deliver(self, event):
+        # Publishers run on other threads; hand the event to the subscriber's loop
+        self._loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning("Dropping payment event for slow subscriber on %s", self.channels)
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Fan-out within one process; enough for tests and single-node deployments"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    def _register(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def subscribe(self, channels):
+        return self._register(Subscription(self, channels))
+
+    async def asubscribe(self, channels):
+        return self._register(AsyncSubscription(self, channels))
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+
+class RedisSubscription:
+    def __init__(self, pubsub, channels):
+        self.pubsub = pubsub
+        self.channels = channels
+
+    def get(self, timeout):
+        message = self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        return json.loads(message['data']) if message else None
+
+    def close(self):
+        self.pubsub.close()
+
+
+class AsyncRedisSubscription(RedisSubscription):
+    async def get(self, timeout):
+        message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        return json.loads(message['data']) if message else None
+
+    async def close(self):
+        await self.pubsub.aclose()
+
+
+class RedisBroker:
+    """Redis pub/sub so events reach subscribers on every node"""
+
+    def __init__(self, url):
+        self.url = url
+        self.client = redis.Redis.from_url(url)
+        self._async_client = None
+
+    def publish(self, channel, event):
+        self.client.publish(channel, json.dumps(event))
+
+    def subscribe(self, channels):
+        pubsub = self.client.pubsub()
+        pubsub.subscribe(*channels)
+        return RedisSubscription(pubsub, channels)
+
+    async def asubscribe(self, channels):
+        if self._async_client is None:
+            self._async_client = aioredis.Redis.from_url(self.url)
+        pubsub = self._async_client.pubsub()
+        await pubsub.subscribe(*channels)
+        return AsyncRedisSubscription(pubsub, channels)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Process-wide event broker chosen by PAYMENT_EVENTS_BACKEND"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                if getattr(settings, 'PAYMENT_EVENTS_BACKEND', 'memory') == 'redis':
+                    _broker = RedisBroker(settings.PAYMENT_EVENTS_REDIS_URL)
+                else:
+                    _broker = InProcessBroker()
+    return _broker
+
+
+def status_event(order):
+    return {
+        'id': order.pk,
+        'is_paid': order.is_paid,
+        'order_status': order.status,
+        'payment_method': order.payment_method,
+        'transaction_id': order.transaction_id,
+    }
+
+
+def publish_status_change(order):
+    """Tell order and dashboard subscribers about an order's new payment status"""
+    event = status_event(order)
+    broker = get_broker()
+    try:
+        broker.publish(order_channel(order.pk), event)
+        broker.publish(DASHBOARD_CHANNEL, event)
+    except Exception as e:
+        # Clients fall back to polling; never fail a settlement over a notification
+        logger.error("Publishing payment event for order %s failed: %s", order.order_id, e, extra={'order_id': order.order_id})
+
+
+_open_streams = 0
+_streams_lock = threading.Lock()
+
+
+class StreamSlot:
+    """One of the PAYMENT_EVENTS_MAX_STREAMS streams a process may hold open"""
+
+    def __init__(self):
+        self.held = True
+
+    def release(self):
+        global _open_streams
+        with _streams_lock:
+            if self.held:
+                self.held = False
+                _open_streams -= 1
+
+
+def acquire_stream_slot():
+    """A StreamSlot, or ``None`` when this process already holds its maximum"""
+    global _open_streams
+    with _streams_lock:
+        if _open_streams >= getattr(settings, 'PAYMENT_EVENTS_MAX_STREAMS', 500):
+            return None
+        _open_streams += 1
+    return StreamSlot()
+
+
+class SlotStream:
+    """Async stream that gives its slot back however it ends.
+
+    The generator finishing, the client disconnecting (cancellation) and
+    the response being closed all release it; ``release`` is idempotent.
+    """
+
+    def __init__(self, stream, slot):
+        self.stream = stream
+        self.slot = slot
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.stream.__anext__()
+        except BaseException:
+            self.slot.release()
+            raise
+
+    def close(self):
+        self.slot.release()
+
+    def __del__(self):
+        # Cancelled before the first chunk was pulled
+        self.slot.release()
+
+
+def _sse(event):
+    return f"event: status\ndata: {json.dumps(event)}\n\n"
+
+
+def _stream_settings():
+    heartbeat = getattr(settings, 'PAYMENT_EVENTS_HEARTBEAT', 15)
+    max_age = getattr(settings, 'PAYMENT_EVENTS_MAX_AGE', 300)
+    # Ask EventSource to reconnect promptly once a stream reaches max_age
+    return heartbeat, time.monotonic() + max_age, f"retry: {heartbeat * 1000}\n\n"
+
+
+async def aevent_stream(channels, snapshot=None, until=None):
+    """Server-Sent Events for ``channels``, read from the event loop.
+
+    ``snapshot`` is called after subscribing so a change landing between the
+    page load and the subscription isn't missed; the stream ends once
+    ``until(event)`` is true, after PAYMENT_EVENTS_MAX_AGE, or on disconnect.
+    """
+    heartbeat, deadline, retry = _stream_settings()
+    subscription = await get_broker().asubscribe(channels)
+    try:
+        yield retry
+        events = await sync_to_async(snapshot)() if snapshot else []
+        while True:
+            for event in events:
+                yield _sse(event)
+                if until and until(event):
+                    return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            event = await subscription.get(min(heartbeat, remaining))
+            if event is None:
+                yield ': keep-alive\n\n'
+            events = [event] if event else []
+    finally:
+        await subscription.close()
@@ -0,0 +1,127 @@
+import csv
+import json
+import zlib
+from datetime import datetime, time, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Order, PaymentLog
+
+# kind -> (model, exported columns); 'order__order_id' puts the public id on each log row
+EXPORTS = {
+    'orders': (Order, (
+        'id', 'order_id', 'name', 'email', 'phone', 'total_price', 'paid_amount', 'currency', 'is_paid',
+        'status', 'payment_method', 'transaction_id', 'created_at', 'updated_at',
+    )),
+    'payment-logs': (PaymentLog, (
+        'id', 'order__order_id', 'payment_method', 'transaction_id', 'amount', 'currency', 'status',
+        'gateway_fee', 'net_amount', 'gateway_response', 'created_at',
+    )),
+}
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+# Rows are sent in pieces of about this many bytes rather than one write per row
+CHUNK_BYTES = 64 * 1024
+
+
+class ExportError(ValueError):
+    """Invalid export parameters"""
+
+
+def _day_start(value, name):
+    day = parse_date(value) if isinstance(value, str) else value
+    if day is None:
+        raise ExportError(f"{name} must be a date (YYYY-MM-DD)")
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def export_queryset(kind, start=None, end=None, gateway=None, status=None):
+    """Rows of ``kind`` created between the ``start`` and ``end`` dates (inclusive), oldest first"""
+    if kind not in EXPORTS:
+        raise ExportError(f"Unknown export '{kind}', expected one of: {', '.join(EXPORTS)}")
+    model, columns = EXPORTS[kind]
+
+    queryset = model.objects.all()
+    if start:
+        queryset = queryset.filter(created_at__gte=_day_start(start, 'start'))
+    if end:
+        # Bounded by the next midnight so the created_at index is usable
+        queryset = queryset.filter(created_at__lt=_day_start(end, 'end') + timedelta(days=1))
+    if gateway:
+        queryset = queryset.filter(payment_method=gateway)
+    if status:
+        queryset = queryset.filter(status=status)
+    return queryset.order_by('created_at', 'id').values_list(*columns), columns
+
+
+class _Echo:
+    """File-like object whose write() hands back the line csv.writer produced"""
+
+    def write(self, value):
+        return value
+
+
+def _lines(rows, columns, fmt):
+    names = ['order_id' if name == 'order__order_id' else name for name in columns]
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(names)
+        for row in rows:
+            yield writer.writerow([
+                json.dumps(value) if isinstance(value, (dict, list)) else value for value in row
+            ])
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(names, row)), default=str) + '\n'
+
+
+def _chunked(lines):
+    buffer, size = [], 0
+    first = True
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        # The first line goes out alone so the client sees bytes before the query finishes
+        if first or size >= CHUNK_BYTES:
+            yield ''.join(buffer).encode()
+            buffer, size = [], 0
+            first = False
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # gzip container
+    first = True
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if first:
+            # Push the header out now instead of waiting for zlib's internal buffer to fill
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            first = False
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(queryset, columns, fmt='csv', gzip=False):
+    """Encoded export chunks, read through a server-side cursor so memory stays flat"""
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown format '{fmt}', expected one of: {', '.join(FORMATS)}")
+    rows = queryset.iterator(chunk_size=getattr(settings, 'EXPORT_CHUNK_SIZE', 2000))
+    chunks = _chunked(_lines(rows, columns, fmt))
+    return _gzipped(chunks) if gzip else chunks
+
+
+async def astream_export(chunks):
+    """Serve a sync export iterator under ASGI without buffering it.
+
+    Each chunk is pulled on the thread-sensitive executor, so the cursor
+    stays on the thread (and connection) that opened it.
+    """
+    pull = sync_to_async(lambda: next(chunks, None), thread_sensitive=True)
+    while (chunk := await pull()) is not None:
+        yield chunk
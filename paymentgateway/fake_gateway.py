@@ -0,0 +1,155 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeGatewayServer:
+    """Local stand-in for the Khalti initiate/lookup and eSewa status endpoints.
+
+    Every response is delayed by ``latency`` seconds plus up to ``jitter``
+    seconds, and a fraction ``error_rate`` of requests fail with a 503.
+    Initiated Khalti payments are remembered so a lookup reports them
+    ``Completed`` with the initiated amount and the same transaction id
+    every time, unless the entry in ``payments`` carries another ``status``. eSewa transactions are
+    ``COMPLETE`` unless ``payments`` has an entry for their uuid.
+    """
+
+    KHALTI_INITIATE_PATH = '/khalti/epayment/initiate/'
+    KHALTI_LOOKUP_PATH = '/khalti/epayment/lookup/'
+    ESEWA_VERIFY_PATH = '/esewa/epay/transaction/status/'
+    ESEWA_PAYMENT_PATH = '/esewa/epay/main'
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.payments = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def settings(self):
+        """Gateway settings pointing the app at this server"""
+        return {
+            'KHALTI_PAYMENT_URL': self.url + self.KHALTI_INITIATE_PATH,
+            'KHALTI_VERIFY_URL': self.url + self.KHALTI_LOOKUP_PATH,
+            'ESEWA_PAYMENT_URL': self.url + self.ESEWA_PAYMENT_PATH,
+            'ESEWA_VERIFY_URL': self.url + self.ESEWA_VERIFY_PATH,
+            'PAYMENT_GATEWAY_MODE': 'production',  # eSewa only calls its verify API in production mode
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @staticmethod
+    def pidx_for(purchase_order_id):
+        return f'pidx-{purchase_order_id}'
+
+    @staticmethod
+    def transaction_id_for(pidx):
+        return f'txn-{hashlib.sha1(pidx.encode()).hexdigest()[:12]}'
+
+    def _delay(self):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        return random.random() < self.error_rate
+
+    def _khalti_initiate(self, body):
+        data = json.loads(body or b'{}')
+        pidx = self.pidx_for(data.get('purchase_order_id'))
+        data['transaction_id'] = self.transaction_id_for(pidx)
+        with self._lock:
+            self.payments[pidx] = data
+        return 200, {
+            'pidx': pidx,
+            'payment_url': f'{self.url}/khalti/pay/?pidx={pidx}',
+            'expires_in': 1800,
+        }
+
+    def _esewa_status(self, query):
+        fields = {name: values[0] for name, values in query.items()}
+        if not fields.get('transaction_uuid'):
+            return 400, {'code': 0, 'error_message': 'transaction_uuid is required'}
+        with self._lock:
+            payment = self.payments.get(fields['transaction_uuid'], {})
+        return 200, {
+            'product_code': fields.get('product_code'),
+            'transaction_uuid': fields['transaction_uuid'],
+            'total_amount': fields.get('total_amount'),
+            'status': payment.get('status', 'COMPLETE'),
+            'ref_id': payment.get('ref_id'),
+        }
+
+    def _khalti_lookup(self, body):
+        pidx = json.loads(body or b'{}').get('pidx')
+        with self._lock:
+            payment = self.payments.get(pidx)
+        if payment is None:
+            return 404, {'detail': 'Not found.', 'error_key': 'validation_error'}
+        return 200, {
+            'pidx': pidx,
+            'total_amount': payment.get('amount'),
+            'status': payment.get('status', 'Completed'),
+            'transaction_id': payment.get('transaction_id') or self.transaction_id_for(pidx),
+            'fee': 0,
+            'refunded': False,
+        }
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if server._delay():
+                    return self._send(503, {'detail': 'Service temporarily unavailable'})
+                if self.path == server.KHALTI_INITIATE_PATH:
+                    return self._send(*server._khalti_initiate(body))
+                if self.path == server.KHALTI_LOOKUP_PATH:
+                    return self._send(*server._khalti_lookup(body))
+                return self._send(404, {'detail': 'Not found.'})
+
+            def do_GET(self):
+                if server._delay():
+                    return self._send(503, {'detail': 'Service temporarily unavailable'})
+                url = urlsplit(self.path)
+                if url.path == server.ESEWA_VERIFY_PATH:
+                    return self._send(*server._esewa_status(parse_qs(url.query)))
+                return self._send(404, {'detail': 'Not found.'})
+
+            def _send(self, status, payload, content_type='application/json'):
+                body = payload if isinstance(payload, str) else json.dumps(payload)
+                body = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Keep benchmark output readable
+
+        return Handler
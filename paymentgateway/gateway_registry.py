@@ -0,0 +1,55 @@
+import threading
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .async_gateways import AsyncEsewaPaymentGateway, AsyncKhaltiPaymentGateway
+from .payment_gateways import EsewaPaymentGateway, KhaltiPaymentGateway
+
+# method -> (sync class, async class)
+_gateway_classes = {}
+# (method, is_async) -> instance
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def register_gateway(gateway_class, async_class=None):
+    """Make a PaymentGateway subclass available at checkout under its ``method``"""
+    _gateway_classes[gateway_class.method] = (gateway_class, async_class or gateway_class)
+    reset_gateways()
+
+
+def gateway_methods():
+    return list(_gateway_classes)
+
+
+def get_gateway(method, asynchronous=False):
+    """Shared gateway instance for ``method``, built on first use; ``None`` if unknown"""
+    key = (method, asynchronous)
+    gateway = _instances.get(key)
+    if gateway is None:
+        classes = _gateway_classes.get(method)
+        if classes is None:
+            return None
+        with _instances_lock:
+            gateway = _instances.get(key)
+            if gateway is None:
+                gateway = _instances[key] = classes[asynchronous]()
+    return gateway
+
+
+def reset_gateways():
+    """Drop built instances so the next lookup reads current settings"""
+    with _instances_lock:
+        _instances.clear()
+
+
+@receiver(setting_changed)
+def reset_on_setting_change(setting=None, **kwargs):
+    """Rebuild gateways when their settings change (e.g. under override_settings)"""
+    if setting is None or setting.startswith(('KHALTI_', 'ESEWA_', 'PAYMENT_')):
+        reset_gateways()
+
+
+register_gateway(EsewaPaymentGateway, AsyncEsewaPaymentGateway)
+register_gateway(KhaltiPaymentGateway, AsyncKhaltiPaymentGateway)
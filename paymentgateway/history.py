@@ -0,0 +1,44 @@
+from django.db.models import Prefetch
+
+from .archive import archived_logs_for
+from .models import PaymentLog
+
+# PaymentLog columns shown in payment history; gateway_response is only loaded on request
+HISTORY_FIELDS = ('id', 'order', 'payment_method', 'transaction_id', 'amount', 'currency', 'status', 'created_at')
+
+
+def with_payment_history(queryset, gateway_response=False):
+    """Orders with their payment logs prefetched, newest first.
+
+    All logs for the page come back in one extra query however many orders
+    it holds, so ``order.payment_logs.all`` in a template or loop is free.
+    """
+    fields = HISTORY_FIELDS + (('gateway_response',) if gateway_response else ())
+    logs = PaymentLog.objects.only(*fields).order_by('-created_at', '-id')
+    return queryset.prefetch_related(Prefetch('payment_logs', queryset=logs))
+
+
+def log_summary(log, gateway_response=False):
+    data = {
+        'id': log.id,
+        'payment_method': log.payment_method,
+        'transaction_id': log.transaction_id,
+        'amount': log.amount,
+        'currency': log.currency,
+        'status': log.status,
+        'created_at': log.created_at.isoformat(),
+    }
+    if gateway_response:
+        data['gateway_response'] = log.gateway_response
+    return data
+
+
+def payment_history(order, gateway_response=False, archived=False):
+    """Serialized logs of an order loaded through ``with_payment_history``"""
+    history = [log_summary(log, gateway_response) for log in order.payment_logs.all()]
+    if archived:
+        # Logs past the retention period; read from the archive table or files
+        history.extend(
+            dict(log_summary(log, gateway_response), archived=True) for log in archived_logs_for(order)
+        )
+    return history
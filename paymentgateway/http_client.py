@@ -0,0 +1,255 @@
+import asyncio
+import threading
+import time
+import logging
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from .circuit_breaker import get_breaker
+from .metrics import observe_gateway_request, status_outcome
+
+logger = logging.getLogger(__name__)
+
+
+class _BaseGatewayClient:
+    """Settings and request counters shared by the sync and async clients"""
+
+    RETRY_STATUS_CODES = (502, 503, 504)
+
+    def __init__(self):
+        self.pool_size = getattr(settings, 'GATEWAY_HTTP_POOL_SIZE', 10)
+        self.pool_hosts = getattr(settings, 'GATEWAY_HTTP_POOL_HOSTS', 10)
+        self.connect_timeout = getattr(settings, 'GATEWAY_HTTP_CONNECT_TIMEOUT', 3.05)
+        self.read_timeout = getattr(settings, 'GATEWAY_HTTP_READ_TIMEOUT', 10)
+        self.max_retries = getattr(settings, 'GATEWAY_HTTP_MAX_RETRIES', 2)
+        self.backoff_factor = getattr(settings, 'GATEWAY_HTTP_BACKOFF_FACTOR', 0.3)
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def _count(self, host, name):
+        with self._lock:
+            counters = self._counters.setdefault(host, {'requests': 0, 'retries': 0, 'errors': 0})
+            counters[name] += 1
+
+    def _backoff(self, attempt):
+        return self.backoff_factor * (2 ** attempt)
+
+    def _read_timeout(self, breaker, probe):
+        # A half-open probe gets the full timeout so a slow-but-recovered gateway can pass
+        return self.read_timeout if probe else breaker.read_timeout(self.read_timeout)
+
+    def get_stats(self):
+        with self._lock:
+            return {host: dict(counters) for host, counters in self._counters.items()}
+
+
+class GatewayHTTPClient(_BaseGatewayClient):
+    """Process-wide HTTP client with keep-alive connection pools per gateway host"""
+
+    def __init__(self):
+        super().__init__()
+        # A single adapter owns the urllib3 pool manager (one pool per host),
+        # so every thread's session draws from the same warm connections.
+        self.adapter = HTTPAdapter(
+            pool_connections=self.pool_hosts,
+            pool_maxsize=self.pool_size,
+            max_retries=0,
+        )
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        """Per-thread session sharing the process-wide connection pools"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', self.adapter)
+            session.mount('http://', self.adapter)
+            self._local.session = session
+        return session
+
+    def post(self, url, idempotent=False, **kwargs):
+        """POST to a gateway endpoint, retrying with backoff when idempotent"""
+        return self.request('POST', url, idempotent=idempotent, **kwargs)
+
+    def get(self, url, idempotent=True, **kwargs):
+        """GET a gateway endpoint, retrying with backoff by default"""
+        return self.request('GET', url, idempotent=idempotent, **kwargs)
+
+    def request(self, method, url, idempotent=False, timeout=None, **kwargs):
+        host = urlsplit(url).netloc
+        breaker = get_breaker(url)
+        attempts = 1 + (self.max_retries if idempotent else 0)
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            probe = breaker.before_call()
+            self._count(host, 'requests')
+            start = time.perf_counter()
+            try:
+                response = self.session.request(
+                    method, url, timeout=timeout or (self.connect_timeout, self._read_timeout(breaker, probe)), **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                elapsed = time.perf_counter() - start
+                breaker.record(elapsed, failed=True, probe=probe)
+                observe_gateway_request(method, url, elapsed, 'error')
+                self._count(host, 'errors')
+                if last_attempt:
+                    raise
+                logger.warning("Gateway request to %s failed (%s), retrying", host, e, extra={'gateway_host': host})
+            else:
+                elapsed = time.perf_counter() - start
+                breaker.record(elapsed, failed=response.status_code >= 500, probe=probe)
+                observe_gateway_request(method, url, elapsed, status_outcome(response.status_code))
+                logger.debug(
+                    "%s %s returned %s in %.1fms", method, url, response.status_code, elapsed * 1000,
+                    extra={'gateway_host': host, 'status_code': response.status_code, 'latency_ms': round(elapsed * 1000, 1)},
+                )
+                if response.status_code not in self.RETRY_STATUS_CODES or last_attempt:
+                    return response
+                logger.warning(
+                    "Gateway to %s returned %s, retrying", host, response.status_code,
+                    extra={'gateway_host': host, 'status_code': response.status_code},
+                )
+
+            self._count(host, 'retries')
+            time.sleep(self._backoff(attempt))
+
+    def get_stats(self):
+        """Snapshot of request counters and connection pool hits/misses per host"""
+        stats = super().get_stats()
+
+        poolmanager = self.adapter.poolmanager
+        for key in poolmanager.pools.keys():
+            pool = poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+            entry = stats.setdefault(host, {'requests': 0, 'retries': 0, 'errors': 0})
+            # Each new connection is a pool miss; every other request reused a kept-alive one.
+            entry['pool_misses'] = entry.get('pool_misses', 0) + pool.num_connections
+            entry['pool_hits'] = entry.get('pool_hits', 0) + max(pool.num_requests - pool.num_connections, 0)
+        return stats
+
+    def close(self):
+        self.adapter.close()
+
+
+class AsyncGatewayHTTPClient(_BaseGatewayClient):
+    """Non-blocking gateway client for async views, bound to one event loop"""
+
+    def __init__(self):
+        super().__init__()
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self.pool_size * self.pool_hosts,
+                max_keepalive_connections=self.pool_size,
+            ),
+        )
+
+    async def post(self, url, idempotent=False, **kwargs):
+        return await self.request('POST', url, idempotent=idempotent, **kwargs)
+
+    async def get(self, url, idempotent=True, **kwargs):
+        return await self.request('GET', url, idempotent=idempotent, **kwargs)
+
+    async def request(self, method, url, idempotent=False, timeout=None, **kwargs):
+        host = urlsplit(url).netloc
+        breaker = get_breaker(url)
+        attempts = 1 + (self.max_retries if idempotent else 0)
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            probe = await breaker.abefore_call()
+            self._count(host, 'requests')
+            start = time.perf_counter()
+            try:
+                response = await self.client.request(
+                    method, url,
+                    timeout=timeout or httpx.Timeout(self._read_timeout(breaker, probe), connect=self.connect_timeout),
+                    **kwargs
+                )
+            except httpx.TransportError as e:
+                elapsed = time.perf_counter() - start
+                await breaker.arecord(elapsed, failed=True, probe=probe)
+                observe_gateway_request(method, url, elapsed, 'error')
+                self._count(host, 'errors')
+                if last_attempt:
+                    raise
+                logger.warning("Async gateway request to %s failed (%s), retrying", host, e, extra={'gateway_host': host})
+            else:
+                elapsed = time.perf_counter() - start
+                await breaker.arecord(elapsed, failed=response.status_code >= 500, probe=probe)
+                observe_gateway_request(method, url, elapsed, status_outcome(response.status_code))
+                logger.debug(
+                    "%s %s returned %s in %.1fms", method, url, response.status_code, elapsed * 1000,
+                    extra={'gateway_host': host, 'status_code': response.status_code, 'latency_ms': round(elapsed * 1000, 1)},
+                )
+                if response.status_code not in self.RETRY_STATUS_CODES or last_attempt:
+                    return response
+                logger.warning(
+                    "Async gateway to %s returned %s, retrying", host, response.status_code,
+                    extra={'gateway_host': host, 'status_code': response.status_code},
+                )
+
+            self._count(host, 'retries')
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_http_client():
+    """Return the process-wide gateway HTTP client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GatewayHTTPClient()
+    return _client
+
+
+def reset_http_client():
+    """Drop the shared client so the next call picks up current settings"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+
+
+async def _close_with_loop(client):
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+def get_async_http_client():
+    """Return the async gateway client for the running event loop.
+
+    The client is closed when its loop shuts down: ``asyncio.run`` (which
+    ASGI servers and ``async_to_sync`` use) finalizes live async generators
+    while the loop can still run them, so a started ``_close_with_loop``
+    awaits ``aclose()`` there.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncGatewayHTTPClient()
+        # The loop only holds weak references to both
+        client._closer = _close_with_loop(client)
+        client._closer_started = loop.create_task(anext(client._closer))
+    return client
@@ -0,0 +1,104 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from .metrics import LOG_RECORDS_DROPPED
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, including any ``extra`` fields such as order_id or latency_ms"""
+
+    def format(self, record):
+        entry = {
+            'timestamp': self.formatTime(record, '%Y-%m-%dT%H:%M:%S%z'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.thread,
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class QueueLogHandler(QueueHandler):
+    """Hand records to a background thread that formats and writes them.
+
+    The request thread only does a non-blocking put on a bounded queue; a
+    ``QueueListener`` writes to a size-rotated file (and optionally the
+    console). When the queue is full the record is dropped and counted
+    rather than stalling the caller.
+    """
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, backup_count=5, json_format=True,
+                 console=False, queue_size=10000):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.queue_size = queue_size
+        text = logging.Formatter('{levelname} {asctime} {module} {process:d} {thread:d} {message}', style='{')
+        file_handler = RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        file_handler.setFormatter(JSONFormatter() if json_format else text)
+        self.targets = [file_handler]
+        if console:
+            console_handler = logging.StreamHandler(sys.stderr)
+            console_handler.setFormatter(text)
+            self.targets.append(console_handler)
+
+        self.dropped = 0
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.listener = None
+        atexit.register(self.stop)
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # The listener thread doesn't survive a fork, and the parent's queue
+                # may have been copied mid-put; each worker starts afresh
+                if self._pid is not None:
+                    self.queue = queue.Queue(maxsize=self.queue_size)
+                self.listener = QueueListener(self.queue, *self.targets, respect_handler_level=True)
+                self.listener.start()
+                self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Resolve args and the traceback now, while they're still valid, but
+        # leave formatting to the listener and keep the exception separate
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+    def stop(self):
+        """Flush queued records and stop the listener"""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+            self._pid = None
+        for target in self.targets:
+            target.flush()
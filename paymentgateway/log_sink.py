@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import uuid
+import threading
+import logging
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import PaymentLog
+from .metrics import PAYMENT_LOG_ENTRIES, PAYMENT_LOG_WRITE_SECONDS
+from .signals import payment_logs_written
+
+logger = logging.getLogger(__name__)
+
+# PaymentLog columns carried through the buffer and write-ahead file
+ENTRY_FIELDS = (
+    'order_id', 'payment_method', 'transaction_id', 'amount', 'status',
+    'gateway_response', 'currency', 'ip_address', 'user_agent', 'gateway_fee', 'net_amount',
+)
+
+
+class PaymentLogSink:
+    """Collects PaymentLog entries and writes them in batches.
+
+    In ``sync`` mode every entry is inserted immediately. In ``buffered``
+    mode entries are appended to a per-process write-ahead file and held
+    in memory until the batch size or flush interval is reached, then
+    written with a single ``bulk_create``. Write-ahead files left behind
+    by a crashed process are picked up and replayed by the next sink, so
+    entries are delivered at least once.
+    """
+
+    def __init__(self):
+        self.mode = getattr(settings, 'PAYMENT_LOG_MODE', 'sync')
+        self.batch_size = getattr(settings, 'PAYMENT_LOG_BATCH_SIZE', 100)
+        self.flush_interval = getattr(settings, 'PAYMENT_LOG_FLUSH_INTERVAL', 5)
+        self.wal_dir = Path(getattr(settings, 'PAYMENT_LOG_WAL_DIR', 'payment_log_wal'))
+        self._lock = threading.RLock()
+        self._pid = None
+        self._buffer = []
+        self._oldest = None
+        self._wal = None
+
+    @property
+    def buffered(self):
+        return self.mode == 'buffered'
+
+    def record(self, order=None, reason='', **fields):
+        """Record a PaymentLog entry; returns the saved row in sync mode
+
+        ``reason`` is a short, fixed label for why a payment failed; it is
+        only used for metrics.
+        """
+        if order is not None:
+            fields['order_id'] = order.pk
+        PAYMENT_LOG_ENTRIES.labels(
+            gateway=fields.get('payment_method', ''), status=fields.get('status', ''), reason=reason,
+        ).inc()
+        if not self.buffered:
+            with PAYMENT_LOG_WRITE_SECONDS.labels(mode='sync').time(), transaction.atomic():
+                log = PaymentLog.objects.create(**fields)
+                payment_logs_written.send(sender=PaymentLog, entries=[log])
+            return log
+
+        entry = {name: fields[name] for name in ENTRY_FIELDS if name in fields}
+        entry['created_at'] = timezone.now().isoformat()
+
+        if transaction.get_connection().in_atomic_block:
+            # Like a sync-mode row, the entry only exists if the caller's transaction commits
+            transaction.on_commit(lambda: self._append(entry))
+        else:
+            self._append(entry)
+        return None
+
+    def _append(self, entry):
+        with self._lock:
+            self._ensure_process()
+            self._wal.write(json.dumps(entry, default=str) + '\n')
+            self._wal.flush()
+            self._buffer.append(entry)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            due = self._is_due()
+
+        if due:
+            try:
+                self.flush()
+            except Exception:
+                # Logged by flush(); the entries stay buffered and in the WAL for the next one
+                pass
+
+    def has_success_pending(self):
+        with self._lock:
+            return any(entry.get('status') == 'Success' for entry in self._buffer)
+
+    def _is_due(self):
+        return bool(self._buffer) and (
+            len(self._buffer) >= self.batch_size
+            or time.monotonic() - self._oldest >= self.flush_interval
+        )
+
+    def flush_if_due(self):
+        with self._lock:
+            due = self._is_due()
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered entries with one bulk insert and reset the WAL"""
+        with self._lock:
+            if not self._buffer:
+                return 0
+            entries = self._buffer
+            rows = [self._to_model(entry) for entry in entries]
+            try:
+                with PAYMENT_LOG_WRITE_SECONDS.labels(mode='bulk').time(), transaction.atomic():
+                    PaymentLog.objects.bulk_create(rows, batch_size=self.batch_size)
+                    payment_logs_written.send(sender=PaymentLog, entries=rows)
+            except Exception as e:
+                # Keep the entries (and their WAL lines) for the next attempt
+                logger.error("PaymentLog flush of %d entries failed: %s", len(rows), e)
+                raise
+
+            self._buffer = []
+            self._oldest = None
+            if self._wal is not None:
+                self._wal.seek(0)
+                self._wal.truncate()
+            return len(rows)
+
+    def _to_model(self, entry):
+        values = {name: entry[name] for name in ENTRY_FIELDS if name in entry}
+        values['created_at'] = parse_datetime(entry['created_at'])
+        return PaymentLog(**values)
+
+    def _ensure_process(self):
+        """Open this process's WAL, replaying any left by dead processes"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        # Forked workers must not share the parent's buffer or file handle
+        self._pid = pid
+        self._buffer = []
+        self._oldest = None
+        self.wal_dir.mkdir(parents=True, exist_ok=True)
+        # Unique per process start: a restarted worker often gets the crashed one's pid
+        self._wal = open(self.wal_dir / f'{pid}-{uuid.uuid4().hex}.wal', 'a+', encoding='utf-8')
+        self._buffer.extend(self._recover_orphans())
+        if self._buffer:
+            self._oldest = time.monotonic()
+
+    def _recover_orphans(self):
+        recovered = []
+        for path in self.wal_dir.glob('*.wal'):
+            try:
+                owner = int(path.stem.split('-', 1)[0])
+            except ValueError:
+                continue
+            if path.name == Path(self._wal.name).name:
+                continue
+            # Another file under our own pid was left by an earlier process with that pid
+            if owner != self._pid and _pid_alive(owner):
+                continue
+
+            claimed = path.with_suffix(f'.claimed-{self._pid}')
+            try:
+                path.rename(claimed)
+            except FileNotFoundError:
+                continue  # Another process claimed it first
+
+            with open(claimed, encoding='utf-8') as f:
+                lines = [line for line in f if line.strip()]
+            for line in lines:
+                self._wal.write(line if line.endswith('\n') else line + '\n')
+                recovered.append(json.loads(line))
+            self._wal.flush()
+            claimed.unlink()
+
+        if recovered:
+            logger.warning("Recovered %d unflushed PaymentLog entries from crashed workers", len(recovered))
+        return recovered
+
+    def recover(self):
+        """Replay orphaned write-ahead files and flush everything buffered"""
+        if not self.buffered:
+            return 0
+        with self._lock:
+            if self._pid == os.getpid():
+                self._buffer.extend(self._recover_orphans())
+            else:
+                self._ensure_process()
+        return self.flush()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_payment_log_sink():
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                _sink = PaymentLogSink()
+    return _sink
+
+
+def record_payment_log(**fields):
+    """Record a PaymentLog entry through the process-wide sink"""
+    return get_payment_log_sink().record(**fields)
+
+
+async def arecord_payment_log(**fields):
+    return await sync_to_async(record_payment_log)(**fields)
+
+
+def flush_payment_logs():
+    return get_payment_log_sink().flush()
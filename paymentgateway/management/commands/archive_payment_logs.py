@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from paymentgateway.archive import archive_payment_logs, archived_logs_for
+from paymentgateway.models import Order
+
+
+class Command(BaseCommand):
+    help = "Move old payment logs into the archive, or show one order's archived logs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, help="Archive logs older than this many days")
+        parser.add_argument('--batch-size', type=int, help="Logs moved per transaction")
+        parser.add_argument('--backend', choices=['table', 'files'], help="Where to archive (default: setting)")
+        parser.add_argument('--show', metavar='ORDER_ID', help="Print an order's archived logs as JSONL instead")
+
+    def handle(self, *args, **options):
+        if options['show']:
+            order = Order.objects.filter(order_id=options['show']).first()
+            if order is None:
+                raise CommandError(f"Order {options['show']} not found")
+            for log in archived_logs_for(order):
+                self.stdout.write(json.dumps({
+                    'id': log.id, 'payment_method': log.payment_method, 'transaction_id': log.transaction_id,
+                    'amount': log.amount, 'status': log.status, 'created_at': log.created_at.isoformat(),
+                    'gateway_response': log.gateway_response,
+                }, default=str))
+            return
+
+        moved = archive_payment_logs(
+            older_than_days=options['older_than'], batch_size=options['batch_size'], backend=options['backend'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} payment logs"))
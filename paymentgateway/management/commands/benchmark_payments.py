@@ -0,0 +1,212 @@
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment,
+)
+from django.urls import reverse
+
+from core.celery import app as celery_app
+from paymentgateway.fake_gateway import FakeGatewayServer
+from paymentgateway.gateway_registry import get_gateway
+from paymentgateway.http_client import get_http_client, reset_http_client
+from paymentgateway.models import Order
+
+ORDER_PRICE = 1000
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def _settled(response):
+    return response.status_code == 302 and response['Location'] != reverse('order_list')
+
+
+def _esewa_callback(order):
+    """Query string of a signed eSewa v2 success redirect for ``order``"""
+    esewa = get_gateway('esewa')
+    data = {
+        'transaction_code': f'ref-{order.order_id}', 'status': 'COMPLETE', 'total_amount': f'{ORDER_PRICE}.0',
+        'transaction_uuid': esewa.transaction_uuid(order), 'product_code': esewa.scd,
+        'signed_field_names': 'transaction_code,status,total_amount,transaction_uuid,product_code,signed_field_names',
+    }
+    data['signature'] = esewa.sign(data, data['signed_field_names'].split(','))
+    return {'data': base64.b64encode(json.dumps(data).encode()).decode()}
+
+
+# name -> (request, success check); each request gets its own fresh order
+SCENARIOS = {
+    'checkout_khalti': (
+        lambda client, order, gateway: client.post(
+            reverse('order_checkout', args=[order.id]), {'payment_method': 'khalti'}
+        ),
+        lambda response: response.status_code == 302 and 'pidx=' in response['Location'],
+    ),
+    'checkout_esewa': (
+        lambda client, order, gateway: client.post(
+            reverse('order_checkout', args=[order.id]), {'payment_method': 'esewa'}
+        ),
+        lambda response: response.status_code == 200,
+    ),
+    'khalti_success': (
+        lambda client, order, gateway: client.get(reverse('khalti_success'), {
+            'pidx': gateway.pidx_for(order.order_id),
+            'purchase_order_id': order.order_id,
+            'status': 'Pending',  # Force the lookup instead of trusting the redirect
+        }),
+        _settled,
+    ),
+    'esewa_success': (
+        lambda client, order, gateway: client.get(reverse('esewa_success'), _esewa_callback(order)),
+        _settled,
+    ),
+    'payment_status': (
+        lambda client, order, gateway: client.get(reverse('payment_status', args=[order.id])),
+        lambda response: response.status_code == 200,
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark checkout, gateway callbacks and status polling against a local fake "
+        "Khalti/eSewa server, using a throwaway test database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint")
+        parser.add_argument('--concurrency', type=int, default=10, help="Concurrent clients")
+        parser.add_argument('--latency', type=float, default=50, help="Fake gateway latency in ms")
+        parser.add_argument('--jitter', type=float, default=20, help="Extra random gateway latency, up to this many ms")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of gateway calls answered with 503")
+        parser.add_argument(
+            '--endpoints', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS),
+            help="Endpoints to benchmark (default: all)",
+        )
+        parser.add_argument(
+            '--queued', action='store_true',
+            help="Verify callbacks through the (eager) task queue instead of inline",
+        )
+        parser.add_argument('--json', action='store_true', help="Print results as JSON")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--requests and --concurrency must be at least 1")
+
+        setup_test_environment()
+        tmpdir = tempfile.TemporaryDirectory()
+        if connection.vendor == 'sqlite':
+            # Worker threads need a shared on-disk database, not per-connection memory,
+            # and writers that queue for the lock instead of failing with "database is locked"
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmpdir.name, 'benchmark.sqlite3')
+            connection.settings_dict['OPTIONS'].update(transaction_mode='IMMEDIATE', timeout=30)
+        old_config = setup_databases(verbosity=0, interactive=False)
+
+        gateway = FakeGatewayServer(
+            latency=options['latency'] / 1000, jitter=options['jitter'] / 1000, error_rate=options['error_rate'],
+        )
+        eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        try:
+            with gateway, override_settings(
+                **gateway.settings(),
+                PAYMENT_QUEUE_VERIFICATION=options['queued'],
+                GATEWAY_HTTP_MAX_RETRIES=0,  # Report gateway errors instead of hiding them in retries
+                RATE_LIMIT_ENABLED=False,  # Every benchmark client shares one address
+            ):
+                reset_http_client()
+                results = [
+                    self.run_endpoint(name, gateway, options['requests'], options['concurrency'])
+                    for name in options['endpoints']
+                ]
+                http_stats = get_http_client().get_stats()
+        finally:
+            celery_app.conf.task_always_eager = eager
+            reset_http_client()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            tmpdir.cleanup()
+
+        if options['json']:
+            self.stdout.write(json.dumps({'endpoints': results, 'gateway_http': http_stats}, indent=2))
+        else:
+            self.print_table(results)
+
+    def prepare_orders(self, name, gateway, count):
+        orders = [Order.objects.create(name=f'Benchmark {name} {i}', total_price=ORDER_PRICE) for i in range(count)]
+        if name == 'khalti_success':
+            # Pretend each payment was initiated so the lookup reports it completed
+            for order in orders:
+                gateway.payments[gateway.pidx_for(order.order_id)] = {
+                    'amount': order.total_price * 100, 'purchase_order_id': order.order_id,
+                }
+        return orders
+
+    def run_endpoint(self, name, gateway, requests, concurrency):
+        orders = self.prepare_orders(name, gateway, requests)
+        send, succeeded = SCENARIOS[name]
+        local = threading.local()
+
+        def one(order):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                try:
+                    ok = succeeded(send(client, order, gateway))
+                except Exception:
+                    ok = False
+                elapsed = time.perf_counter() - start
+            return elapsed, ok, len(queries)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            started = time.perf_counter()
+            samples = list(executor.map(one, orders))
+            wall = time.perf_counter() - started
+            self.close_worker_connections(executor, concurrency)
+
+        latencies = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+        return {
+            'endpoint': name,
+            'requests': len(samples),
+            'errors': sum(1 for _, ok, _ in samples if not ok),
+            'throughput': round(len(samples) / wall, 1) if wall else 0.0,
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'queries_per_request': round(sum(count for _, _, count in samples) / len(samples), 1),
+        }
+
+    def close_worker_connections(self, executor, concurrency):
+        """Close each worker thread's DB connections so the test database can be dropped"""
+        barrier = threading.Barrier(concurrency)
+
+        def close():
+            connections.close_all()
+            barrier.wait()  # Hold this thread so every worker runs one close
+
+        list(executor.map(lambda _: close(), range(concurrency)))
+
+    def print_table(self, results):
+        header = f"{'endpoint':<16} {'reqs':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8}"
+        self.stdout.write(self.style.MIGRATE_HEADING(header))
+        for row in results:
+            self.stdout.write(
+                f"{row['endpoint']:<16} {row['requests']:>6} {row['errors']:>6} {row['throughput']:>8} "
+                f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9} {row['queries_per_request']:>8}"
+            )
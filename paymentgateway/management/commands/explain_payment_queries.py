@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from paymentgateway.models import Order, PaymentLog
+
+
+class Command(BaseCommand):
+    help = "Print the database query plans for the payment hot-path queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help="Execute the queries and report actual timings (PostgreSQL only)",
+        )
+
+    def key_queries(self):
+        """The lookups the callbacks, dashboard and admin run most often"""
+        since = timezone.now() - timedelta(days=30)
+        sample = PaymentLog.objects.values_list('transaction_id', flat=True).first() or 'TXN'
+        order = Order.objects.only('pk', 'order_id').first()
+        order_pk, order_id = (order.pk, order.order_id) if order else (0, 'ORDERID')
+
+        return [
+            ("Callback order lookup", Order.objects.filter(order_id=order_id)),
+            ("Orders by status, newest first",
+             Order.objects.filter(status='pending', created_at__gte=since).order_by('-created_at')),
+            ("Admin filter: paid by gateway",
+             Order.objects.filter(is_paid=True, payment_method='Khalti', created_at__gte=since)),
+            ("Unpaid orders (reconciliation)",
+             Order.objects.filter(is_paid=False, created_at__lt=since).order_by('created_at')),
+            ("Payment history for an order",
+             PaymentLog.objects.filter(order_id=order_pk).order_by('-created_at')),
+            ("Payment log by transaction", PaymentLog.objects.filter(transaction_id=sample)),
+            ("Logs by status and gateway, newest first",
+             PaymentLog.objects.filter(status='Success', payment_method='Khalti').order_by('-created_at')[:100]),
+        ]
+
+    def handle(self, *args, **options):
+        explain_options = {}
+        if options['analyze']:
+            if connection.vendor != 'postgresql':
+                self.stderr.write("--analyze is only supported on PostgreSQL; showing plans only.")
+            else:
+                explain_options = {'analyze': True, 'buffers': True}
+
+        for title, queryset in self.key_queries():
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write('')
@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from paymentgateway.db_routing import replica_reads
+from paymentgateway.export import EXPORTS, FORMATS, ExportError, export_queryset, stream_export
+
+
+class Command(BaseCommand):
+    help = "Stream orders or payment logs to CSV/JSONL without loading them into memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--start', help="First day to include (YYYY-MM-DD)")
+        parser.add_argument('--end', help="Last day to include (YYYY-MM-DD)")
+        parser.add_argument('--gateway', help="Only this payment method, e.g. Khalti or eSewa")
+        parser.add_argument('--status', help="Only rows with this status")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output")
+        parser.add_argument('--output', '-o', help="File to write (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            with replica_reads():
+                queryset, columns = export_queryset(
+                    options['kind'], start=options['start'], end=options['end'],
+                    gateway=options['gateway'], status=options['status'],
+                )
+                queryset = queryset.using(queryset.db)
+            chunks = stream_export(queryset, columns, fmt=options['format'], gzip=options['gzip'])
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from paymentgateway.log_sink import get_payment_log_sink
+
+
+class Command(BaseCommand):
+    help = "Replay PaymentLog write-ahead files left by stopped workers and flush them"
+
+    def handle(self, *args, **options):
+        sink = get_payment_log_sink()
+        if not sink.buffered:
+            self.stdout.write("PAYMENT_LOG_MODE is 'sync'; nothing is buffered.")
+            return
+
+        written = sink.recover()
+        self.stdout.write(self.style.SUCCESS(f"Flushed {written} PaymentLog entries"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from paymentgateway.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the order and payment log statistics from scratch"
+
+    def handle(self, *args, **options):
+        order_buckets, log_buckets = rebuild_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {order_buckets} order stat buckets and {log_buckets} payment log stat buckets"
+        ))
@@ -0,0 +1,49 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from paymentgateway.reconciliation import Reconciler
+
+
+class Command(BaseCommand):
+    help = (
+        "Look up unpaid orders with their gateway, settling completed payments and "
+        "cancelling ones that expired or can't be verified"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help="Concurrent gateway lookups")
+        parser.add_argument('--rate-limit', type=float, help="Maximum gateway lookups per second (0 for no limit)")
+        parser.add_argument('--chunk-size', type=int, help="Orders read and updated per batch")
+        parser.add_argument('--min-age', type=int, help="Skip orders younger than this many minutes")
+        parser.add_argument('--expire-after', type=int, help="Cancel unverifiable orders older than this many hours")
+        parser.add_argument(
+            '--checkpoint', default=getattr(settings, 'RECONCILE_CHECKPOINT_FILE', None),
+            help="File recording progress after each batch",
+        )
+        parser.add_argument('--resume', action='store_true', help="Continue an interrupted run from the checkpoint")
+        parser.add_argument('--dry-run', action='store_true', help="Look up orders without changing them")
+        parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] is not None and options['concurrency'] < 1:
+            raise CommandError("--concurrency must be at least 1")
+
+        reconciler = Reconciler(
+            concurrency=options['concurrency'],
+            rate_limit=options['rate_limit'],
+            chunk_size=options['chunk_size'],
+            min_age=options['min_age'] * 60 if options['min_age'] is not None else None,
+            expire_after=options['expire_after'] * 3600 if options['expire_after'] is not None else None,
+            checkpoint=options['checkpoint'],
+            dry_run=options['dry_run'],
+        )
+        summary = reconciler.run(resume=options['resume'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+        for result, count in sorted(summary.items()):
+            self.stdout.write(f"{result:<20} {count:>8}")
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {sum(summary.values())} orders"))
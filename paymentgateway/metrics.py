@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connections
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+# Gateway calls range from a few ms (kept-alive lookups) to the 10s read timeout
+GATEWAY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15)
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+GATEWAY_REQUEST_SECONDS = Histogram(
+    'payment_gateway_request_seconds', "Gateway HTTP request latency, per attempt",
+    ['gateway', 'method', 'endpoint', 'outcome'], buckets=GATEWAY_BUCKETS,
+)
+VIEW_SECONDS = Histogram(
+    'payment_view_seconds', "Request latency per view", ['view'], buckets=GATEWAY_BUCKETS,
+)
+VIEW_DB_SECONDS = Histogram(
+    'payment_view_db_seconds', "Time spent in database queries per request, per view", ['view'], buckets=DB_BUCKETS,
+)
+VIEW_DB_QUERIES = Histogram(
+    'payment_view_db_queries', "Database queries per request, per view", ['view'],
+    buckets=(1, 2, 5, 10, 20, 50, 100),
+)
+PAYMENT_LOG_WRITE_SECONDS = Histogram(
+    'payment_log_write_seconds', "Time to write PaymentLog entries", ['mode'], buckets=DB_BUCKETS,
+)
+PAYMENT_LOG_ENTRIES = Counter(
+    'payment_log_entries_total', "PaymentLog entries recorded", ['gateway', 'status', 'reason'],
+)
+LOG_RECORDS_DROPPED = Counter(
+    'payment_log_records_dropped_total', "Log records dropped because the logging queue was full",
+)
+CIRCUIT_STATE = Gauge(
+    'payment_gateway_circuit_state', "Circuit breaker state per gateway endpoint: 0 closed, 1 half-open, 2 open",
+    ['gateway', 'endpoint'], multiprocess_mode='livemax',
+)
+CIRCUIT_REJECTIONS = Counter(
+    'payment_gateway_circuit_rejections_total', "Gateway calls failed fast by an open circuit", ['gateway', 'endpoint'],
+)
+GATEWAY_READ_TIMEOUT = Gauge(
+    'payment_gateway_read_timeout_seconds', "Adaptive read timeout per gateway endpoint",
+    ['gateway', 'endpoint'], multiprocess_mode='livemax',
+)
+RECONCILED_ORDERS = Counter(
+    'payment_reconciled_orders_total', "Pending orders checked by reconciliation, by result", ['gateway', 'result'],
+)
+SETTLEMENTS = Counter(
+    'payment_settlements_total', "Settlement attempts by outcome", ['gateway', 'outcome'],
+)
+RATE_LIMIT_DECISIONS = Counter(
+    'payment_rate_limit_decisions_total', "Rate limiter decisions per route and key scope",
+    ['route', 'scope', 'decision'],
+)
+
+
+def gateway_label(url):
+    """Name the gateway a URL belongs to, falling back to its host"""
+    for gateway, names in (
+        ('Khalti', ('KHALTI_PAYMENT_URL', 'KHALTI_VERIFY_URL')),
+        ('eSewa', ('ESEWA_VERIFY_URL', 'ESEWA_PAYMENT_URL')),
+    ):
+        for name in names:
+            configured = getattr(settings, name, None)
+            if configured and urlsplit(configured).netloc == urlsplit(url).netloc:
+                return gateway
+    return urlsplit(url).netloc
+
+
+def observe_gateway_request(method, url, seconds, outcome):
+    """Record one gateway HTTP attempt; ``outcome`` is a status class such as '2xx', or 'error'"""
+    GATEWAY_REQUEST_SECONDS.labels(
+        gateway=gateway_label(url), method=method, endpoint=urlsplit(url).path, outcome=outcome,
+    ).observe(seconds)
+
+
+def status_outcome(status_code):
+    return f'{status_code // 100}xx'
+
+
+def observe_view(view, seconds, timer):
+    VIEW_SECONDS.labels(view=view).observe(seconds)
+    VIEW_DB_SECONDS.labels(view=view).observe(timer.seconds)
+    VIEW_DB_QUERIES.labels(view=view).observe(timer.queries)
+
+
+class QueryTimer:
+    """Database execute wrapper summing query time for one request, across aliases and threads"""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.seconds += elapsed
+                self.queries += 1
+
+
+# The timer of the request being served. Context variables follow the request
+# into sync_to_async threads, so queries run there are counted too.
+_current_timer = ContextVar('query_timer', default=None)
+
+
+def _timed_execute(execute, sql, params, many, context):
+    timer = _current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_query_timer(connection, **kwargs):
+    """Time queries on this thread's connection; also a ``connection_created`` receiver"""
+    if _timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_timed_execute)
+
+
+@contextmanager
+def time_queries():
+    """Sum the time of every query run for this request, on any alias or thread"""
+    timer = QueryTimer()
+    token = _current_timer.set(timer)
+    # Connections opened before the receiver was connected have no wrapper yet
+    for alias in connections:
+        install_query_timer(connections[alias])
+    try:
+        yield timer
+    finally:
+        _current_timer.reset(token)
+
+
+def render_metrics():
+    """Exposition-format body and content type for all payment metrics"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        # Gunicorn/uvicorn workers each write samples to files; aggregate them
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
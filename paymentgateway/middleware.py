@@ -0,0 +1,152 @@
+import math
+import time
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.decorators import sync_and_async_middleware
+
+from .db_routing import end_request, pin_seconds, replicas, start_request
+from .log_sink import get_payment_log_sink
+from .metrics import observe_view, time_queries
+from .rate_limit import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCapableMiddleware:
+    """Serve sync and async requests natively, so ASGI doesn't adapt the handler chain.
+
+    Subclasses implement ``handle`` and, for async requests, ``ahandle``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.ahandle(request)
+        return self.handle(request)
+
+
+@sync_and_async_middleware
+class PaymentLogFlushMiddleware(AsyncCapableMiddleware):
+    """Flush buffered PaymentLog entries once the response is ready.
+
+    Requests that recorded a successful payment flush right away so the
+    success page shows the settled log; others only flush when the batch
+    size or interval threshold has been reached.
+    """
+
+    def handle(self, request):
+        response = self.get_response(request)
+        self.flush()
+        return response
+
+    async def ahandle(self, request):
+        response = await self.get_response(request)
+        if get_payment_log_sink().buffered:
+            await sync_to_async(self.flush)()
+        return response
+
+    @staticmethod
+    def flush():
+        sink = get_payment_log_sink()
+        if sink.buffered:
+            try:
+                if sink.has_success_pending():
+                    sink.flush()
+                else:
+                    sink.flush_if_due()
+            except Exception as e:
+                # Entries stay buffered and in the write-ahead file for the next flush
+                logger.error("Deferred PaymentLog flush failed: %s", e)
+
+
+@sync_and_async_middleware
+class MetricsMiddleware(AsyncCapableMiddleware):
+    """Observe latency, DB time and query count per view"""
+
+    def handle(self, request):
+        start = time.perf_counter()
+        with time_queries() as timer:
+            response = self.get_response(request)
+        self.observe(request, start, timer)
+        return response
+
+    async def ahandle(self, request):
+        start = time.perf_counter()
+        with time_queries() as timer:
+            response = await self.get_response(request)
+        self.observe(request, start, timer)
+        return response
+
+    @staticmethod
+    def observe(request, start, timer):
+        match = getattr(request, 'resolver_match', None)
+        # Unmatched URLs share one label so scanners can't blow up cardinality
+        view = (match.view_name or match._func_path) if match else 'unmatched'
+        observe_view(view, time.perf_counter() - start, timer)
+
+
+@sync_and_async_middleware
+class RateLimitMiddleware(AsyncCapableMiddleware):
+    """Answer 429 with Retry-After once a client or order exceeds its route's RATE_LIMITS.
+
+    Runs as a view middleware, after URL resolution, so rules are keyed by
+    URL name and can read the order id from the route. The handler runs
+    ``process_view`` in a thread for async requests, as the limiter may call Redis.
+    """
+
+    def handle(self, request):
+        return self.get_response(request)
+
+    async def ahandle(self, request):
+        return await self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+            return None
+        route = request.resolver_match.url_name
+        retry_after = get_rate_limiter().check(route, request, view_kwargs)
+        if retry_after is None:
+            return None
+        response = JsonResponse(
+            {'status': 'error', 'message': 'Too many requests, please slow down'}, status=429,
+        )
+        response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+
+@sync_and_async_middleware
+class ReplicaPinningMiddleware(AsyncCapableMiddleware):
+    """Keep a client on the primary for a few seconds after a request of theirs writes.
+
+    Replicas lag the primary, so the page a client is redirected to after
+    creating or paying for an order must not read from one. The pin is a
+    short-lived cookie, so it follows the client across workers and nodes.
+    """
+    cookie_name = 'db_pin'
+
+    def handle(self, request):
+        self.process_request(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def ahandle(self, request):
+        # Neither hook does I/O, so they run on the event loop
+        self.process_request(request)
+        return self.process_response(request, await self.get_response(request))
+
+    def process_request(self, request):
+        request.db_state = start_request(pinned=self.cookie_name in request.COOKIES)
+
+    def process_response(self, request, response):
+        end_request()
+        state = getattr(request, 'db_state', None)
+        if state is not None and state.wrote and replicas():
+            response.set_cookie(self.cookie_name, '1', max_age=pin_seconds(), httponly=True, samesite='Lax')
+        return response
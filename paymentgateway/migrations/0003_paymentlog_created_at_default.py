@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-17 18:38
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paymentgateway', '0002_alter_paymentlog_options_order_address_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paymentlog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.5 on 2026-10-17 18:41
+
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def backfill_stats(apps, schema_editor):
+    """Seed the stat tables from orders and logs that already exist"""
+    Order = apps.get_model('paymentgateway', 'Order')
+    PaymentLog = apps.get_model('paymentgateway', 'PaymentLog')
+    OrderStat = apps.get_model('paymentgateway', 'OrderStat')
+    PaymentLogStat = apps.get_model('paymentgateway', 'PaymentLogStat')
+
+    order_rows = Order.objects.annotate(
+        date=TruncDate('created_at'), method=Coalesce('payment_method', Value('')),
+    ).values('date', 'method', 'status', 'is_paid').annotate(
+        order_count=Count('id'),
+        revenue=Sum(Case(When(is_paid=True, then='paid_amount'), default=0, output_field=IntegerField())),
+    ).order_by()
+    OrderStat.objects.bulk_create([
+        OrderStat(
+            date=row['date'], payment_method=row['method'], status=row['status'],
+            is_paid=row['is_paid'], order_count=row['order_count'], revenue=row['revenue'] or 0,
+        )
+        for row in order_rows
+    ], batch_size=1000)
+
+    log_rows = PaymentLog.objects.annotate(date=TruncDate('created_at')).values(
+        'date', 'payment_method', 'status',
+    ).annotate(log_count=Count('id'), total=Sum('amount')).order_by()
+    PaymentLogStat.objects.bulk_create([
+        PaymentLogStat(
+            date=row['date'], payment_method=row['payment_method'], status=row['status'],
+            log_count=row['log_count'], amount=row['total'] or 0,
+        )
+        for row in log_rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paymentgateway', '0005_order_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('payment_method', models.CharField(blank=True, default='', max_length=20)),
+                ('status', models.CharField(max_length=20)),
+                ('is_paid', models.BooleanField(default=False)),
+                ('order_count', models.IntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'payment_method', 'status', 'is_paid'), name='orderstat_bucket_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PaymentLogStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('payment_method', models.CharField(max_length=20)),
+                ('status', models.CharField(max_length=20)),
+                ('log_count', models.IntegerField(default=0)),
+                ('amount', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'payment_method', 'status'), name='paylogstat_bucket_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-17 18:47
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paymentgateway', '0006_order_and_payment_log_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentSettlement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=150, unique=True)),
+                ('payment_method', models.CharField(max_length=20)),
+                ('transaction_id', models.CharField(max_length=100)),
+                ('amount', models.IntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='settlements', to='paymentgateway.order')),
+            ],
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.5 on 2026-10-17 19:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+PARTITIONED_TABLE = """
+DROP TABLE paymentgateway_archivedpaymentlog;
+CREATE TABLE paymentgateway_archivedpaymentlog (
+    id bigint NOT NULL,
+    order_id bigint NOT NULL REFERENCES paymentgateway_order (id) DEFERRABLE INITIALLY DEFERRED,
+    payment_method varchar(20) NOT NULL,
+    transaction_id varchar(100) NOT NULL,
+    amount integer NOT NULL,
+    status varchar(20) NOT NULL,
+    created_at timestamp with time zone NOT NULL,
+    payload bytea NOT NULL,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE INDEX archlog_order_created_idx ON paymentgateway_archivedpaymentlog (order_id, created_at);
+CREATE INDEX archlog_txn_idx ON paymentgateway_archivedpaymentlog (transaction_id);
+CREATE TABLE paymentgateway_archivedpaymentlog_default PARTITION OF paymentgateway_archivedpaymentlog DEFAULT;
+"""
+
+
+def partition_archive(apps, schema_editor):
+    """On PostgreSQL, recreate the archive as a table partitioned by month of created_at.
+
+    The primary key has to include the partition column; monthly partitions
+    are added by the archive job before it writes into them.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(PARTITIONED_TABLE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paymentgateway', '0007_payment_settlement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPaymentLog',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('payment_method', models.CharField(max_length=20)),
+                ('transaction_id', models.CharField(max_length=100)),
+                ('amount', models.IntegerField()),
+                ('status', models.CharField(max_length=20)),
+                ('created_at', models.DateTimeField()),
+                ('payload', models.BinaryField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_payment_logs', to='paymentgateway.order')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['order', 'created_at'], name='archlog_order_created_idx'), models.Index(fields=['transaction_id'], name='archlog_txn_idx')],
+            },
+        ),
+        migrations.RunPython(partition_archive, migrations.RunPython.noop),
+    ]
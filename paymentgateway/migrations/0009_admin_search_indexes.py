@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-17 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paymentgateway', '0008_archived_payment_log'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedpaymentlog',
+            index=models.Index(fields=['-created_at', '-id'], name='archlog_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['transaction_id'], name='order_txn_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['name'], name='order_name_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='paymentlog',
+            index=models.Index(fields=['-created_at', '-id'], name='paylog_created_id_idx'),
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 import uuid
 from django.core.validators import EmailValidator
 
@@ -35,21 +37,70 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of the order list
+            models.Index(fields=['-created_at', '-id'], name='order_created_id_idx'),
+            # Dashboard/status filters ordered by recency
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+            # Admin list_filter combination
+            models.Index(fields=['is_paid', 'payment_method', 'created_at'], name='order_paid_method_created_idx'),
+            # Reconciliation and pending lists only ever scan unpaid orders
+            models.Index(fields=['created_at'], name='order_unpaid_created_idx', condition=Q(is_paid=False)),
+            # Admin search: exact transaction id, and customer-name prefix (LIKE 'x%' on PostgreSQL)
+            models.Index(fields=['transaction_id'], name='order_txn_idx'),
+            models.Index(fields=['name'], name='order_name_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
     
     # search field
     search_fields = ['name', 'order_id', 'is_paid', 'email', 'phone']
     
+    # Payment fields whose changes are tracked across saves (stats, cache, events)
+    TRACKED_FIELDS = ('is_paid', 'status', 'payment_method', 'paid_amount', 'transaction_id', 'created_at')
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked()
+        return instance
+    
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._snapshot_tracked()
+    
+    def _snapshot_tracked(self):
+        """Remember the persisted payment fields, if they were all loaded"""
+        if all(name in self.__dict__ for name in self.TRACKED_FIELDS):
+            self._loaded_values = {name: self.__dict__[name] for name in self.TRACKED_FIELDS}
+        else:
+            self._loaded_values = None
+    
     def save(self, *args, **kwargs):
         if not self.order_id:
             self.order_id = str(uuid.uuid4())[:8].upper()
         
         # Auto-update status based on payment
-        if self.is_paid and self.status == 'pending':
+        if self.is_paid and self.status in ('pending', 'processing'):
             self.status = 'paid'
         elif not self.is_paid and self.status == 'paid':
             self.status = 'pending'
+        
+        # What the row looked like before this save, for post_save receivers
+        if self._state.adding:
+            self._previous_values = None
+        elif getattr(self, '_loaded_values', None) is not None:
+            self._previous_values = self._loaded_values
+        else:
+            self._previous_values = Order.objects.filter(pk=self.pk).values(*self.TRACKED_FIELDS).first()
             
         super().save(*args, **kwargs)
+        self._snapshot_tracked()
+    
+    def tracked_changes(self):
+        """Names of tracked fields changed by the last save (all of them on create)"""
+        previous = getattr(self, '_previous_values', None)
+        if previous is None:
+            return set(self.TRACKED_FIELDS)
+        return {name for name in self.TRACKED_FIELDS if previous.get(name) != getattr(self, name)}
     
     def __str__(self):
         return f"{self.name} - {self.order_id} - Rs.{self.total_price}"
@@ -73,7 +124,8 @@ class PaymentLog(models.Model):
         ]
     )
     gateway_response = models.JSONField(null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the event happens, not when a buffered batch is written
+    created_at = models.DateTimeField(default=timezone.now)
     
     # Additional production fields
     currency = models.CharField(max_length=3, default='NPR')
@@ -86,4 +138,92 @@ class PaymentLog(models.Model):
         return f"{self.order.order_id} - {self.payment_method} - {self.status}"
     
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+        indexes = [
+            # order.payment_logs ordered by -created_at
+            models.Index(fields=['order', 'created_at'], name='paylog_order_created_idx'),
+            # Admin changelist order and date hierarchy
+            models.Index(fields=['-created_at', '-id'], name='paylog_created_id_idx'),
+            # Callback, webhook and admin lookups by gateway transaction
+            models.Index(fields=['transaction_id'], name='paylog_txn_idx'),
+            # Admin/report filters on status and gateway, newest first
+            models.Index(fields=['status', 'payment_method', '-created_at'], name='paylog_status_method_idx'),
+        ]
+
+
+class OrderStat(models.Model):
+    """Running order counters for one (day, gateway, status, paid) bucket"""
+    date = models.DateField()
+    payment_method = models.CharField(max_length=20, blank=True, default='')
+    status = models.CharField(max_length=20)
+    is_paid = models.BooleanField(default=False)
+    order_count = models.IntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'payment_method', 'status', 'is_paid'], name='orderstat_bucket_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.payment_method or 'none'} - {self.status}: {self.order_count}"
+
+
+class PaymentLogStat(models.Model):
+    """Running PaymentLog counters for one (day, gateway, status) bucket"""
+    date = models.DateField()
+    payment_method = models.CharField(max_length=20)
+    status = models.CharField(max_length=20)
+    log_count = models.IntegerField(default=0)
+    amount = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'payment_method', 'status'], name='paylogstat_bucket_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.payment_method} - {self.status}: {self.log_count}"
+
+
+class PaymentSettlement(models.Model):
+    """Idempotency record: one row per gateway payment that settled an order"""
+    key = models.CharField(max_length=150, unique=True)  # "<gateway>:<transaction id>"
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='settlements')
+    payment_method = models.CharField(max_length=20)
+    transaction_id = models.CharField(max_length=100)
+    amount = models.IntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.key} -> {self.order_id}"
+
+
+class ArchivedPaymentLog(models.Model):
+    """A PaymentLog moved out of the hot table by the retention job.
+
+    Columns used for lookups keep their own fields; the rest of the entry,
+    including ``gateway_response``, is stored as zlib-compressed JSON.
+    On PostgreSQL the table is range-partitioned by month on ``created_at``.
+    """
+    id = models.BigIntegerField(primary_key=True)  # The original PaymentLog id
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='archived_payment_logs')
+    payment_method = models.CharField(max_length=20)
+    transaction_id = models.CharField(max_length=100)
+    amount = models.IntegerField()
+    status = models.CharField(max_length=20)
+    created_at = models.DateTimeField()
+    payload = models.BinaryField()
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['order', 'created_at'], name='archlog_order_created_idx'),
+            models.Index(fields=['transaction_id'], name='archlog_txn_idx'),
+            models.Index(fields=['-created_at', '-id'], name='archlog_created_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.order_id} - {self.payment_method} - {self.status} (archived)"
@@ -0,0 +1,79 @@
+import base64
+import json
+from dataclasses import dataclass, field
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_datetime
+
+
+@dataclass
+class KeysetPage:
+    """One page of a (created_at, id) keyset-paginated queryset"""
+    items: list = field(default_factory=list)
+    next_cursor: str = None
+    has_next: bool = False
+
+
+def encode_cursor(created_at, pk):
+    """Opaque cursor pointing just past the given row"""
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(created_at, pk)`` from a cursor, or ``None`` if it is malformed"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        created_at = parse_datetime(created_at)
+        return (created_at, int(pk)) if created_at else None
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def paginate_keyset(queryset, cursor=None, page_size=25):
+    """Newest-first page of ``queryset`` starting after ``cursor``.
+
+    Seeks on the (created_at, id) index instead of OFFSET, so every page
+    costs the same no matter how deep the client has scrolled.
+    """
+    queryset = queryset.order_by('-created_at', '-id')
+    position = decode_cursor(cursor)
+    if position:
+        created_at, pk = position
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+
+    # Fetch one extra row to learn whether another page exists
+    rows = list(queryset[:page_size + 1])
+    has_next = len(rows) > page_size
+    items = rows[:page_size]
+    next_cursor = encode_cursor(items[-1].created_at, items[-1].pk) if has_next else None
+    return KeysetPage(items=items, next_cursor=next_cursor, has_next=has_next)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that trusts the query planner's row estimate for big results.
+
+    ``COUNT(*)`` over millions of rows dominates an admin changelist. On
+    PostgreSQL the estimate from ``EXPLAIN`` is used once it passes
+    ``exact_threshold``; smaller results, and other databases, are counted
+    exactly. An overestimate only means the last page links run short.
+    """
+    exact_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and connections[queryset.db].vendor == 'postgresql':
+            plan = json.loads(queryset.order_by().explain(format='json'))
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+            if estimate > self.exact_threshold:
+                return estimate
+        return super().count
@@ -4,47 +4,223 @@ import hashlib
 import hmac
 import base64
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from django.conf import settings
+from django.core.cache import cache
 from django.urls import reverse
-from .models import Order, PaymentLog
+from .models import Order
+from .log_sink import record_payment_log
+from .settlement import (
+    AMOUNT_MISMATCH, ORDER_NOT_FOUND, TRANSACTION_REUSED, already_settled, settle_payment
+)
+from .http_client import get_http_client
+from .circuit_breaker import CircuitOpenError
 import logging
+from asgiref.sync import sync_to_async
 
 logger = logging.getLogger(__name__)
 
 
-class EsewaPaymentGateway:
+def circuit_open_error(e):
+    """Error payload shown at checkout when a gateway's circuit is open"""
+    return {
+        "error": f"{e.gateway} is temporarily unavailable. Please try again in a few minutes "
+                 "or choose another payment method.",
+        "circuit_open": True,
+        "retry_after": round(e.retry_after),
+    }
+
+
+# eSewa transaction statuses that will not change again, so answers can be cached
+ESEWA_FINAL_STATUSES = ('COMPLETE', 'FULL_REFUND', 'PARTIAL_REFUND', 'CANCELED')
+# Answers worth asking again about: the payment may still complete, the lookup
+# failed, or (NOT_FOUND) eSewa hasn't recorded the transaction yet
+ESEWA_RETRY_STATUSES = ('PENDING', 'AMBIGUOUS', 'NOT_FOUND', 'ERROR')
+
+
+@dataclass(frozen=True)
+class EsewaStatus:
+    """One answer from eSewa's transaction status API.
+
+    ``status`` is eSewa's (COMPLETE, PENDING, AMBIGUOUS, NOT_FOUND, CANCELED,
+    FULL_REFUND, PARTIAL_REFUND), or ERROR when no usable answer came back.
+    """
+    transaction_uuid: str
+    status: str
+    total_amount: str = ''
+    ref_id: str = None
+    error: str = None
+    
+    @property
+    def completed(self):
+        return self.status == 'COMPLETE'
+    
+    @property
+    def final(self):
+        return self.status in ESEWA_FINAL_STATUSES
+
+
+def khalti_error_data(response):
+    """Error body of a failed Khalti call, from a requests or httpx response"""
+    return response.json() if response.content else {"error": f"HTTP {response.status_code}"}
+
+
+def parse_khalti_lookup(response, pidx):
+    """``(data, None)`` when a lookup reports the payment Completed, else ``(None, error_data)``"""
+    if response.status_code != 200:
+        error_data = khalti_error_data(response)
+        logger.error("Khalti verification failed: %s", error_data, extra={'gateway': 'Khalti', 'pidx': pidx})
+        return None, error_data
+    data = response.json()
+    if data.get('status') != 'Completed':
+        logger.warning("Khalti payment not completed: %s", data, extra={'gateway': 'Khalti', 'pidx': pidx})
+        return None, data
+    return data, None
+
+
+def khalti_settlement_result(outcome, order_id, pidx, data):
+    """``verify_payment``'s answer once a completed lookup went through ``settle_payment``"""
+    if outcome == AMOUNT_MISMATCH:
+        return False, {"error": "Amount mismatch"}
+    if outcome == TRANSACTION_REUSED:
+        return False, {"error": "Transaction already used for another order"}
+    if outcome == ORDER_NOT_FOUND:
+        raise Order.DoesNotExist
+    logger.info(
+        "Khalti payment verified successfully for order %s", order_id,
+        extra={'gateway': 'Khalti', 'order_id': order_id, 'pidx': pidx},
+    )
+    return True, data
+
+
+def esewa_status_result(status):
+    """``verify_transaction``'s answer when the status API didn't report COMPLETE, and the failure to log"""
+    if status in ESEWA_RETRY_STATUSES:
+        return (None, status), None
+    return (False, "Payment verification failed with eSewa API"), f"API verification failed: {status}"
+
+
+def esewa_settlement_result(outcome, oid, amt, refId):
+    """``verify_transaction``'s answer for a settlement ``outcome``, and the failure to log"""
+    if outcome == AMOUNT_MISMATCH:
+        return (False, "Payment amount does not match order amount"), "Amount mismatch"
+    if outcome == TRANSACTION_REUSED:
+        return (False, "Payment reference was already used for another order"), "Reference already used for another order"
+    if outcome == ORDER_NOT_FOUND:
+        raise Order.DoesNotExist
+    logger.info(
+        "eSewa payment successful for order %s, amount: %s, refId: %s", oid, amt, refId,
+        extra={'gateway': 'eSewa', 'order_id': oid, 'transaction_id': refId},
+    )
+    return (True, "Payment verified successfully"), None
+
+
+class PaymentGateway:
+    """Interface implemented by every gateway in the registry.
+
+    The registry builds one instance per process and shares it across
+    threads, so a gateway keeps only settings read in ``__init__`` and
+    process-wide clients, never per-request state.
+    """
+    method = None  # Registry key and checkout form value, e.g. 'khalti'
+    name = None    # Name stored on orders and payment logs, e.g. 'Khalti'
+    
+    @property
+    def http(self):
+        # Looked up per call so a reset client is picked up by long-lived instances
+        return get_http_client()
+    
+    def start_checkout(self, order):
+        """Begin paying ``order`` and return ``(success, data)``.
+        
+        On success the customer is sent to ``data['payment_url']``: by
+        redirect, or by POSTing ``data['form']`` there when it is set.
+        """
+        raise NotImplementedError
+    
+    async def astart_checkout(self, order):
+        return await sync_to_async(self.start_checkout)(order)
+
+
+class EsewaPaymentGateway(PaymentGateway):
     """eSewa Payment Gateway Integration - Production Ready"""
+    method = 'esewa'
+    name = 'eSewa'
+    
+    # Fields covered by the v2 form signature, in signing order
+    SIGNED_FIELDS = ('total_amount', 'transaction_uuid', 'product_code')
     
     def __init__(self):
         self.scd = settings.ESEWA_SCD
+        self.secret_key = getattr(settings, 'ESEWA_SECRET_KEY', '')
         self.success_url = settings.ESEWA_SUCCESS_URL
         self.failure_url = settings.ESEWA_FAILURE_URL
         self.payment_url = settings.ESEWA_PAYMENT_URL
         self.verify_url = getattr(settings, 'ESEWA_VERIFY_URL', None)
         self.mode = getattr(settings, 'PAYMENT_GATEWAY_MODE', 'sandbox')
+        self.form_ttl = getattr(settings, 'ESEWA_FORM_CACHE_TTL', 300)
+        self.status_ttl = getattr(settings, 'ESEWA_STATUS_CACHE_TTL', 3600)
+        self.status_concurrency = getattr(settings, 'ESEWA_STATUS_CONCURRENCY', 10)
+        # Keyed once; each signature copies it rather than re-deriving the key pads
+        self._mac = hmac.new(self.secret_key.encode(), digestmod=hashlib.sha256)
+    
+    def sign(self, fields, names):
+        """Base64 HMAC-SHA256 over ``name=value`` pairs, as eSewa v2 signs them"""
+        mac = self._mac.copy()
+        mac.update(','.join(f'{name}={fields[name]}' for name in names).encode())
+        return base64.b64encode(mac.digest()).decode()
+    
+    @staticmethod
+    def transaction_uuid(order):
+        # eSewa allows letters, digits and hyphens; the prefix ties the callback to the order
+        return f'{order.order_id}-{uuid.uuid4().hex[:12]}'
+    
+    @staticmethod
+    def order_id_from_uuid(transaction_uuid):
+        return transaction_uuid.rsplit('-', 1)[0]
+    
+    def _build_payment_data(self, order, transaction_uuid):
+        """Signed form fields posted to eSewa's v2 payment page"""
+        data = {
+            'amount': str(order.total_price),
+            'tax_amount': '0',
+            'total_amount': str(order.total_price),
+            'transaction_uuid': transaction_uuid,
+            'product_code': self.scd,
+            'product_service_charge': '0',
+            'product_delivery_charge': '0',
+            'success_url': self.success_url,
+            'failure_url': self.failure_url,
+            'signed_field_names': ','.join(self.SIGNED_FIELDS),
+        }
+        data['signature'] = self.sign(data, self.SIGNED_FIELDS)
+        return data
+    
+    def _form_cache_key(self, order):
+        return f'esewa-form:{order.pk}:{order.total_price}'
     
     def generate_payment_data(self, order):
-        """Generate payment data for eSewa"""
-        # Generate unique transaction UUID
-        transaction_uuid = str(uuid.uuid4())
+        """Signed payment form for ``order``.
         
-        payment_data = {
-            'tAmt': str(order.total_price),
-            'amt': str(order.total_price),
-            'txAmt': '0',  # Tax amount
-            'psc': '0',    # Service charge
-            'pdc': '0',    # Delivery charge
-            'scd': self.scd,
-            'pid': order.order_id,
-            'su': self.success_url,
-            'fu': self.failure_url,
-        }
+        The form is cached per order and amount for ``ESEWA_FORM_CACHE_TTL``
+        seconds, so a double-submitted checkout gets the same
+        ``transaction_uuid`` back without signing or logging it again.
+        """
+        key = self._form_cache_key(order)
+        payment_data = cache.get(key)
+        if payment_data is not None:
+            return payment_data
+        
+        payment_data = self._build_payment_data(order, self.transaction_uuid(order))
+        if not cache.add(key, payment_data, self.form_ttl):
+            # A concurrent submit cached its form first; hand out that one
+            return cache.get(key, payment_data)
         
-        # Log payment initiation
-        PaymentLog.objects.create(
+        record_payment_log(
             order=order,
             payment_method='eSewa',
-            transaction_id=transaction_uuid,
+            transaction_id=payment_data['transaction_uuid'],
             amount=order.total_price,
             status='Initiated',
             gateway_response={'payment_data': payment_data}
@@ -52,101 +228,229 @@ class EsewaPaymentGateway:
         
         return payment_data
     
+    def parse_callback(self, params):
+        """``(oid, amt, refId, transaction_uuid)`` from a success redirect, or ``None`` if incomplete or forged.
+        
+        eSewa v2 sends one base64 ``data`` parameter holding signed JSON;
+        the legacy ``oid``/``amt``/``refId`` form is still accepted for the
+        sandbox simulation and carries no ``transaction_uuid``.
+        """
+        encoded = params.get('data')
+        if not encoded:
+            values = (params.get('oid'), params.get('amt'), params.get('refId'))
+            return values + (None,) if all(values) else None
+        
+        try:
+            data = json.loads(base64.b64decode(encoded))
+            signature = self.sign(data, data['signed_field_names'].split(','))
+            verified = hmac.compare_digest(signature, str(data.get('signature', '')))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            verified = False
+        if not verified:
+            logger.warning("eSewa callback with an invalid signature", extra={'gateway': 'eSewa'})
+            return None
+        if data.get('status') != 'COMPLETE':
+            logger.warning("eSewa callback with status %s", data.get('status'), extra={'gateway': 'eSewa'})
+            return None
+        
+        amount = str(data['total_amount']).replace(',', '')
+        transaction_uuid = data['transaction_uuid']
+        return self.order_id_from_uuid(transaction_uuid), amount, data['transaction_code'], transaction_uuid
+    
+    def start_checkout(self, order):
+        return True, {'payment_url': self.payment_url, 'form': self.generate_payment_data(order)}
+    
     def verify_payment(self, request):
         """Verify eSewa payment with proper API verification"""
-        oid = request.GET.get('oid')
-        amt = request.GET.get('amt')
-        refId = request.GET.get('refId')
+        params = self.parse_callback(request.GET)
+        if params is None:
+            logger.error("eSewa payment verification failed: missing or invalid parameters", extra={'gateway': 'eSewa'})
+            return False, "Missing or invalid payment details"
         
-        if not all([oid, amt, refId]):
-            logger.error(f"eSewa payment verification failed: Missing parameters - oid: {oid}, amt: {amt}, refId: {refId}")
-            return False, "Missing required parameters"
+        oid, amt, refId, transaction_uuid = params
+        return self.verify_transaction(oid, amt, refId, transaction_uuid=transaction_uuid)
+    
+    def verify_transaction(self, oid, amt, refId, raise_on_network_error=False, transaction_uuid=None):
+        """Verify an eSewa transaction and mark the order paid.
+
+        With ``raise_on_network_error`` a failed call to eSewa's API is raised
+        instead of being recorded as a failed payment, so callers such as the
+        verification task can retry it. Without ``transaction_uuid`` the
+        order's latest initiated eSewa transaction is checked.
+
+        When eSewa's answer may still change (``ESEWA_RETRY_STATUSES``) nothing
+        is recorded and ``(None, status)`` is returned, so the caller can ask
+        again later.
+        """
+        # A replayed callback for a payment that already settled needs no API call
+        if already_settled('eSewa', refId, oid):
+            return True, "Payment verified successfully"
         
         try:
             order = Order.objects.get(order_id=oid)
             
             # In production mode, verify with eSewa API
             if self.mode == 'production' and self.verify_url:
-                verification_success = self._verify_with_esewa_api(oid, amt, refId)
-                if not verification_success:
-                    self._log_failed_payment(order, refId, amt, "API verification failed")
-                    return False, "Payment verification failed with eSewa API"
-            
-            # Verify amount matches
-            if int(float(amt)) != order.total_price:
-                self._log_failed_payment(order, refId, amt, "Amount mismatch")
-                return False, "Payment amount does not match order amount"
-            
-            # Update order
-            order.is_paid = True
-            order.paid_amount = int(float(amt))
-            order.payment_method = 'eSewa'
-            order.transaction_id = refId
-            order.save()
-            
-            # Log successful payment
-            PaymentLog.objects.create(
-                order=order,
-                payment_method='eSewa',
-                transaction_id=refId,
-                amount=int(float(amt)),
-                status='Success',
-                gateway_response={
-                    'oid': oid,
-                    'amt': amt,
-                    'refId': refId,
-                    'verification_mode': self.mode
-                }
-            )
+                status = self._verify_with_esewa_api(
+                    oid, amt, refId, raise_on_network_error, transaction_uuid or self._initiated_uuid(order),
+                )
+                if status != 'COMPLETE':
+                    result, failure = esewa_status_result(status)
+                    if failure:
+                        self._log_failed_payment(order, refId, amt, failure)
+                    return result
             
-            logger.info(f"eSewa payment successful for order {oid}, amount: {amt}, refId: {refId}")
-            return True, "Payment verified successfully"
+            outcome = settle_payment(*self._settlement_args(oid, amt, refId))
+            result, failure = esewa_settlement_result(outcome, oid, amt, refId)
+            if failure:
+                self._log_failed_payment(order, refId, amt, failure)
+            return result
                 
         except Order.DoesNotExist:
-            logger.error(f"eSewa payment verification failed: Order {oid} not found")
+            logger.error("eSewa payment verification failed: Order %s not found", oid, extra={'gateway': 'eSewa', 'order_id': oid})
             return False, "Order not found"
+        except requests.RequestException:
+            raise
         except Exception as e:
-            logger.error(f"eSewa payment verification error: {str(e)}")
+            logger.error("eSewa payment verification error: %s", e, extra={'gateway': 'eSewa', 'order_id': oid})
             return False, f"Error: {str(e)}"
     
-    def _verify_with_esewa_api(self, oid, amt, refId):
-        """Verify payment with eSewa's verification API"""
+    def _settlement_args(self, oid, amt, refId):
+        """``settle_payment`` arguments for a verified eSewa callback"""
+        return oid, 'eSewa', refId, round(float(amt) * 100), {
+            'oid': oid,
+            'amt': amt,
+            'refId': refId,
+            'verification_mode': self.mode
+        }
+    
+    @staticmethod
+    def _initiated_uuid(order):
+        return order.payment_logs.filter(payment_method='eSewa', status='Initiated').values_list(
+            'transaction_id', flat=True,
+        ).order_by('-created_at', '-id').first()
+    
+    def _status_cache_key(self, product_code, transaction_uuid):
+        return f'esewa-status:{product_code}:{transaction_uuid}'
+    
+    def _status_params(self, product_code, total_amount, transaction_uuid):
+        return {
+            'product_code': product_code or self.scd,
+            'total_amount': total_amount,
+            'transaction_uuid': transaction_uuid,
+        }
+    
+    @staticmethod
+    def _parse_status(transaction_uuid, status_code, data):
+        """EsewaStatus from the status API's JSON body (``None`` if it wasn't JSON)"""
+        if not isinstance(data, dict) or not data.get('status'):
+            # Errors come back as {"code": 0, "error_message": "..."}
+            error = data.get('error_message') if isinstance(data, dict) else None
+            return EsewaStatus(transaction_uuid, 'ERROR', error=error or f"HTTP {status_code}")
+        return EsewaStatus(
+            transaction_uuid, data['status'],
+            total_amount=str(data.get('total_amount', '')), ref_id=data.get('ref_id'),
+        )
+    
+    @staticmethod
+    def _json(response):
         try:
-            verify_data = {
-                'amt': amt,
-                'scd': self.scd,
-                'rid': refId,
-                'pid': oid
-            }
-            
-            response = requests.post(self.verify_url, data=verify_data, timeout=30)
-            
-            if response.status_code == 200:
-                # Check if response contains success indicator
-                if 'Success' in response.text or 'success' in response.text.lower():
-                    return True
-                    
-            logger.warning(f"eSewa API verification failed: {response.status_code} - {response.text}")
-            return False
-            
-        except Exception as e:
-            logger.error(f"eSewa API verification exception: {str(e)}")
-            return False
+            return response.json()
+        except ValueError:
+            return None
+    
+    def transaction_status(self, transaction_uuid, total_amount, product_code=None):
+        """Status of one eSewa transaction; network errors are raised.
+        
+        Final answers (completed, cancelled, refunded) are cached for
+        ``ESEWA_STATUS_CACHE_TTL`` seconds, so repeated callbacks and
+        reconciliation runs don't ask again.
+        """
+        key = self._status_cache_key(product_code or self.scd, transaction_uuid)
+        result = cache.get(key)
+        if result is None:
+            response = self.http.get(
+                self.verify_url, params=self._status_params(product_code, total_amount, transaction_uuid),
+            )
+            result = self._parse_status(transaction_uuid, response.status_code, self._json(response))
+            if result.final:
+                cache.set(key, result, self.status_ttl)
+        return result
+    
+    def transaction_statuses(self, transactions, concurrency=None, throttle=None):
+        """``{transaction_uuid: EsewaStatus}`` for many ``(product_code, total_amount, transaction_uuid)``.
+        
+        Cached answers are read in one round-trip; the rest are looked up at
+        most ``concurrency`` at a time, each after calling ``throttle`` if
+        given. A lookup that fails on the network comes back as ERROR.
+        """
+        keys = {self._status_cache_key(code or self.scd, uuid_): (code, amount, uuid_)
+                for code, amount, uuid_ in transactions}
+        results = {result.transaction_uuid: result for result in cache.get_many(keys).values()}
+        pending = [item for item in keys.values() if item[2] not in results]
+        
+        def check(item):
+            if throttle:
+                throttle()
+            try:
+                return self.transaction_status(item[2], item[1], item[0])
+            except requests.RequestException as e:
+                return EsewaStatus(item[2], 'ERROR', error=str(e))
+        
+        if pending:
+            workers = min(concurrency or self.status_concurrency, len(pending))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results.update((result.transaction_uuid, result) for result in executor.map(check, pending))
+        return results
+    
+    def _check_status(self, result, oid, refId):
+        """Status of the payment described by a callback; COMPLETE only if ``result`` confirms it"""
+        if not result.completed:
+            logger.warning(
+                "eSewa status for order %s is %s %s", oid, result.status, result.error or '',
+                extra={'gateway': 'eSewa', 'order_id': oid},
+            )
+            return result.status
+        if result.ref_id and refId != result.ref_id:
+            logger.warning(
+                "eSewa reference %s for order %s does not match status ref_id %s", refId, oid, result.ref_id,
+                extra={'gateway': 'eSewa', 'order_id': oid, 'transaction_id': refId},
+            )
+            return 'REF_MISMATCH'
+        return result.status
+    
+    def _verify_with_esewa_api(self, oid, amt, refId, raise_on_network_error=False, transaction_uuid=None):
+        """Check a callback with eSewa's transaction status API and return the status"""
+        if not transaction_uuid:
+            # The Initiated log may not have been flushed yet
+            logger.warning("No eSewa transaction to check for order %s", oid, extra={'gateway': 'eSewa', 'order_id': oid})
+            return 'NOT_FOUND'
+        try:
+            result = self.transaction_status(transaction_uuid, amt)
+        except requests.RequestException as e:
+            if raise_on_network_error:
+                raise
+            logger.error("eSewa API verification exception: %s", e, extra={'gateway': 'eSewa', 'order_id': oid})
+            return 'ERROR'
+        return self._check_status(result, oid, refId)
     
     def _log_failed_payment(self, order, refId, amt, reason):
         """Log failed payment attempt"""
-        PaymentLog.objects.create(
+        record_payment_log(
             order=order,
             payment_method='eSewa',
             transaction_id=refId or 'unknown',
             amount=int(float(amt)) if amt else 0,
             status='Failed',
-            gateway_response={'reason': reason}
+            gateway_response={'reason': reason},
+            reason=reason
         )
 
 
-class KhaltiPaymentGateway:
+class KhaltiPaymentGateway(PaymentGateway):
     """Khalti Payment Gateway Integration - Production Ready"""
+    method = 'khalti'
+    name = 'Khalti'
     
     def __init__(self):
         self.public_key = settings.KHALTI_PUBLIC_KEY
@@ -158,14 +462,15 @@ class KhaltiPaymentGateway:
         self.website_url = getattr(settings, 'KHALTI_WEBSITE_URL', 'https://yourdomain.com/')
         self.mode = getattr(settings, 'PAYMENT_GATEWAY_MODE', 'sandbox')
     
-    def initiate_payment(self, order):
-        """Initiate Khalti payment with proper error handling"""
-        headers = {
+    def _headers(self):
+        return {
             'Authorization': f'Key {self.secret_key}',
             'Content-Type': 'application/json'
         }
-        
-        payment_data = {
+    
+    def _build_initiate_data(self, order):
+        """Request body for Khalti's epayment initiate API"""
+        return {
             "return_url": self.success_url,
             "website_url": self.website_url,
             "amount": order.total_price * 100,  # Khalti expects amount in paisa
@@ -177,20 +482,24 @@ class KhaltiPaymentGateway:
                 "phone": getattr(order, 'phone', '9800000000')
             }
         }
+    
+    def initiate_payment(self, order):
+        """Initiate Khalti payment with proper error handling"""
+        headers = self._headers()
+        payment_data = self._build_initiate_data(order)
         
         try:
-            response = requests.post(
+            response = self.http.post(
                 self.payment_url,
                 headers=headers,
-                data=json.dumps(payment_data),
-                timeout=30
+                data=json.dumps(payment_data)
             )
             
             if response.status_code == 200:
                 data = response.json()
                 
                 # Log the initiation
-                PaymentLog.objects.create(
+                record_payment_log(
                     order=order,
                     payment_method='Khalti',
                     transaction_id=data.get('pidx', ''),
@@ -199,126 +508,113 @@ class KhaltiPaymentGateway:
                     gateway_response=data
                 )
                 
-                logger.info(f"Khalti payment initiated for order {order.order_id}")
+                logger.info("Khalti payment initiated for order %s", order.order_id, extra={'gateway': 'Khalti', 'order_id': order.order_id})
                 return True, data
             else:
-                error_data = response.json() if response.content else {"error": f"HTTP {response.status_code}"}
+                error_data = khalti_error_data(response)
                 
                 # Log the failed initiation
-                PaymentLog.objects.create(
+                record_payment_log(
                     order=order,
                     payment_method='Khalti',
                     transaction_id='',
                     amount=order.total_price,
                     status='Failed',
-                    gateway_response=error_data
+                    gateway_response=error_data,
+                    reason='http_error'
                 )
                 
-                logger.error(f"Khalti payment initiation failed: {error_data}")
+                logger.error("Khalti payment initiation failed: %s", error_data, extra={'gateway': 'Khalti', 'order_id': order.order_id})
                 return False, error_data
                 
+        except CircuitOpenError as e:
+            error_data = circuit_open_error(e)
+            
+            record_payment_log(
+                order=order,
+                payment_method='Khalti',
+                transaction_id='',
+                amount=order.total_price,
+                status='Failed',
+                gateway_response=error_data,
+                reason='circuit_open'
+            )
+            
+            logger.warning("Khalti payment initiation skipped: %s", e, extra={'gateway': 'Khalti', 'order_id': order.order_id})
+            return False, error_data
         except requests.RequestException as e:
             error_data = {"error": f"Network error: {str(e)}"}
             
             # Log the exception
-            PaymentLog.objects.create(
+            record_payment_log(
                 order=order,
                 payment_method='Khalti',
                 transaction_id='',
                 amount=order.total_price,
                 status='Failed',
-                gateway_response=error_data
+                gateway_response=error_data,
+                reason='network_error'
             )
             
-            logger.error(f"Khalti payment initiation exception: {str(e)}")
+            logger.error("Khalti payment initiation exception: %s", e, extra={'gateway': 'Khalti', 'order_id': order.order_id})
             return False, error_data
         except Exception as e:
             error_data = {"error": str(e)}
             
             # Log the exception
-            PaymentLog.objects.create(
+            record_payment_log(
                 order=order,
                 payment_method='Khalti',
                 transaction_id='',
                 amount=order.total_price,
                 status='Failed',
-                gateway_response=error_data
+                gateway_response=error_data,
+                reason='unexpected_error'
             )
             
-            logger.error(f"Khalti payment initiation unexpected error: {str(e)}")
+            logger.error("Khalti payment initiation unexpected error: %s", e, extra={'gateway': 'Khalti', 'order_id': order.order_id})
             return False, error_data
     
-    def verify_payment(self, pidx):
-        """Verify Khalti payment with comprehensive validation"""
-        headers = {
-            'Authorization': f'Key {self.secret_key}',
-            'Content-Type': 'application/json'
-        }
-        
-        verify_data = {
-            "pidx": pidx
-        }
-        
+    def start_checkout(self, order):
+        return self.initiate_payment(order)
+    
+    def lookup(self, pidx):
+        """Fetch a payment's current state from Khalti without settling anything"""
+        # Lookup is read-only on Khalti's side, so it is safe to retry
+        return self.http.post(
+            self.verify_url,
+            headers=self._headers(),
+            data=json.dumps({"pidx": pidx}),
+            idempotent=True
+        )
+    
+    def verify_payment(self, pidx, order_id=None, raise_on_network_error=False):
+        """Verify Khalti payment with comprehensive validation
+
+        ``order_id`` is used when the lookup response doesn't echo the
+        ``purchase_order_id``. With ``raise_on_network_error`` transport
+        failures are raised so the caller can retry the lookup.
+        """
         try:
-            response = requests.post(
-                self.verify_url,
-                headers=headers,
-                data=json.dumps(verify_data),
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                if data.get('status') == 'Completed':
-                    # Get order by purchase_order_id
-                    order_id = data.get('purchase_order_id')
-                    order = Order.objects.get(order_id=order_id)
-                    
-                    # Verify amount matches
-                    expected_amount = order.total_price * 100  # Convert to paisa
-                    actual_amount = data.get('total_amount', 0)
-                    
-                    if actual_amount != expected_amount:
-                        logger.error(f"Khalti amount mismatch: expected {expected_amount}, got {actual_amount}")
-                        return False, {"error": "Amount mismatch"}
-                    
-                    # Update order
-                    order.is_paid = True
-                    order.paid_amount = actual_amount // 100  # Convert paisa to rupees
-                    order.payment_method = 'Khalti'
-                    order.transaction_id = data.get('transaction_id')
-                    order.save()
-                    
-                    # Log payment
-                    PaymentLog.objects.create(
-                        order=order,
-                        payment_method='Khalti',
-                        transaction_id=data.get('transaction_id'),
-                        amount=actual_amount // 100,
-                        status='Success',
-                        gateway_response=data
-                    )
-                    
-                    logger.info(f"Khalti payment verified successfully for order {order_id}")
-                    return True, data
-                else:
-                    logger.warning(f"Khalti payment not completed: {data}")
-                    return False, data
-            else:
-                error_data = response.json() if response.content else {"error": f"HTTP {response.status_code}"}
-                logger.error(f"Khalti verification failed: {error_data}")
+            data, error_data = parse_khalti_lookup(self.lookup(pidx), pidx)
+            if data is None:
                 return False, error_data
+            
+            order_id = data.get('purchase_order_id') or order_id
+            outcome = settle_payment(order_id, 'Khalti', data.get('transaction_id'), data.get('total_amount', 0), data)
+            return khalti_settlement_result(outcome, order_id, pidx, data)
                 
         except Order.DoesNotExist:
             error_msg = {"error": "Order not found"}
-            logger.error(f"Khalti verification failed: Order not found for pidx {pidx}")
+            logger.error("Khalti verification failed: Order not found for pidx %s", pidx, extra={'gateway': 'Khalti', 'pidx': pidx})
             return False, error_msg
         except requests.RequestException as e:
+            if raise_on_network_error:
+                raise
             error_msg = {"error": f"Network error: {str(e)}"}
-            logger.error(f"Khalti verification network error: {str(e)}")
+            logger.error("Khalti verification network error: %s", e, extra={'gateway': 'Khalti', 'pidx': pidx})
             return False, error_msg
         except Exception as e:
             error_msg = {"error": str(e)}
-            logger.error(f"Khalti verification unexpected error: {str(e)}")
+            logger.error("Khalti verification unexpected error: %s", e, extra={'gateway': 'Khalti', 'pidx': pidx})
             return False, error_msg
@@ -0,0 +1,181 @@
+import math
+import time
+import logging
+import threading
+from dataclasses import dataclass
+
+import redis
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .metrics import RATE_LIMIT_DECISIONS
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+
+# Refill and take one token atomically; the bucket is a hash of (tokens, ts).
+# Redis's own clock is used so every node refills at the same pace.
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, tostring(retry_after)}
+"""
+
+
+@dataclass(frozen=True)
+class Rule:
+    """``rate`` requests per second, with bursts of up to ``burst``, per ``scope`` value"""
+    scope: str          # 'ip' or 'order'
+    rate: float
+    burst: int
+    methods: tuple = ()  # Empty means every method
+
+
+def parse_rule(config):
+    """Rule from a RATE_LIMITS entry such as ``{'scope': 'ip', 'rate': '30/m', 'burst': 10}``"""
+    count, _, period = config['rate'].partition('/')
+    rate = int(count) / PERIODS[period[:1] or 's']
+    return Rule(
+        scope=config.get('scope', 'ip'),
+        rate=rate,
+        burst=int(config.get('burst') or max(1, math.ceil(rate))),
+        methods=tuple(method.upper() for method in config.get('methods', ())),
+    )
+
+
+class MemoryBackend:
+    """Token buckets in this process; limits apply per node"""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity):
+        """Return ``(allowed, retry_after seconds)``"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - ts) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                allowed, retry_after = True, 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                allowed, retry_after = False, (1 - tokens) / rate
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return allowed, retry_after
+
+    def _prune(self, now):
+        # Buckets refilled to capacity are the same as no bucket at all; the
+        # slowest refill is assumed to take at most an hour
+        self._buckets = {key: value for key, value in self._buckets.items() if now - value[1] < 3600}
+
+
+class RedisBackend:
+    """Token buckets in Redis, shared by every node"""
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(TOKEN_BUCKET_LUA)
+
+    def take(self, key, rate, capacity):
+        allowed, retry_after = self.script(keys=[key], args=[rate, capacity])
+        return bool(allowed), float(retry_after)
+
+
+class RateLimiter:
+    """Checks requests against the RATE_LIMITS rules for their route"""
+
+    def __init__(self, backend, rules):
+        self.backend = backend
+        self.rules = rules
+
+    @staticmethod
+    def client_ip(request):
+        """Client address, read from X-Forwarded-For behind RATE_LIMIT_TRUSTED_PROXIES proxies"""
+        proxies = getattr(settings, 'RATE_LIMIT_TRUSTED_PROXIES', 0)
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+        if proxies and forwarded:
+            hops = [hop.strip() for hop in forwarded.split(',')]
+            # Each trusted proxy appended one hop; anything further left is client-supplied
+            return hops[-proxies] if len(hops) >= proxies else hops[0]
+        return request.META.get('REMOTE_ADDR', '')
+
+    @staticmethod
+    def order_key(request, view_kwargs):
+        order_id = view_kwargs.get('order_id') or request.GET.get('purchase_order_id') or request.GET.get('oid')
+        return str(order_id) if order_id else None
+
+    def check(self, route, request, view_kwargs):
+        """``None`` if the request may proceed, otherwise seconds until it may retry"""
+        retry_after = None
+        for rule in self.rules.get(route, ()):
+            if rule.methods and request.method not in rule.methods:
+                continue
+            value = self.client_ip(request) if rule.scope == 'ip' else self.order_key(request, view_kwargs)
+            if not value:
+                continue
+            try:
+                allowed, wait = self.backend.take(f'ratelimit:{route}:{rule.scope}:{value}', rule.rate, rule.burst)
+            except redis.RedisError as e:
+                # Fail open: an unreachable limiter must not take checkout down with it
+                logger.error("Rate limiter unavailable: %s", e)
+                RATE_LIMIT_DECISIONS.labels(route=route, scope=rule.scope, decision='error').inc()
+                continue
+            RATE_LIMIT_DECISIONS.labels(
+                route=route, scope=rule.scope, decision='allowed' if allowed else 'limited',
+            ).inc()
+            if not allowed:
+                retry_after = max(retry_after or 0, wait)
+        return retry_after
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Process-wide limiter built from RATE_LIMITS and RATE_LIMIT_BACKEND"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                rules = {
+                    route: [parse_rule(config) for config in configs]
+                    for route, configs in getattr(settings, 'RATE_LIMITS', {}).items()
+                }
+                if getattr(settings, 'RATE_LIMIT_BACKEND', 'memory') == 'redis':
+                    backend = RedisBackend(settings.RATE_LIMIT_REDIS_URL)
+                else:
+                    backend = MemoryBackend()
+                _limiter = RateLimiter(backend, rules)
+    return _limiter
+
+
+@receiver(setting_changed)
+def reset_rate_limiter(setting=None, **kwargs):
+    """Rebuild the limiter (and empty memory buckets) when its settings change"""
+    global _limiter
+    if setting is None or setting.startswith('RATE_LIMIT'):
+        with _limiter_lock:
+            _limiter = None
@@ -0,0 +1,307 @@
+import json
+import time
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .events import publish_status_change
+from .metrics import PAYMENT_LOG_ENTRIES, RECONCILED_ORDERS
+from .models import Order, PaymentLog
+from .gateway_registry import get_gateway
+from .settlement import settle_payment
+from .signals import payment_logs_written
+from .stats import apply_bulk_order_changes
+from .status_cache import invalidate_payment_statuses
+
+logger = logging.getLogger(__name__)
+
+# Orders in these states are still waiting on a payment
+PENDING_STATUSES = ('pending', 'processing')
+
+# Lookup results
+COMPLETED = 'completed'
+PENDING = 'pending'
+CLOSED = 'closed'          # The gateway says the payment can no longer complete
+NOT_FOUND = 'not_found'    # The gateway has no record of the payment
+UNVERIFIABLE = 'unverifiable'  # No status API for this gateway
+ERROR = 'error'
+
+# Khalti lookup statuses after which a payment can't turn into 'Completed'
+KHALTI_CLOSED_STATUSES = ('Expired', 'User canceled')
+
+
+def lookup_khalti(pidx):
+    """Look up a Khalti payment and classify the result"""
+    response = get_gateway('khalti').lookup(pidx)
+    if response.status_code == 404:
+        return NOT_FOUND, {}
+    if response.status_code != 200:
+        return ERROR, {'error': f"HTTP {response.status_code}"}
+    data = response.json()
+    if data.get('status') == 'Completed':
+        return COMPLETED, data
+    if data.get('status') in KHALTI_CLOSED_STATUSES:
+        return CLOSED, data
+    return PENDING, data
+
+
+# eSewa statuses after which a payment can't turn into COMPLETE
+ESEWA_CLOSED_STATUSES = ('CANCELED', 'FULL_REFUND', 'PARTIAL_REFUND')
+
+
+def classify_esewa(result):
+    """Classify an EsewaStatus, shaping completed ones for settle_payment"""
+    if result.completed:
+        return COMPLETED, {
+            'transaction_id': result.ref_id or result.transaction_uuid,
+            'total_amount': round(float(result.total_amount or 0) * 100),  # Paisa, as settlement expects
+            'transaction_uuid': result.transaction_uuid,
+            'status': result.status,
+        }
+    if result.status in ESEWA_CLOSED_STATUSES:
+        return CLOSED, {'status': result.status}
+    if result.status == 'NOT_FOUND':
+        return NOT_FOUND, {}
+    if result.status == 'ERROR':
+        return ERROR, {'error': result.error}
+    return PENDING, {'status': result.status}
+
+
+def lookup_esewa_many(transactions, concurrency, throttle):
+    """``{transaction_uuid: (result, data)}`` for ``(transaction_uuid, total_amount)`` pairs"""
+    results = get_gateway('esewa').transaction_statuses(
+        [(None, amount, transaction_uuid) for transaction_uuid, amount in transactions],
+        concurrency=concurrency, throttle=throttle,
+    )
+    return {transaction_uuid: classify_esewa(result) for transaction_uuid, result in results.items()}
+
+
+# Gateway name (as logged) -> function taking the initiated transaction id
+LOOKUPS = {
+    'Khalti': lookup_khalti,
+}
+
+# Gateway name -> function checking a whole chunk's transactions at once
+BATCH_LOOKUPS = {
+    'eSewa': lookup_esewa_many,
+}
+
+
+class RateLimiter:
+    """Space calls at least ``1 / rate`` seconds apart, across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def latest_initiated(order_pks):
+    """``{order pk: (payment_method, transaction_id)}`` from each order's newest Initiated log"""
+    latest = {}
+    rows = PaymentLog.objects.filter(order_id__in=order_pks, status='Initiated').order_by(
+        'order_id', '-created_at', '-id',
+    ).values_list('order_id', 'payment_method', 'transaction_id')
+    for order_pk, payment_method, transaction_id in rows:
+        latest.setdefault(order_pk, (payment_method, transaction_id))
+    return latest
+
+
+class Reconciler:
+    """Settle or expire unpaid orders whose gateway callback never arrived.
+
+    Pending orders older than ``min_age`` are read in primary-key chunks.
+    Each order's newest Initiated log says which gateway and transaction
+    to look up; lookups run on a bounded thread pool under a shared rate
+    limit (eSewa's per chunk, through its batched status check), while
+    all database work stays on the calling thread. Completed
+    payments go through the settlement engine. Orders the gateway closed,
+    or that can't be verified and are older than ``expire_after``, are
+    cancelled with one bulk update per chunk. With a checkpoint file an
+    interrupted run resumes after the last finished chunk.
+    """
+
+    def __init__(self, concurrency=None, rate_limit=None, chunk_size=None, min_age=None, expire_after=None,
+                 checkpoint=None, dry_run=False):
+        self.concurrency = concurrency or getattr(settings, 'RECONCILE_CONCURRENCY', 10)
+        self.rate_limit = rate_limit if rate_limit is not None else getattr(settings, 'RECONCILE_RATE_LIMIT', 100)
+        self.chunk_size = chunk_size or getattr(settings, 'RECONCILE_CHUNK_SIZE', 500)
+        self.min_age = min_age if min_age is not None else getattr(settings, 'RECONCILE_MIN_AGE', 1800)
+        self.expire_after = expire_after if expire_after is not None else getattr(settings, 'RECONCILE_EXPIRE_AFTER', 86400)
+        self.checkpoint = Path(checkpoint) if checkpoint else None
+        self.dry_run = dry_run
+        self.limiter = RateLimiter(self.rate_limit)
+        self.summary = Counter()
+
+    def run(self, resume=False):
+        """Reconcile every eligible order and return counts per result"""
+        state = self._load_checkpoint() if resume else None
+        if state:
+            last_pk = state['last_pk']
+            cutoff = parse_datetime(state['cutoff'])
+            expire_before = parse_datetime(state['expire_before'])
+            self.summary.update(state['summary'])
+            logger.info("Resuming reconciliation after order pk %s", last_pk)
+        else:
+            now = timezone.now()
+            last_pk = 0
+            cutoff = now - timedelta(seconds=self.min_age)
+            expire_before = now - timedelta(seconds=self.expire_after)
+
+        pending = Order.objects.filter(
+            is_paid=False, status__in=PENDING_STATUSES, created_at__lte=cutoff,
+        ).order_by('pk').values_list('pk', 'order_id', 'total_price', 'created_at')
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                # Keyset chunks rather than one open cursor: this loop writes to
+                # the rows it reads, and each chunk is a natural resume point
+                chunk = list(pending.filter(pk__gt=last_pk)[:self.chunk_size])
+                if not chunk:
+                    break
+                self._reconcile_chunk(executor, chunk, expire_before)
+                last_pk = chunk[-1][0]
+                self._save_checkpoint(last_pk, cutoff, expire_before)
+
+        self._clear_checkpoint()
+        return dict(self.summary)
+
+    def _batch_lookups(self, chunk, initiated):
+        """``{(gateway, transaction id): result}`` for gateways with a batch lookup"""
+        transactions = {}
+        for pk, _, total_price, _ in chunk:
+            if pk in initiated and initiated[pk][0] in BATCH_LOOKUPS:
+                transactions.setdefault(initiated[pk][0], []).append((initiated[pk][1], total_price))
+        results = {}
+        for gateway, items in transactions.items():
+            found = BATCH_LOOKUPS[gateway](items, self.concurrency, self.limiter.wait)
+            results.update(((gateway, transaction_id), result) for transaction_id, result in found.items())
+        return results
+
+    def _lookup(self, initiated, batched):
+        if initiated is None:
+            return None
+        if initiated in batched:
+            return batched[initiated]
+        lookup = LOOKUPS.get(initiated[0])
+        if lookup is None:
+            return UNVERIFIABLE, {}
+        self.limiter.wait()
+        try:
+            return lookup(initiated[1])
+        except requests.RequestException as e:
+            # Includes an open circuit; the order is picked up again next run
+            return ERROR, {'error': str(e)}
+
+    def _reconcile_chunk(self, executor, chunk, expire_before):
+        initiated = latest_initiated([row[0] for row in chunk])
+        batched = self._batch_lookups(chunk, initiated)
+        results = executor.map(lambda row: self._lookup(initiated.get(row[0]), batched), chunk)
+
+        to_expire = []
+        for (pk, order_id, total_price, created_at), result in zip(chunk, results):
+            if result is None:
+                # Never sent to a gateway, so there is nothing to reconcile
+                self._count('', 'not_initiated')
+                continue
+            payment_method, transaction_id = initiated[pk]
+            status, data = result
+
+            if status == COMPLETED and not self.dry_run:
+                outcome = settle_payment(
+                    order_id, payment_method, data.get('transaction_id'), data.get('total_amount', 0), data,
+                )
+                self._count(payment_method, outcome)
+            elif status == CLOSED or (status in (NOT_FOUND, UNVERIFIABLE) and created_at < expire_before):
+                to_expire.append((pk, payment_method, transaction_id, status))
+            else:
+                self._count(payment_method, status)
+
+        if to_expire and not self.dry_run:
+            self._expire(to_expire)
+        elif to_expire:
+            for _, payment_method, _, _ in to_expire:
+                self._count(payment_method, 'expired')
+
+    def _expire(self, to_expire):
+        """Cancel still-unpaid orders with one UPDATE, keeping stats, cache and subscribers in step"""
+        details = {pk: (payment_method, transaction_id, status) for pk, payment_method, transaction_id, status in to_expire}
+        with transaction.atomic():
+            # Re-read under lock: a callback may have settled some since the lookup
+            rows = list(Order.objects.select_for_update().filter(
+                pk__in=list(details), is_paid=False, status__in=PENDING_STATUSES,
+            ).values('pk', 'order_id', 'total_price', *Order.TRACKED_FIELDS))
+            if not rows:
+                return
+            pks = [row['pk'] for row in rows]
+            Order.objects.filter(pk__in=pks).update(status='cancelled', updated_at=timezone.now())
+
+            # update() sends no post_save, so do what the receivers would have done
+            apply_bulk_order_changes([(row, dict(row, status='cancelled')) for row in rows])
+            invalidate_payment_statuses(pks)
+
+            logs = []
+            for row in rows:
+                payment_method, transaction_id, status = details[row['pk']]
+                logs.append(PaymentLog(
+                    order_id=row['pk'], payment_method=payment_method, transaction_id=transaction_id,
+                    amount=row['total_price'], status='Cancelled',
+                    gateway_response={'reason': 'expired', 'lookup': status},
+                ))
+                PAYMENT_LOG_ENTRIES.labels(gateway=payment_method, status='Cancelled', reason='expired').inc()
+                self._count(payment_method, 'expired')
+            PaymentLog.objects.bulk_create(logs, batch_size=self.chunk_size)
+            payment_logs_written.send(sender=PaymentLog, entries=logs)
+
+            expired = [
+                Order(pk=row['pk'], order_id=row['order_id'], is_paid=False, status='cancelled',
+                      payment_method=row['payment_method'], transaction_id=row['transaction_id'])
+                for row in rows
+            ]
+            transaction.on_commit(lambda: [publish_status_change(order) for order in expired])
+
+    def _count(self, gateway, result):
+        self.summary[result] += 1
+        RECONCILED_ORDERS.labels(gateway=gateway, result=result).inc()
+
+    def _load_checkpoint(self):
+        if self.checkpoint is None or not self.checkpoint.exists():
+            return None
+        return json.loads(self.checkpoint.read_text())
+
+    def _save_checkpoint(self, last_pk, cutoff, expire_before):
+        if self.checkpoint is None:
+            return
+        state = {
+            'last_pk': last_pk,
+            'cutoff': cutoff.isoformat(),
+            'expire_before': expire_before.isoformat(),
+            'summary': dict(self.summary),
+        }
+        # Write then rename so a crash never leaves a half-written checkpoint
+        tmp = self.checkpoint.with_suffix('.tmp')
+        tmp.write_text(json.dumps(state))
+        tmp.replace(self.checkpoint)
+
+    def _clear_checkpoint(self):
+        if self.checkpoint is not None:
+            self.checkpoint.unlink(missing_ok=True)
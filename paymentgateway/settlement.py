@@ -0,0 +1,128 @@
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from .models import Order, PaymentSettlement
+from .log_sink import record_payment_log
+from .metrics import SETTLEMENTS
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of settle_payment
+SETTLED = 'settled'
+ALREADY_SETTLED = 'already_settled'
+AMOUNT_MISMATCH = 'amount_mismatch'
+ORDER_NOT_FOUND = 'order_not_found'
+TRANSACTION_REUSED = 'transaction_reused'
+
+def settlement_key(payment_method, transaction_id, order_id=None):
+    return f"{payment_method}:{transaction_id or order_id}"
+
+
+def _cache_key(key):
+    return f"payment-settled:{key}"
+
+
+def already_settled(payment_method, transaction_id, order_id=None):
+    """True if this gateway payment is known to have settled; checks only the cache"""
+    return cache.get(_cache_key(settlement_key(payment_method, transaction_id, order_id))) is not None
+
+
+async def aalready_settled(payment_method, transaction_id, order_id=None):
+    return await cache.aget(_cache_key(settlement_key(payment_method, transaction_id, order_id))) is not None
+
+
+def settle_payment(order_id, payment_method, transaction_id, amount, gateway_response):
+    """Apply a successful gateway payment to an order exactly once.
+
+    ``amount`` is in paisa and must equal the order total. Replays are
+    answered from the dedupe cache without touching the database; otherwise
+    the order row is locked, so concurrent callbacks, webhooks and task
+    retries serialize on it and only the first one marks the order paid,
+    records the idempotency key and logs a Success entry. Saving through the
+    model keeps the stats, status cache and status events up to date.
+    """
+    outcome = _settle(order_id, payment_method, transaction_id, amount, gateway_response)
+    SETTLEMENTS.labels(gateway=payment_method, outcome=outcome).inc()
+    return outcome
+
+
+def _settle(order_id, payment_method, transaction_id, amount, gateway_response):
+    key = settlement_key(payment_method, transaction_id, order_id)
+    settled_order = cache.get(_cache_key(key))
+    if settled_order is not None:
+        return ALREADY_SETTLED if settled_order == order_id else TRANSACTION_REUSED
+
+    try:
+        with transaction.atomic():
+            try:
+                order = Order.objects.select_for_update().get(order_id=order_id)
+            except Order.DoesNotExist:
+                return ORDER_NOT_FOUND
+
+            if PaymentSettlement.objects.filter(key=key).exclude(order=order).exists():
+                logger.error(
+                    "%s payment %s already settled another order, not %s", payment_method, transaction_id, order_id,
+                    extra={'gateway': payment_method, 'order_id': order_id, 'transaction_id': transaction_id},
+                )
+                return TRANSACTION_REUSED
+
+            if order.is_paid:
+                if order.transaction_id != transaction_id:
+                    logger.warning(
+                        "%s payment %s arrived for order %s already settled by %s",
+                        payment_method, transaction_id, order_id, order.transaction_id,
+                        extra={'gateway': payment_method, 'order_id': order_id, 'transaction_id': transaction_id},
+                    )
+                outcome = ALREADY_SETTLED
+            elif amount != order.total_price * 100:
+                logger.error(
+                    "%s amount mismatch for order %s: expected %s, got %s",
+                    payment_method, order_id, order.total_price * 100, amount,
+                    extra={'gateway': payment_method, 'order_id': order_id, 'transaction_id': transaction_id},
+                )
+                return AMOUNT_MISMATCH
+            else:
+                order.is_paid = True
+                order.paid_amount = amount // 100  # Convert paisa to rupees
+                order.payment_method = payment_method
+                order.transaction_id = transaction_id
+                order.save()
+
+                PaymentSettlement.objects.create(
+                    key=key, order=order, payment_method=payment_method,
+                    transaction_id=transaction_id or '', amount=order.paid_amount,
+                )
+                record_payment_log(
+                    order=order,
+                    payment_method=payment_method,
+                    transaction_id=transaction_id,
+                    amount=order.paid_amount,
+                    status='Success',
+                    gateway_response=gateway_response
+                )
+                outcome = SETTLED
+
+            ttl = getattr(settings, 'PAYMENT_SETTLEMENT_DEDUPE_TTL', 86400)
+            transaction.on_commit(lambda: cache.set(_cache_key(key), order_id, ttl))
+    except IntegrityError:
+        # Another order claimed the same payment concurrently; never apply it twice
+        logger.error(
+            "%s payment %s already settled another order, not %s", payment_method, transaction_id, order_id,
+            extra={'gateway': payment_method, 'order_id': order_id, 'transaction_id': transaction_id},
+        )
+        return TRANSACTION_REUSED
+
+    if outcome == SETTLED:
+        logger.info(
+            "%s payment %s settled order %s", payment_method, transaction_id, order_id,
+            extra={'gateway': payment_method, 'order_id': order_id, 'transaction_id': transaction_id},
+        )
+    return outcome
+
+
+async def asettle_payment(*args, **kwargs):
+    return await sync_to_async(settle_payment)(*args, **kwargs)
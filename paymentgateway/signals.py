@@ -0,0 +1,48 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .models import Order
+from . import stats
+from .status_cache import invalidate_payment_status
+from .events import publish_status_change
+
+# Sent by the PaymentLog sink after entries reach the database, whether one
+# at a time or as a bulk_create batch (which doesn't fire post_save).
+# ``entries`` is a list of PaymentLog instances or entry dicts.
+payment_logs_written = Signal()
+
+
+@receiver(post_save, sender=Order)
+def update_order_stats(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    stats.apply_order_change(instance)
+
+
+@receiver(post_delete, sender=Order)
+def remove_order_stats(sender, instance, **kwargs):
+    stats.apply_order_deletion(instance)
+
+
+@receiver(post_save, sender=Order)
+def invalidate_cached_status(sender, instance, created, raw=False, **kwargs):
+    if not created and instance.tracked_changes() - {'created_at'}:
+        invalidate_payment_status(instance.pk)
+
+
+@receiver(post_save, sender=Order)
+def publish_status_event(sender, instance, created, raw=False, **kwargs):
+    # Every settlement path saves the order, so this covers verify, callbacks and webhooks
+    if not created and not raw and instance.tracked_changes() & {'is_paid', 'status'}:
+        transaction.on_commit(lambda: publish_status_change(instance))
+
+
+@receiver(post_delete, sender=Order)
+def drop_cached_status(sender, instance, **kwargs):
+    invalidate_payment_status(instance.pk)
+
+
+@receiver(payment_logs_written)
+def update_payment_log_stats(sender, entries, **kwargs):
+    stats.apply_payment_logs(entries)
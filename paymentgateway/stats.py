@@ -0,0 +1,194 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ArchivedPaymentLog, Order, OrderStat, PaymentLog, PaymentLogStat
+
+
+def _day(value):
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def _order_bucket(values):
+    """Stat bucket and revenue contribution for a snapshot of an order's fields"""
+    key = {
+        'date': _day(values['created_at']),
+        'payment_method': values['payment_method'] or '',
+        'status': values['status'],
+        'is_paid': values['is_paid'],
+    }
+    revenue = (values['paid_amount'] or 0) if values['is_paid'] else 0
+    return key, revenue
+
+
+def _increment(model, key, **deltas):
+    """Add ``deltas`` to a counter row once the surrounding transaction commits.
+
+    Counter rows are shared by every order of the day, so updating one inside
+    a settlement would hold its lock until commit and serialize all
+    settlements on it. A rolled-back transaction changes no counters; a
+    failed update is logged and fixed by ``rebuild_order_stats``.
+    """
+    transaction.on_commit(lambda: _apply_increment(model, key, deltas), robust=True)
+
+
+def _apply_increment(model, key, deltas):
+    updates = {name: F(name) + delta for name, delta in deltas.items()}
+    if model.objects.filter(**key).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **deltas)
+    except IntegrityError:
+        # Another writer created the bucket first
+        model.objects.filter(**key).update(**updates)
+
+
+def apply_order_change(order):
+    """Move an order between stat buckets after it was created or saved"""
+    current = {name: getattr(order, name) for name in Order.TRACKED_FIELDS}
+    new_key, new_revenue = _order_bucket(current)
+
+    previous = getattr(order, '_previous_values', None)
+    if previous is not None:
+        old_key, old_revenue = _order_bucket(previous)
+        if old_key == new_key and old_revenue == new_revenue:
+            return
+        _increment(OrderStat, old_key, order_count=-1, revenue=-old_revenue)
+
+    _increment(OrderStat, new_key, order_count=1, revenue=new_revenue)
+
+
+def apply_bulk_order_changes(changes):
+    """Move many orders between stat buckets after a bulk ``update()``, which sends no signals
+
+    ``changes`` holds ``(previous, current)`` dicts of ``Order.TRACKED_FIELDS``.
+    """
+    deltas = defaultdict(Counter)
+    for previous, current in changes:
+        old_key, old_revenue = _order_bucket(previous)
+        new_key, new_revenue = _order_bucket(current)
+        if old_key == new_key and old_revenue == new_revenue:
+            continue
+        old_delta, new_delta = deltas[tuple(old_key.items())], deltas[tuple(new_key.items())]
+        old_delta['order_count'] -= 1
+        old_delta['revenue'] -= old_revenue
+        new_delta['order_count'] += 1
+        new_delta['revenue'] += new_revenue
+
+    for key, delta in deltas.items():
+        if any(delta.values()):
+            _increment(OrderStat, dict(key), order_count=delta['order_count'], revenue=delta['revenue'])
+
+
+def apply_order_deletion(order):
+    key, revenue = _order_bucket({name: getattr(order, name) for name in Order.TRACKED_FIELDS})
+    _increment(OrderStat, key, order_count=-1, revenue=-revenue)
+
+
+def apply_payment_logs(entries):
+    """Count written PaymentLog entries (dicts or model instances) per bucket"""
+    counts, amounts = Counter(), Counter()
+    for entry in entries:
+        if not isinstance(entry, dict):
+            entry = {
+                'created_at': entry.created_at, 'payment_method': entry.payment_method,
+                'status': entry.status, 'amount': entry.amount,
+            }
+        key = (_day(entry['created_at']), entry['payment_method'], entry['status'])
+        counts[key] += 1
+        amounts[key] += entry.get('amount') or 0
+
+    # One UPDATE per bucket, however many entries a batch held
+    for (date, payment_method, status), count in counts.items():
+        _increment(
+            PaymentLogStat, {'date': date, 'payment_method': payment_method, 'status': status},
+            log_count=count, amount=amounts[(date, payment_method, status)],
+        )
+
+
+def order_totals():
+    """Dashboard totals, summed over the (small) stat table"""
+    totals = OrderStat.objects.aggregate(
+        total=Sum('order_count'),
+        paid=Sum(Case(When(is_paid=True, then='order_count'), default=0)),
+        pending=Sum(Case(When(is_paid=False, then='order_count'), default=0)),
+        revenue=Sum('revenue'),
+    )
+    return {name: value or 0 for name, value in totals.items()}
+
+
+def stats_summary(days=30):
+    """Totals plus per-gateway, per-status and daily breakdowns"""
+    since = timezone.localdate() - timedelta(days=days - 1)
+    by_gateway = OrderStat.objects.values('payment_method').annotate(
+        orders=Sum('order_count'), revenue=Sum('revenue'),
+    ).order_by('payment_method')
+    by_status = OrderStat.objects.values('status').annotate(orders=Sum('order_count')).order_by('status')
+    daily = OrderStat.objects.filter(date__gte=since).values('date').annotate(
+        orders=Sum('order_count'),
+        paid=Sum(Case(When(is_paid=True, then='order_count'), default=0)),
+        revenue=Sum('revenue'),
+    ).order_by('date')
+    logs = PaymentLogStat.objects.filter(date__gte=since).values('payment_method', 'status').annotate(
+        count=Sum('log_count'), amount=Sum('amount'),
+    ).order_by('payment_method', 'status')
+
+    return {
+        'totals': order_totals(),
+        'by_gateway': [
+            {'payment_method': row['payment_method'] or None, 'orders': row['orders'], 'revenue': row['revenue']}
+            for row in by_gateway
+        ],
+        'by_status': list(by_status),
+        'daily': [dict(row, date=row['date'].isoformat()) for row in daily],
+        'payment_logs': list(logs),
+    }
+
+
+@transaction.atomic
+def rebuild_stats():
+    """Recompute every stat bucket from the Order, PaymentLog and archived log tables"""
+    OrderStat.objects.all().delete()
+    PaymentLogStat.objects.all().delete()
+
+    order_rows = Order.objects.annotate(
+        date=TruncDate('created_at'), method=Coalesce('payment_method', Value('')),
+    ).values('date', 'method', 'status', 'is_paid').annotate(
+        order_count=Count('id'),
+        revenue=Sum(Case(When(is_paid=True, then='paid_amount'), default=0, output_field=IntegerField())),
+    ).order_by()
+    OrderStat.objects.bulk_create([
+        OrderStat(
+            date=row['date'], payment_method=row['method'], status=row['status'],
+            is_paid=row['is_paid'], order_count=row['order_count'], revenue=row['revenue'] or 0,
+        )
+        for row in order_rows
+    ], batch_size=1000)
+
+    # Archived logs still count towards the history (file archives can't be included)
+    log_counts, log_amounts = Counter(), Counter()
+    for model in (PaymentLog, ArchivedPaymentLog):
+        log_rows = model.objects.annotate(date=TruncDate('created_at')).values(
+            'date', 'payment_method', 'status',
+        ).annotate(log_count=Count('id'), total=Sum('amount')).order_by()
+        for row in log_rows:
+            key = (row['date'], row['payment_method'], row['status'])
+            log_counts[key] += row['log_count']
+            log_amounts[key] += row['total'] or 0
+    PaymentLogStat.objects.bulk_create([
+        PaymentLogStat(
+            date=date, payment_method=payment_method, status=status,
+            log_count=count, amount=log_amounts[(date, payment_method, status)],
+        )
+        for (date, payment_method, status), count in log_counts.items()
+    ], batch_size=1000)
+
+    return OrderStat.objects.count(), PaymentLogStat.objects.count()
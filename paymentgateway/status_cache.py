@@ -0,0 +1,124 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+
+from .db_routing import orders_pinned, pin_orders
+from .models import Order
+
+STATUS_FIELDS = ('id', 'is_paid', 'status', 'payment_method', 'transaction_id', 'updated_at')
+
+
+def _key(order_pk):
+    return f"payment-status:{order_pk}"
+
+
+def _timeout():
+    return getattr(settings, 'PAYMENT_STATUS_CACHE_TTL', 300)
+
+
+def _entry(row):
+    """Cacheable status payload plus the validators used for conditional GETs"""
+    payload = {
+        'is_paid': row['is_paid'],
+        'order_status': row['status'],
+        'payment_method': row['payment_method'],
+        'transaction_id': row['transaction_id'],
+    }
+    digest = hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    return {'payload': payload, 'etag': f'"{digest}"', 'updated_at': row['updated_at'].isoformat()}
+
+
+def last_modified(entry):
+    return parse_datetime(entry['updated_at'])
+
+
+def _status_rows(order_pks):
+    """Status rows for ``order_pks``, from the primary if any of them changed moments ago.
+
+    A replica may not have the settlement yet, and whatever is read here
+    is cached for the whole TTL.
+    """
+    rows = Order.objects.filter(pk__in=order_pks).values(*STATUS_FIELDS)
+    return rows.using(DEFAULT_DB_ALIAS) if orders_pinned(order_pks) else rows
+
+
+def get_payment_status(order_pk):
+    """Cached status entry for one order, or ``None`` if it doesn't exist"""
+    entry = cache.get(_key(order_pk))
+    if entry is None:
+        row = _status_rows([order_pk]).first()
+        if row is None:
+            return None
+        entry = _entry(row)
+        cache.set(_key(order_pk), entry, _timeout())
+    return entry
+
+
+def get_payment_statuses(order_pks):
+    """Cached status entries for many orders with one cache round-trip and at most one query"""
+    keys = {_key(pk): pk for pk in order_pks}
+    cached = cache.get_many(list(keys))
+    entries = {keys[key]: entry for key, entry in cached.items()}
+
+    missing = [pk for pk in order_pks if pk not in entries]
+    if missing:
+        fresh = {row['id']: _entry(row) for row in _status_rows(missing)}
+        if fresh:
+            cache.set_many({_key(pk): entry for pk, entry in fresh.items()}, _timeout())
+        entries.update(fresh)
+    return entries
+
+
+def invalidate_payment_status(order_pk):
+    """Drop the cached status now and again once the surrounding transaction commits.
+
+    After the commit the order is pinned to the primary until replicas catch up.
+    """
+    key = _key(order_pk)
+    cache.delete(key)
+
+    def committed():
+        # A poll between the save and the commit could re-cache the old row
+        cache.delete(key)
+        pin_orders([order_pk])
+    transaction.on_commit(committed)
+
+
+def invalidate_payment_statuses(order_pks):
+    """Bulk version of ``invalidate_payment_status`` for rows changed with ``update()``"""
+    keys = [_key(pk) for pk in order_pks]
+    cache.delete_many(keys)
+
+    def committed():
+        cache.delete_many(keys)
+        pin_orders(order_pks)
+    transaction.on_commit(committed)
+
+
+def status_response(request, payload, etag, modified):
+    """JSON status response with validators, or a 304 when the client is current"""
+    timestamp = int(modified.timestamp()) if modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = JsonResponse({'status': 'success', **payload})
+    response['ETag'] = etag
+    if timestamp:
+        response['Last-Modified'] = http_date(timestamp)
+    # Let browsers keep the body but revalidate on every poll
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def combined_validators(entries, requested):
+    """ETag and Last-Modified covering the status entries for the ``requested`` ids"""
+    parts = [str(pk) + entries[pk]['etag'] if pk in entries else str(pk) for pk in requested]
+    digest = hashlib.md5('|'.join(parts).encode()).hexdigest()
+    modified = max((last_modified(entry) for entry in entries.values()), default=None)
+    return f'"{digest}"', modified
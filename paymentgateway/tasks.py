@@ -0,0 +1,148 @@
+import logging
+
+import requests
+from celery import shared_task
+from celery.signals import task_postrun
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Order
+from .log_sink import get_payment_log_sink
+from .gateway_registry import get_gateway
+from .reconciliation import Reconciler
+from .archive import archive_payment_logs
+
+logger = logging.getLogger(__name__)
+
+# Khalti lookup statuses that can still turn into 'Completed'
+KHALTI_PENDING_STATUSES = ('Pending', 'Initiated')
+
+
+def _set_order_status(order_id, status, from_statuses):
+    """Move an unpaid order to ``status`` if it is currently in one of ``from_statuses``"""
+    order = Order.objects.filter(order_id=order_id, is_paid=False, status__in=from_statuses).first()
+    if order:
+        order.status = status
+        order.save(update_fields=['status', 'updated_at'])
+    return order
+
+
+def mark_order_processing(order):
+    """Flag an order as awaiting background verification"""
+    if not order.is_paid and order.status in ('pending', 'failed'):
+        order.status = 'processing'
+        order.save(update_fields=['status', 'updated_at'])
+
+
+def _retry_or_release(task, order_id, exc):
+    """Retry the verification with backoff, or hand the order back as pending"""
+    if task.request.retries < task.max_retries:
+        raise task.retry(exc=exc, countdown=min(2 ** task.request.retries * 5, 300))
+
+    logger.warning(
+        "Giving up verification for order %s after %d retries: %s", order_id, task.request.retries, exc,
+        extra={'order_id': order_id},
+    )
+    # Leave it pending so a later callback or reconciliation can settle it
+    _set_order_status(order_id, 'pending', ('processing',))
+
+
+def _verify_khalti(task, pidx, order_id):
+    """Look up a Khalti payment and settle the order, retrying through ``task``"""
+    if order_id and Order.objects.filter(order_id=order_id, is_paid=True).exists():
+        # Already settled by a webhook, the redirect or an earlier attempt; skip the lookup
+        return True
+    try:
+        success, response = get_gateway('khalti').verify_payment(
+            pidx, order_id=order_id, raise_on_network_error=True
+        )
+    except requests.RequestException as e:
+        return _retry_or_release(task, order_id, e)
+
+    if success:
+        return True
+
+    if response.get('status') in KHALTI_PENDING_STATUSES:
+        return _retry_or_release(task, order_id, f"Khalti status {response.get('status')}")
+
+    _set_order_status(order_id, 'failed', ('processing', 'pending'))
+    return False
+
+
+@shared_task(bind=True, max_retries=getattr(settings, 'PAYMENT_VERIFY_MAX_RETRIES', 5))
+def verify_khalti_payment(self, pidx, order_id):
+    """Look up a Khalti payment and settle the order"""
+    return _verify_khalti(self, pidx, order_id)
+
+
+@shared_task(bind=True, max_retries=getattr(settings, 'PAYMENT_VERIFY_MAX_RETRIES', 5))
+def process_khalti_webhook(self, pidx, order_id=None):
+    """Settle an order from a Khalti webhook, confirming the payment with a lookup first"""
+    return _verify_khalti(self, pidx, order_id)
+
+
+@shared_task(bind=True, max_retries=getattr(settings, 'PAYMENT_VERIFY_MAX_RETRIES', 5))
+def verify_esewa_payment(self, oid, amt, refId, transaction_uuid=None):
+    """Verify an eSewa transaction and settle the order"""
+    try:
+        success, message = get_gateway('esewa').verify_transaction(
+            oid, amt, refId, raise_on_network_error=True, transaction_uuid=transaction_uuid
+        )
+    except requests.RequestException as e:
+        return _retry_or_release(self, oid, e)
+
+    if success is None:
+        # eSewa's answer may still change; NOT_FOUND only fails once retries run out
+        if message != 'NOT_FOUND' or self.request.retries < self.max_retries:
+            return _retry_or_release(self, oid, f"eSewa status {message}")
+        order = _set_order_status(oid, 'failed', ('processing', 'pending'))
+        if order:
+            get_gateway('esewa')._log_failed_payment(order, refId, amt, "Transaction not found")
+        return False
+
+    if not success:
+        logger.warning(
+            "eSewa verification failed for order %s: %s", oid, message, extra={'gateway': 'eSewa', 'order_id': oid}
+        )
+        _set_order_status(oid, 'failed', ('processing', 'pending'))
+    return success
+
+
+@shared_task
+def reconcile_pending_payments():
+    """Scheduled reconciliation of orders whose gateway callback never arrived"""
+    lock = 'reconcile-pending-payments'
+    # One run at a time across workers; a run killed mid-way resumes from its checkpoint
+    if not cache.add(lock, 1, getattr(settings, 'RECONCILE_LOCK_TTL', 3600)):
+        logger.info("Reconciliation already running, skipping")
+        return None
+    try:
+        summary = Reconciler(checkpoint=getattr(settings, 'RECONCILE_CHECKPOINT_FILE', None)).run(resume=True)
+    finally:
+        cache.delete(lock)
+    logger.info("Reconciliation finished: %s", summary)
+    return summary
+
+
+@shared_task
+def archive_old_payment_logs():
+    """Move payment logs past PAYMENT_LOG_RETENTION_DAYS into the archive"""
+    lock = 'archive-payment-logs'
+    if not cache.add(lock, 1, getattr(settings, 'PAYMENT_LOG_ARCHIVE_LOCK_TTL', 3600)):
+        logger.info("Payment log archival already running, skipping")
+        return None
+    try:
+        return archive_payment_logs()
+    finally:
+        cache.delete(lock)
+
+
+@task_postrun.connect
+def flush_payment_logs_after_task(**kwargs):
+    """Write any PaymentLog entries a task buffered before the worker moves on"""
+    sink = get_payment_log_sink()
+    if sink.buffered:
+        try:
+            sink.flush()
+        except Exception as e:
+            logger.error("PaymentLog flush after task failed: %s", e)
@@ -1,3 +1,1327 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from urllib.parse import urlsplit
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import httpx
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+from prometheus_client import REGISTRY
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from core.celery import app as celery_app
+from . import async_views
+from .models import ArchivedPaymentLog, Order, OrderStat, PaymentLog, PaymentLogStat, PaymentSettlement
+from .log_sink import PaymentLogSink
+from .metrics import time_queries
+from .log_handlers import QueueLogHandler
+from .fake_gateway import FakeGatewayServer
+from .payment_gateways import EsewaPaymentGateway, EsewaStatus, KhaltiPaymentGateway, parse_khalti_lookup
+from .gateway_registry import get_gateway
+from .db_routing import end_request, replica_reads, start_request
+from .rate_limit import MemoryBackend, RateLimiter, reset_rate_limiter
+from .http_client import GatewayHTTPClient, get_async_http_client
+from .circuit_breaker import CLOSED, OPEN, CircuitBreaker, get_breaker
+from .reconciliation import Reconciler
+from .pagination import EstimatedCountPaginator
+from .archive import archive_payment_logs, archived_logs_for
+from . import events
+from .events import get_broker, order_channel
+from .settlement import ALREADY_SETTLED, AMOUNT_MISMATCH, SETTLED, TRANSACTION_REUSED, settle_payment
+from .stats import order_totals, rebuild_stats
+from .status_cache import _status_rows, invalidate_payment_status
+from .urls import urlpatterns as app_urlpatterns
+
+
+def gateway_response(payload, status_code=200):
+    """Build a requests.Response as returned by the gateway HTTP client"""
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(payload).encode()
+    return response
+
+
+@override_settings(
+    KHALTI_VERIFY_URL='https://khalti.test/api/v2/epayment/lookup/',
+    KHALTI_SECRET_KEY='test_secret_key',
+    PAYMENT_QUEUE_VERIFICATION=True,
+)
+class QueuedVerificationTests(TestCase):
+    """Callbacks hand verification to the (eager) task queue"""
+
+    def setUp(self):
+        celery_app.conf.task_always_eager = True
+        cache.clear()
+        self.order = Order.objects.create(name='Test Customer', total_price=1000)
+
+    def khalti_callback(self):
+        return self.client.get(reverse('khalti_success'), {
+            'pidx': 'PIDX123',
+            'purchase_order_id': self.order.order_id,
+            'status': 'Completed',
+            'transaction_id': 'TXN123',
+            'amount': '100000',
+        })
+
+    def test_khalti_callback_redirects_to_processing_and_settles(self):
+        lookup = gateway_response({
+            'pidx': 'PIDX123',
+            'status': 'Completed',
+            'total_amount': 100000,
+            'transaction_id': 'TXN123',
+        })
+        with mock.patch('paymentgateway.http_client.GatewayHTTPClient.request', return_value=lookup) as request:
+            response = self.khalti_callback()
+
+        self.assertRedirects(
+            response, reverse('payment_processing', args=[self.order.id]), fetch_redirect_response=False
+        )
+        # A Completed redirect is still confirmed with a lookup
+        request.assert_called_once()
+        self.assertEqual(json.loads(request.call_args.kwargs['data']), {'pidx': 'PIDX123'})
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.is_paid)
+        self.assertEqual(self.order.status, 'paid')
+        self.assertEqual(self.order.transaction_id, 'TXN123')
+        self.assertTrue(PaymentLog.objects.filter(order=self.order, status='Success').exists())
+
+        status = self.client.get(reverse('payment_status', args=[self.order.id])).json()
+        self.assertTrue(status['is_paid'])
+
+    def test_khalti_network_errors_are_retried_then_released(self):
+        with mock.patch(
+            'paymentgateway.http_client.GatewayHTTPClient.request',
+            side_effect=requests.ConnectionError('gateway down'),
+        ) as request:
+            self.khalti_callback()
+
+        self.assertGreater(request.call_count, 1)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.is_paid)
+        self.assertEqual(self.order.status, 'pending')
+
+    def test_khalti_expired_payment_marks_order_failed(self):
+        lookup = gateway_response({'pidx': 'PIDX123', 'status': 'Expired', 'total_amount': 100000})
+        with mock.patch('paymentgateway.http_client.GatewayHTTPClient.request', return_value=lookup):
+            self.khalti_callback()
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'failed')
+        status = self.client.get(reverse('payment_status', args=[self.order.id])).json()
+        self.assertEqual(status['order_status'], 'failed')
+
+
+@override_settings(
+    KHALTI_VERIFY_URL='https://khalti.test/api/v2/epayment/lookup/',
+    KHALTI_SECRET_KEY='test_secret_key',
+    KHALTI_WEBHOOK_SECRET='webhook_secret',
+)
+class KhaltiWebhookTests(TestCase):
+    """Webhooks are signature-checked, deduplicated and settled once"""
+
+    def setUp(self):
+        celery_app.conf.task_always_eager = True
+        cache.clear()
+        self.order = Order.objects.create(name='Test Customer', total_price=1000)
+        self.lookup = gateway_response({
+            'pidx': 'PIDX123', 'status': 'Completed', 'total_amount': 100000, 'transaction_id': 'TXN123',
+        })
+
+    def deliver(self, signature=None):
+        body = json.dumps({'pidx': 'PIDX123', 'status': 'Completed', 'purchase_order_id': self.order.order_id})
+        if signature is None:
+            signature = hmac.new(b'webhook_secret', body.encode(), hashlib.sha256).hexdigest()
+        return self.client.post(
+            reverse('khalti_webhook'), body, content_type='application/json', HTTP_X_KHALTI_SIGNATURE=signature,
+        )
+
+    def test_invalid_signature_is_rejected(self):
+        self.assertEqual(self.deliver(signature='forged').status_code, 401)
+
+    def test_redeliveries_and_redirect_settle_once(self):
+        with mock.patch('paymentgateway.http_client.GatewayHTTPClient.request', return_value=self.lookup) as request:
+            self.assertEqual(self.deliver().json(), {'status': 'success'})
+            self.assertTrue(self.deliver().json()['duplicate'])
+            # The browser redirect arriving afterwards must not log a second success
+            self.client.get(reverse('khalti_success'), {
+                'pidx': 'PIDX123', 'transaction_id': 'TXN123', 'purchase_order_id': self.order.order_id,
+                'amount': '100000', 'status': 'Completed',
+            })
+
+        self.assertEqual(request.call_count, 1)
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.is_paid)
+        self.assertEqual(PaymentLog.objects.filter(order=self.order, status='Success').count(), 1)
+
+
+class SettlementTests(TestCase):
+    """Every callback path settles through one locked, idempotent engine"""
+
+    def setUp(self):
+        cache.clear()
+        self.order = Order.objects.create(name='Test Customer', total_price=1000)
+
+    def settle(self, order=None, transaction_id='REF123', amount=100000):
+        order = order or self.order
+        with self.captureOnCommitCallbacks(execute=True):
+            return settle_payment(order.order_id, 'eSewa', transaction_id, amount, {'refId': transaction_id})
+
+    def test_replays_are_answered_from_cache(self):
+        self.assertEqual(self.settle(), SETTLED)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.settle(), ALREADY_SETTLED)
+        self.assertEqual(PaymentLog.objects.filter(order=self.order, status='Success').count(), 1)
+        self.assertEqual(PaymentSettlement.objects.get().order, self.order)
+
+    @override_settings(PAYMENT_QUEUE_VERIFICATION=False)
+    def test_khalti_redirect_parameters_never_settle(self):
+        lookup = gateway_response({'pidx': 'FORGED', 'status': 'Pending', 'total_amount': 100000})
+        with mock.patch('paymentgateway.http_client.GatewayHTTPClient.request', return_value=lookup) as request:
+            self.client.get(reverse('khalti_success'), {
+                'pidx': 'FORGED', 'status': 'Completed', 'purchase_order_id': self.order.order_id,
+                'transaction_id': 'anything',
+            })
+
+        request.assert_called_once()
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.is_paid)
+        self.assertFalse(PaymentSettlement.objects.exists())
+
+    def test_amount_mismatch_leaves_order_unpaid(self):
+        self.assertEqual(self.settle(amount=50000), AMOUNT_MISMATCH)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.is_paid)
+
+    def test_payment_cannot_settle_two_orders(self):
+        self.assertEqual(self.settle(), SETTLED)
+        other = Order.objects.create(name='Other Customer', total_price=1000)
+        cache.clear()
+        self.assertEqual(self.settle(order=other), TRANSACTION_REUSED)
+        other.refresh_from_db()
+        self.assertFalse(other.is_paid)
+
+    def test_duplicate_esewa_callbacks_log_one_success(self):
+        params = {'oid': self.order.order_id, 'amt': '1000.0', 'refId': 'REF123'}
+        with override_settings(PAYMENT_QUEUE_VERIFICATION=False):
+            for _ in range(2):
+                response = self.client.get(reverse('esewa_success'), params)
+                self.assertRedirects(
+                    response, reverse('order_success', args=[self.order.id]), fetch_redirect_response=False
+                )
+        self.assertEqual(PaymentLog.objects.filter(order=self.order, status='Success').count(), 1)
+
+
+class FakeGatewayServerTests(TestCase):
+    """The benchmark's stand-in gateway speaks enough Khalti for a full payment"""
+
+    def test_khalti_initiate_then_lookup_settles(self):
+        order = Order.objects.create(name='Test Customer', total_price=1000)
+        with FakeGatewayServer() as gateway, override_settings(**gateway.settings()):
+            khalti = KhaltiPaymentGateway()
+            success, initiated = khalti.initiate_payment(order)
+            self.assertTrue(success)
+            success, _ = khalti.verify_payment(initiated['pidx'], order_id=order.order_id)
+            # Repeated lookups of a pidx report the same transaction, as Khalti's do
+            lookups = {khalti.lookup(initiated['pidx']).json()['transaction_id'] for _ in range(2)}
+
+        self.assertTrue(success)
+        order.refresh_from_db()
+        self.assertTrue(order.is_paid)
+        self.assertEqual(order.paid_amount, 1000)
+        self.assertEqual(lookups, {order.transaction_id})
+
+    def test_error_rate_fails_requests(self):
+        with FakeGatewayServer(error_rate=1.0) as gateway:
+            response = requests.post(gateway.settings()['KHALTI_VERIFY_URL'], json={'pidx': 'x'}, timeout=5)
+        self.assertEqual(response.status_code, 503)
+
+
+@override_settings(GATEWAY_BREAKER_MIN_CALLS=2, GATEWAY_HTTP_MAX_RETRIES=0)
+class CircuitBreakerTests(TestCase):
+    """A failing gateway endpoint is cut off quickly and probed before it's trusted again"""
+
+    def setUp(self):
+        cache.clear()
+        self.order = Order.objects.create(name='Test Customer', total_price=1000)
+
+    def test_failures_open_the_circuit_and_checkout_fails_fast(self):
+        with FakeGatewayServer(error_rate=1.0) as gateway, override_settings(**gateway.settings()):
+            for _ in range(2):
+                KhaltiPaymentGateway().initiate_payment(self.order)
+            breaker = get_breaker(gateway.settings()['KHALTI_PAYMENT_URL'])
+            self.assertEqual(breaker.state(), OPEN)
+
+            with mock.patch('requests.Session.request') as send:
+                response = self.client.post(
+                    reverse('order_checkout', args=[self.order.id]), {'payment_method': 'khalti'}, follow=True
+                )
+            send.assert_not_called()
+
+        self.assertIn('Khalti is temporarily unavailable', response.content.decode())
+        self.assertTrue(PaymentLog.objects.filter(order=self.order, gateway_response__circuit_open=True).exists())
+
+    @override_settings(GATEWAY_BREAKER_OPEN_SECONDS=0)
+    def test_successful_probe_closes_the_circuit(self):
+        with FakeGatewayServer(error_rate=1.0) as gateway, override_settings(**gateway.settings()):
+            for _ in range(2):
+                KhaltiPaymentGateway().initiate_payment(self.order)
+            breaker = get_breaker(gateway.settings()['KHALTI_PAYMENT_URL'])
+            self.assertNotEqual(breaker.state(), CLOSED)
+
+            gateway.error_rate = 0.0
+            success, _ = KhaltiPaymentGateway().initiate_payment(self.order)
+
+        self.assertTrue(success)
+        self.assertEqual(breaker.state(), CLOSED)
+
+    def test_read_timeout_follows_observed_latency(self):
+        breaker = get_breaker('https://khalti.test/api/v2/epayment/lookup/')
+        self.assertEqual(breaker.read_timeout(10), 10)  # Too few samples to judge
+
+        for _ in range(50):
+            breaker.record(0.8, failed=False)
+        self.assertAlmostEqual(breaker.read_timeout(10), 2.4)
+
+        for _ in range(50):
+            breaker.record(0.05, failed=False)
+        self.assertAlmostEqual(breaker.read_timeout(10), 2.4)  # p99 still covers the slow calls
+
+
+class ReconciliationTests(TestCase):
+    """Orders abandoned at the gateway are settled or cancelled in bulk"""
+
+    def setUp(self):
+        cache.clear()
+
+    def initiated_order(self, gateway_name, transaction_id, age_hours, total_price=1000):
+        order = Order.objects.create(name='Test Customer', total_price=total_price)
+        order.created_at = timezone.now() - timezone.timedelta(hours=age_hours)
+        order.save()
+        PaymentLog.objects.create(
+            order=order, payment_method=gateway_name, transaction_id=transaction_id,
+            amount=total_price, status='Initiated',
+        )
+        return order
+
+    def test_completed_payments_settle_and_stale_ones_expire(self):
+        with FakeGatewayServer() as gateway, override_settings(**gateway.settings()), \
+                self.captureOnCommitCallbacks(execute=True):
+            paid = self.initiated_order('Khalti', gateway.pidx_for('A'), age_hours=2)
+            gateway.payments[gateway.pidx_for('A')] = {'amount': 100000, 'purchase_order_id': paid.order_id}
+            expired = self.initiated_order('Khalti', gateway.pidx_for('B'), age_hours=2)
+            gateway.payments[gateway.pidx_for('B')] = {'amount': 100000, 'status': 'Expired'}
+            lost = self.initiated_order('Khalti', 'pidx-unknown', age_hours=48)
+            recent = self.initiated_order('eSewa', 'uuid-1', age_hours=2)
+            gateway.payments['uuid-1'] = {'status': 'PENDING'}
+            esewa_stale = self.initiated_order('eSewa', 'uuid-2', age_hours=48)
+            gateway.payments['uuid-2'] = {'status': 'NOT_FOUND'}
+            esewa_paid = self.initiated_order('eSewa', 'uuid-3', age_hours=2)
+            gateway.payments['uuid-3'] = {'ref_id': 'ESW3'}
+            Order.objects.create(name='Just created', total_price=1000)
+
+            summary = Reconciler(concurrency=4, chunk_size=2).run()
+
+        self.assertEqual(summary, {'settled': 2, 'expired': 3, 'pending': 1})
+        statuses = dict(Order.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[paid.pk], 'paid')
+        self.assertEqual(statuses[esewa_paid.pk], 'paid')
+        self.assertTrue(PaymentSettlement.objects.filter(key='eSewa:ESW3').exists())
+        self.assertEqual([statuses[o.pk] for o in (expired, lost, esewa_stale)], ['cancelled'] * 3)
+        self.assertEqual(statuses[recent.pk], 'pending')
+        self.assertEqual(PaymentLog.objects.filter(status='Cancelled').count(), 3)
+        # Bulk updates kept the dashboard counters in step with the orders
+        counters = lambda: set(OrderStat.objects.filter(order_count__gt=0).values_list(
+            'date', 'payment_method', 'status', 'is_paid', 'order_count', 'revenue',
+        ))
+        before = counters()
+        rebuild_stats()
+        self.assertEqual(counters(), before)
+
+    def test_resumes_after_the_checkpointed_chunk(self):
+        first = self.initiated_order('eSewa', 'uuid-1', age_hours=48)
+        second = self.initiated_order('eSewa', 'uuid-2', age_hours=48)
+        with FakeGatewayServer() as gateway, override_settings(**gateway.settings()), \
+                tempfile.TemporaryDirectory() as tmpdir:
+            gateway.payments['uuid-2'] = {'status': 'CANCELED'}
+            checkpoint = Path(tmpdir) / 'checkpoint.json'
+            reconciler = Reconciler(chunk_size=1, checkpoint=checkpoint)
+            reconciler._save_checkpoint(first.pk, timezone.now(), timezone.now())
+
+            summary = reconciler.run(resume=True)
+            self.assertFalse(checkpoint.exists())
+
+        self.assertEqual(summary, {'expired': 1})
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.status, second.status), ('pending', 'cancelled'))
+
+
+class ExportTests(TestCase):
+    """Finance exports stream filtered rows to staff only"""
+
+    def setUp(self):
+        order = Order.objects.create(name='Test Customer', total_price=1000)
+        PaymentLog.objects.create(
+            order=order, payment_method='Khalti', transaction_id='txn-1', amount=1000, status='Success',
+            gateway_response={'fee': 30}, gateway_fee=30, net_amount=970,
+        )
+        PaymentLog.objects.create(
+            order=order, payment_method='eSewa', transaction_id='ref-1', amount=1000, status='Success',
+        )
+        self.order = order
+
+    def test_requires_staff(self):
+        response = self.client.get(reverse('export', args=['orders']))
+        self.assertEqual(response.status_code, 302)
+
+    def test_csv_export_is_filtered_and_streamed(self):
+        self.client.force_login(User.objects.create_user('finance', is_staff=True))
+        today = timezone.localdate().isoformat()
+        response = self.client.get(
+            reverse('export', args=['payment-logs']), {'gateway': 'Khalti', 'start': today, 'end': today},
+        )
+
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['order_id'], self.order.order_id)
+        self.assertEqual((rows[0]['gateway_fee'], rows[0]['net_amount']), ('30.00', '970.00'))
+        self.assertEqual(json.loads(rows[0]['gateway_response']), {'fee': 30})
+
+    def test_gzipped_jsonl_export(self):
+        self.client.force_login(User.objects.create_user('finance', is_staff=True))
+        response = self.client.get(reverse('export', args=['orders']), {'format': 'jsonl', 'gzip': '1'})
+
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual([json.loads(line)['order_id'] for line in lines], [self.order.order_id])
+
+    def test_invalid_date_is_rejected(self):
+        self.client.force_login(User.objects.create_user('finance', is_staff=True))
+        response = self.client.get(reverse('export', args=['orders']), {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class PaymentLogArchiveTests(TestCase):
+    """Old logs leave the hot table but stay readable per order"""
+
+    def setUp(self):
+        self.order = Order.objects.create(name='Test Customer', total_price=1000)
+        self.old = PaymentLog.objects.create(
+            order=self.order, payment_method='Khalti', transaction_id='pidx-old', amount=1000, status='Initiated',
+            gateway_response={'pidx': 'pidx-old'}, created_at=timezone.now() - timezone.timedelta(days=120),
+        )
+        self.recent = PaymentLog.objects.create(
+            order=self.order, payment_method='Khalti', transaction_id='txn-new', amount=1000, status='Success',
+        )
+
+    def test_old_logs_move_to_the_archive_table(self):
+        self.assertEqual(archive_payment_logs(older_than_days=90), 1)
+
+        self.assertEqual(list(PaymentLog.objects.values_list('pk', flat=True)), [self.recent.pk])
+        self.assertEqual(ArchivedPaymentLog.objects.get().pk, self.old.pk)
+        archived = archived_logs_for(self.order)
+        self.assertEqual([log.transaction_id for log in archived], ['pidx-old'])
+        self.assertEqual(archived[0].gateway_response, {'pidx': 'pidx-old'})
+
+        # Rebuilt stats still count the archived entry
+        rebuild_stats()
+        self.assertEqual(sum(PaymentLogStat.objects.values_list('log_count', flat=True)), 2)
+
+    def test_file_archive_is_read_back_per_order(self):
+        with tempfile.TemporaryDirectory() as tmpdir, override_settings(PAYMENT_LOG_ARCHIVE_DIR=tmpdir):
+            self.order.created_at = self.old.created_at
+            self.order.save()
+            other = Order.objects.create(name='Other Customer', total_price=500)
+            # The gateway echoes a merchant order_id that happens to equal self.order's pk
+            PaymentLog.objects.create(
+                order=other, payment_method='eSewa', transaction_id='ref-other', amount=500, status='Success',
+                gateway_response={'order_id': self.order.pk, 'ref_id': 'ref-other'}, created_at=self.old.created_at,
+            )
+
+            self.assertEqual(archive_payment_logs(older_than_days=90, backend='files'), 2)
+            archived = archived_logs_for(self.order)
+
+        self.assertEqual([(log.pk, log.gateway_response) for log in archived], [(self.old.pk, {'pidx': 'pidx-old'})])
+        self.assertFalse(ArchivedPaymentLog.objects.exists())
+
+
+class MetricsTests(TestCase):
+    """Gateway calls, views and payment outcomes show up on /metrics"""
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_gateway_latency_and_outcomes_are_labelled_by_gateway(self):
+        order = Order.objects.create(name='Test Customer', total_price=1000)
+        labels = {'gateway': 'Khalti', 'method': 'POST', 'endpoint': FakeGatewayServer.KHALTI_INITIATE_PATH, 'outcome': '2xx'}
+        before = self.sample('payment_gateway_request_seconds_count', **labels)
+        initiated = self.sample('payment_log_entries_total', gateway='Khalti', status='Initiated', reason='')
+
+        with FakeGatewayServer() as gateway, override_settings(**gateway.settings()):
+            KhaltiPaymentGateway().initiate_payment(order)
+
+        self.assertEqual(self.sample('payment_gateway_request_seconds_count', **labels), before + 1)
+        self.assertEqual(
+            self.sample('payment_log_entries_total', gateway='Khalti', status='Initiated', reason=''), initiated + 1
+        )
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_endpoint_is_staff_only_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer None').status_code, 401)
+
+        self.client.force_login(User.objects.create_user('ops', password='pw', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_endpoint_requires_token_and_reports_view_db_time(self):
+        self.client.get(reverse('order_list'))
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('payment_view_db_seconds_count{view="order_list"}', response.content.decode())
+
+    @override_settings(DEBUG=True)
+    def test_asgi_handler_chain_is_not_adapted(self):
+        with self.assertNoLogs('django.request', level='DEBUG'):
+            ASGIHandler()
+
+    def test_queries_in_sync_to_async_threads_are_timed(self):
+        def query():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+        with time_queries() as timer:
+            async_to_sync(sync_to_async(query, thread_sensitive=False))()
+        self.assertEqual(timer.queries, 1)
+
+
+@override_settings(GATEWAY_HTTP_BACKOFF_FACTOR=0)
+class GatewayHTTPClientTests(TestCase):
+    """Idempotent calls are retried on transient failures; payment POSTs never are"""
+
+    def setUp(self):
+        cache.clear()
+        self.client_under_test = GatewayHTTPClient()
+        self.addCleanup(self.client_under_test.close)
+
+    def test_idempotent_get_is_retried_then_gives_up(self):
+        with FakeGatewayServer(error_rate=1.0) as gateway:
+            response = self.client_under_test.get(gateway.settings()['ESEWA_VERIFY_URL'], params={'uuid': 'x'})
+            host = urlsplit(gateway.url).netloc
+
+        self.assertEqual(response.status_code, 503)
+        stats = self.client_under_test.get_stats()[host]
+        self.assertEqual((stats['requests'], stats['retries']), (3, 2))
+        # All three attempts went over the one kept-alive connection
+        self.assertEqual((stats['pool_misses'], stats['pool_hits']), (1, 2))
+
+    def test_connection_errors_are_retried_and_reraised(self):
+        with mock.patch('requests.Session.request', side_effect=requests.ConnectionError('refused')) as send:
+            with self.assertRaises(requests.ConnectionError):
+                self.client_under_test.get('http://esewa.test/status/')
+
+        self.assertEqual(send.call_count, 3)
+        self.assertEqual(self.client_under_test.get_stats()['esewa.test']['errors'], 3)
+
+    def test_payment_post_is_not_retried(self):
+        with FakeGatewayServer(error_rate=1.0) as gateway:
+            response = self.client_under_test.post(gateway.settings()['KHALTI_PAYMENT_URL'], json={})
+            host = urlsplit(gateway.url).netloc
+
+        self.assertEqual(response.status_code, 503)
+        stats = self.client_under_test.get_stats()[host]
+        self.assertEqual((stats['requests'], stats['retries']), (1, 0))
+
+    def test_async_clients_close_with_their_event_loop(self):
+        async def client():
+            return get_async_http_client()
+
+        first = async_to_sync(client)()
+        self.assertIsNot(async_to_sync(client)(), first)
+        self.assertTrue(first.client.is_closed)
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_stats_endpoint_needs_staff_or_token(self):
+        url = reverse('gateway_http_stats')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer scrape-token').status_code, 200)
+
+        staff = User.objects.create_user('ops', password='pw', is_staff=True)
+        self.client.force_login(staff)
+        self.assertIn('hosts', self.client.get(url).json())
+
+
+class QueueLogHandlerTests(TestCase):
+    """Application logs are written off the request thread, as JSON"""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = Path(tmpdir.name) / 'app.log'
+
+    def record(self, msg, *args, **extra):
+        record = logging.LogRecord('paymentgateway', logging.INFO, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_records_are_written_as_json_with_extra_fields(self):
+        handler = QueueLogHandler(str(self.path))
+        handler.handle(self.record("Order %s settled", 7, order_id=7, latency_ms=12.5))
+        handler.stop()
+
+        entry = json.loads(self.path.read_text().splitlines()[0])
+        self.assertEqual(entry['message'], 'Order 7 settled')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual((entry['order_id'], entry['latency_ms']), (7, 12.5))
+
+    def test_full_queue_drops_records_instead_of_blocking(self):
+        handler = QueueLogHandler(str(self.path), queue_size=1)
+        handler._pid = os.getpid()  # Pretend the listener is running but stalled
+        before = REGISTRY.get_sample_value('payment_log_records_dropped_total') or 0
+
+        for i in range(3):
+            handler.handle(self.record("message %s", i))
+
+        self.assertEqual(handler.dropped, 2)
+        self.assertEqual(REGISTRY.get_sample_value('payment_log_records_dropped_total'), before + 2)
+
+
+class BufferedPaymentLogSinkTests(TestCase):
+    """Buffered audit writes are batched and survive a crashed worker"""
+
+    def setUp(self):
+        self.order = Order.objects.create(name='Test Customer', total_price=500)
+        self.wal_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.wal_dir.cleanup)
+        self.settings_override = override_settings(
+            PAYMENT_LOG_MODE='buffered',
+            PAYMENT_LOG_BATCH_SIZE=3,
+            PAYMENT_LOG_FLUSH_INTERVAL=60,
+            PAYMENT_LOG_WAL_DIR=self.wal_dir.name,
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def record(self, sink, status='Initiated'):
+        sink.record(order=self.order, payment_method='Khalti', transaction_id='PIDX',
+                    amount=500, status=status, gateway_response={'pidx': 'PIDX'})
+
+    def test_entries_are_written_in_one_batch(self):
+        sink = PaymentLogSink()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.record(sink)
+            self.record(sink)
+        self.assertEqual(PaymentLog.objects.count(), 0)
+
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.record(sink)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "paymentgateway_paymentlog"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(PaymentLog.objects.filter(order=self.order).count(), 3)
+
+    def test_orphaned_write_ahead_file_is_replayed(self):
+        crashed = PaymentLogSink()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.record(crashed, status='Success')
+        # Pretend the worker died: its WAL now belongs to a pid that no longer exists
+        wal = next(Path(self.wal_dir.name).glob('*.wal'))
+        wal.rename(wal.with_name('999999999.wal'))
+
+        self.assertEqual(PaymentLogSink().recover(), 1)
+        self.assertTrue(PaymentLog.objects.filter(order=self.order, status='Success').exists())
+
+    def test_write_ahead_file_from_a_reused_pid_is_replayed(self):
+        # A crashed worker whose pid this process now has (PID 1 in a restarted container)
+        entry = {'order_id': self.order.pk, 'payment_method': 'Khalti', 'transaction_id': 'PIDX',
+                 'amount': 500, 'status': 'Success', 'created_at': timezone.now().isoformat()}
+        Path(self.wal_dir.name, f'{os.getpid()}.wal').write_text(json.dumps(entry) + '\n')
+
+        sink = PaymentLogSink()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.record(sink)
+        self.assertEqual(sink.flush(), 2)
+        self.assertTrue(PaymentLog.objects.filter(order=self.order, status='Success').exists())
+        self.assertEqual([path.read_text() for path in Path(self.wal_dir.name).glob('*.wal')], [''])
+
+
+    def test_rolled_back_entries_are_dropped_and_flush_errors_kept(self):
+        sink = PaymentLogSink()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.record(sink, status='Success')
+                    raise IntegrityError('settlement key taken')
+            except IntegrityError:
+                pass
+        self.assertFalse(sink.has_success_pending())
+
+        with mock.patch.object(PaymentLog.objects, 'bulk_create', side_effect=IntegrityError('db down')), \
+                self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                self.record(sink)  # The third reaches the batch size and fails to flush, quietly
+        self.assertEqual(sink.flush(), 3)
+
+
+class OrderListPaginationTests(TestCase):
+    """The order list seeks by (created_at, id) cursor instead of loading every row"""
+
+    def setUp(self):
+        Order.objects.bulk_create([
+            Order(name=f'Customer {i}', order_id=f'ORD{i:05d}', total_price=100 + i) for i in range(7)
+        ])
+        # Same timestamp for every row so the id tiebreaker is exercised
+        Order.objects.update(created_at=timezone.now())
+        # Bulk writes skip the incremental stat updates
+        rebuild_stats()
+
+    def test_cursor_walks_all_orders_once(self):
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 3}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get(reverse('order_list_api'), params).json()
+            seen.extend(order['id'] for order in data['orders'])
+            cursor = data['next_cursor']
+            if not data['has_next']:
+                break
+
+        self.assertEqual(seen, list(Order.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_dashboard_renders_one_page(self):
+        with override_settings(ORDER_LIST_PAGE_SIZE=5):
+            response = self.client.get(reverse('order_list'))
+        self.assertEqual(len(response.context['orders']), 5)
+        self.assertTrue(response.context['page'].has_next)
+        self.assertEqual(response.context['stats']['total'], 7)
+
+
+@skipUnless(connection.vendor == 'sqlite', "Plan wording is SQLite's")
+class ExplainPaymentQueriesTests(TestCase):
+    """The hot-path queries are planned on the indexes added for them"""
+
+    def test_plans_use_the_payment_indexes(self):
+        order = Order.objects.create(name='Test Customer', total_price=1000)
+        PaymentLog.objects.create(order=order, payment_method='Khalti', transaction_id='pidx-1', amount=1000,
+                                  status='Initiated')
+        out = io.StringIO()
+        call_command('explain_payment_queries', stdout=out)
+
+        plans = out.getvalue()
+        for index in ('order_status_created_idx', 'order_unpaid_created_idx', 'paylog_order_created_idx',
+                      'paylog_txn_idx', 'paylog_status_method_idx'):
+            self.assertIn(f'USING INDEX {index}', plans)
+
+
+class AdminChangelistTests(TestCase):
+    """Admin changelists stay index-friendly as the log table grows"""
+
+    def setUp(self):
+        self.order = Order.objects.create(name='Ram', order_id='ORDADMIN1', total_price=100)
+        self.other = Order.objects.create(name='Sita', order_id='ORDADMIN2', total_price=200)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+
+    def add_logs(self, order, count):
+        PaymentLog.objects.bulk_create([
+            PaymentLog(order=order, payment_method='Khalti', transaction_id=f'{order.order_id}-{i}',
+                       amount=order.total_price, status='Initiated')
+            for i in range(count)
+        ])
+
+    def changelist_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:paymentgateway_paymentlog_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.add_logs(self.order, 2)
+        _, few = self.changelist_queries()
+        self.add_logs(self.other, 40)
+        _, many = self.changelist_queries()
+        self.assertEqual(few, many)
+
+    def test_search_matches_exact_order_id(self):
+        self.add_logs(self.order, 2)
+        self.add_logs(self.other, 3)
+        response, _ = self.changelist_queries(q='ordadmin1')
+        self.assertEqual(response.context['cl'].result_count, 2)
+        # A fragment is not a match; only indexed exact/prefix lookups are used
+        response, _ = self.changelist_queries(q='ADMIN')
+        self.assertEqual(response.context['cl'].result_count, 0)
+
+    def test_estimated_paginator_counts_exactly_off_postgres(self):
+        self.add_logs(self.order, 3)
+        paginator = EstimatedCountPaginator(PaymentLog.objects.order_by('pk'), 2)
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual(paginator.num_pages, 2)
+
+
+class OrderHistoryTests(TestCase):
+    """Order pages and the detail API load payment history with a fixed number of queries"""
+
+    def setUp(self):
+        self.order = Order.objects.create(name='Ram', order_id='ORDHIST1', total_price=100)
+        PaymentLog.objects.bulk_create([
+            PaymentLog(order=self.order, payment_method='Khalti', transaction_id=f'pidx-{i}', amount=100,
+                       status='Failed', gateway_response={'error': 'declined'})
+            for i in range(5)
+        ])
+
+    def test_detail_api_query_budget(self):
+        # Order, then all of its logs in one prefetch
+        with self.assertNumQueries(2):
+            data = self.client.get(reverse('order_detail_api', args=[self.order.id])).json()
+        self.assertEqual(data['order']['order_id'], 'ORDHIST1')
+        self.assertEqual(len(data['payment_history']), 5)
+        self.assertNotIn('gateway_response', data['payment_history'][0])
+
+    def test_gateway_response_only_on_request(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('order_detail_api', args=[self.order.id]))
+        self.assertNotIn('gateway_response', queries[-1]['sql'])
+
+        self.client.force_login(User.objects.create_user('support', is_staff=True))
+        data = self.client.get(reverse('order_detail_api', args=[self.order.id]), {'include': 'gateway_response'}).json()
+        self.assertEqual(data['payment_history'][0]['gateway_response'], {'error': 'declined'})
+
+    def test_success_page_query_budget(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('order_success', args=[self.order.id]))
+        self.assertContains(response, 'pidx-4')
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('order_checkout', args=[self.order.id]))
+        self.assertContains(response, 'Payment History')
+
+    def test_missing_order(self):
+        response = self.client.get(reverse('order_detail_api', args=[999999]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_raw_and_archived_history_need_staff(self):
+        url = reverse('order_detail_api', args=[self.order.id])
+        for params in ({'include': 'gateway_response'}, {'archived': '1'}):
+            with self.subTest(params):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 403)
+                self.assertNotIn('declined', response.content.decode())
+
+
+class GatewayRegistryTests(TestCase):
+    """Checkout dispatches through shared, once-built gateway instances"""
+
+    def setUp(self):
+        cache.clear()
+        reset_rate_limiter()  # Order pks repeat across tests; start with full buckets
+        self.order = Order.objects.create(name='Ram', total_price=100)
+
+    def test_sync_and_async_responses_are_read_alike(self):
+        pending = {'pidx': 'P1', 'status': 'Pending'}
+        completed = {'pidx': 'P1', 'status': 'Completed', 'total_amount': 10000}
+        for make in (gateway_response, lambda payload, status_code=200: httpx.Response(status_code, json=payload)):
+            self.assertEqual(parse_khalti_lookup(make(pending), 'P1'), (None, pending))
+            self.assertEqual(parse_khalti_lookup(make(completed), 'P1'), (completed, None))
+            self.assertEqual(parse_khalti_lookup(make({'detail': 'Not found.'}, 404), 'P1'), (None, {'detail': 'Not found.'}))
+
+    def test_instances_are_shared_until_settings_change(self):
+        khalti = get_gateway('khalti')
+        self.assertIs(get_gateway('khalti'), khalti)
+        self.assertIsNot(get_gateway('khalti', asynchronous=True), khalti)
+        with override_settings(KHALTI_SECRET_KEY='rotated'):
+            self.assertEqual(get_gateway('khalti').secret_key, 'rotated')
+        self.assertIsNone(get_gateway('paypal'))
+
+    def test_checkout_renders_form_gateway(self):
+        response = self.client.post(reverse('order_checkout', args=[self.order.id]), {'payment_method': 'esewa'})
+        self.assertTemplateUsed(response, 'payment_form.html')
+        self.assertTrue(response.context['payment_data']['transaction_uuid'].startswith(self.order.order_id))
+        self.assertTrue(PaymentLog.objects.filter(order=self.order, payment_method='eSewa', status='Initiated').exists())
+
+    def test_checkout_redirects_to_gateway(self):
+        initiated = gateway_response({'pidx': 'pidx-1', 'payment_url': 'https://khalti.test/pay/pidx-1'})
+        with mock.patch('paymentgateway.http_client.GatewayHTTPClient.request', return_value=initiated):
+            response = self.client.post(reverse('order_checkout', args=[self.order.id]), {'payment_method': 'khalti'})
+        self.assertRedirects(response, 'https://khalti.test/pay/pidx-1', fetch_redirect_response=False)
+
+    def test_unknown_method_stays_on_checkout(self):
+        response = self.client.post(reverse('order_checkout', args=[self.order.id]), {'payment_method': 'paypal'})
+        self.assertTemplateUsed(response, 'order_checkout.html')
+
+
+# The app's routes with the async checkout, callback and status views, as
+# PAYMENT_ASYNC_VIEWS=True serves them
+ASYNC_GATEWAY_VIEWS = {
+    'order_checkout': async_views.order_checkout,
+    'esewa_success': async_views.esewa_success,
+    'khalti_success': async_views.khalti_success,
+    'payment_status': async_views.PaymentStatusView.as_view(),
+}
+
+
+class AsyncURLConf:
+    urlpatterns = [path('payment/', include([
+        path(str(pattern.pattern), ASYNC_GATEWAY_VIEWS.get(pattern.name, pattern.callback), name=pattern.name)
+        for pattern in app_urlpatterns
+    ]))]
+
+
+@override_settings(ROOT_URLCONF=AsyncURLConf, PAYMENT_QUEUE_VERIFICATION=False)
+class AsyncViewTests(TestCase):
+    """The async checkout, callback and status views settle orders like the sync ones"""
+
+    def setUp(self):
+        cache.clear()
+        reset_rate_limiter()  # Order pks repeat across tests; start with full buckets
+        self.order = Order.objects.create(name='Ram', total_price=1000)
+        self.gateway = FakeGatewayServer().start()
+        self.addCleanup(self.gateway.stop)
+        gateway_settings = override_settings(**self.gateway.settings())
+        gateway_settings.enable()
+        self.addCleanup(gateway_settings.disable)
+
+    async def test_khalti_checkout_and_callback_keep_breaker_off_the_loop(self):
+        on_loop = []
+        before_call = CircuitBreaker.before_call
+
+        def watched_before_call(breaker):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(True)
+            except RuntimeError:
+                on_loop.append(False)
+            return before_call(breaker)
+
+        pidx = self.gateway.pidx_for(self.order.order_id)
+        with mock.patch.object(CircuitBreaker, 'before_call', watched_before_call):
+            response = await self.async_client.post(
+                reverse('order_checkout', args=[self.order.id]), {'payment_method': 'khalti'},
+            )
+            self.assertEqual(response.status_code, 302)
+            self.assertIn(pidx, response['Location'])
+
+            response = await self.async_client.get(reverse('khalti_success'), {
+                'pidx': pidx, 'purchase_order_id': self.order.order_id, 'status': 'Pending',
+            })
+
+        self.assertRedirects(response, reverse('order_success', args=[self.order.id]), fetch_redirect_response=False)
+        self.assertTrue((await Order.objects.aget(pk=self.order.pk)).is_paid)
+        # Initiate and lookup both went through the breaker, each time on a worker thread
+        self.assertEqual(on_loop, [False, False])
+
+    async def test_esewa_checkout_and_callback(self):
+        response = await self.async_client.post(
+            reverse('order_checkout', args=[self.order.id]), {'payment_method': 'esewa'},
+        )
+        self.assertTrue(response.context['payment_data']['transaction_uuid'].startswith(self.order.order_id))
+
+        response = await self.async_client.get(reverse('esewa_success'), {
+            'oid': self.order.order_id, 'amt': '1000.0', 'refId': 'REF1',
+        })
+        self.assertRedirects(response, reverse('order_success', args=[self.order.id]), fetch_redirect_response=False)
+        order = await Order.objects.aget(pk=self.order.pk)
+        self.assertTrue(order.is_paid)
+        self.assertEqual(order.transaction_id, 'REF1')
+
+    async def test_status_follows_settlement_and_revalidates(self):
+        url = reverse('payment_status', args=[self.order.id])
+        first = await self.async_client.get(url)
+        self.assertFalse(first.json()['is_paid'])
+        self.assertEqual((await self.async_client.get(url, headers={'if-none-match': first['ETag']})).status_code, 304)
+
+        self.order.is_paid = True
+        self.order.paid_amount = 1000
+        await self.order.asave()
+        self.assertTrue((await self.async_client.get(url)).json()['is_paid'])
+
+        missing = await self.async_client.get(reverse('payment_status', args=[999999]))
+        self.assertEqual(missing.json()['message'], 'Order not found')
+
+
+@override_settings(ESEWA_SECRET_KEY='test-secret', ESEWA_SCD='EPAYTEST', PAYMENT_QUEUE_VERIFICATION=False)
+class EsewaSignedFormTests(TestCase):
+    """eSewa v2 checkout forms are signed once and reused on a double submit"""
+
+    def setUp(self):
+        cache.clear()
+        reset_rate_limiter()  # Order pks repeat across tests; start with full buckets
+        self.order = Order.objects.create(name='Ram', order_id='ORDESEWA1', total_price=1000)
+
+    def callback_data(self, **overrides):
+        data = {
+            'transaction_code': 'TXN1', 'status': 'COMPLETE', 'total_amount': '1,000.0',
+            'transaction_uuid': 'ORDESEWA1-abc123', 'product_code': 'EPAYTEST',
+            'signed_field_names': 'transaction_code,status,total_amount,transaction_uuid,product_code,signed_field_names',
+        }
+        message = ','.join(f'{name}={data[name]}' for name in data['signed_field_names'].split(','))
+        data['signature'] = base64.b64encode(
+            hmac.new(b'test-secret', message.encode(), hashlib.sha256).digest()
+        ).decode()
+        data.update(overrides)
+        return base64.b64encode(json.dumps(data).encode()).decode()
+
+    def test_form_is_signed_over_declared_fields(self):
+        form = get_gateway('esewa').generate_payment_data(self.order)
+        self.assertTrue(form['transaction_uuid'].startswith('ORDESEWA1-'))
+        message = f"total_amount=1000,transaction_uuid={form['transaction_uuid']},product_code=EPAYTEST"
+        expected = base64.b64encode(hmac.new(b'test-secret', message.encode(), hashlib.sha256).digest()).decode()
+        self.assertEqual(form['signature'], expected)
+
+    def test_double_submit_reuses_form(self):
+        url = reverse('order_checkout', args=[self.order.id])
+        first = self.client.post(url, {'payment_method': 'esewa'}).context['payment_data']
+        second = self.client.post(url, {'payment_method': 'esewa'}).context['payment_data']
+        self.assertEqual(first, second)
+        self.assertEqual(PaymentLog.objects.filter(order=self.order, status='Initiated').count(), 1)
+
+    def test_signed_callback_settles_order(self):
+        response = self.client.get(reverse('esewa_success'), {'data': self.callback_data()})
+        self.assertRedirects(response, reverse('order_success', args=[self.order.id]), fetch_redirect_response=False)
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.is_paid)
+        self.assertEqual(self.order.transaction_id, 'TXN1')
+
+    def test_tampered_callback_is_rejected(self):
+        response = self.client.get(reverse('esewa_success'), {'data': self.callback_data(total_amount='10.0')})
+        self.assertRedirects(response, reverse('order_list'), fetch_redirect_response=False)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.is_paid)
+
+
+@override_settings(
+    ESEWA_SCD='EPAYTEST',
+    ESEWA_SECRET_KEY='8gBm/:&EnhH.1/q',
+    ESEWA_STATUS_CACHE_TTL=3600,
+    ESEWA_STATUS_CONCURRENCY=2,
+)
+class EsewaStatusTests(TestCase):
+    """eSewa's status API is parsed into EsewaStatus and final answers are cached"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_batch_lookup_caches_final_answers(self):
+        with FakeGatewayServer() as gateway, override_settings(**gateway.settings()):
+            gateway.payments.update({'uuid-1': {'ref_id': 'REF1'}, 'uuid-2': {'status': 'PENDING'}})
+            esewa = get_gateway('esewa')
+            transactions = [('EPAYTEST', '100', 'uuid-1'), ('EPAYTEST', '100', 'uuid-2')]
+            first = esewa.transaction_statuses(transactions)
+
+            gateway.payments.update({'uuid-1': {'status': 'FULL_REFUND'}, 'uuid-2': {'status': 'COMPLETE'}})
+            second = esewa.transaction_statuses(transactions)
+
+        self.assertTrue(first['uuid-1'].completed)
+        self.assertEqual(first['uuid-1'].ref_id, 'REF1')
+        self.assertEqual(first['uuid-2'].status, 'PENDING')
+        # COMPLETE was final and served from cache; PENDING was asked again
+        self.assertEqual(second['uuid-1'], first['uuid-1'])
+        self.assertTrue(second['uuid-2'].completed)
+
+    def test_error_body_is_parsed(self):
+        with FakeGatewayServer() as gateway, override_settings(**gateway.settings()):
+            result = get_gateway('esewa').transaction_status('', '100')
+        self.assertEqual(result.status, 'ERROR')
+        self.assertEqual(result.error, 'transaction_uuid is required')
+
+    def test_callback_checked_against_status_api(self):
+        order = Order.objects.create(name='Ram', total_price=1000)
+        params = {'oid': order.order_id, 'amt': '1000.0', 'refId': 'REF9'}
+        with FakeGatewayServer() as gateway, override_settings(**gateway.settings(), PAYMENT_QUEUE_VERIFICATION=False):
+            form = get_gateway('esewa').generate_payment_data(order)
+            gateway.payments[form['transaction_uuid']] = {'status': 'PENDING'}
+            self.client.get(reverse('esewa_success'), params)
+            order.refresh_from_db()
+            self.assertFalse(order.is_paid)
+
+            gateway.payments[form['transaction_uuid']] = {'ref_id': 'REF9'}
+            self.client.get(reverse('esewa_success'), params)
+        order.refresh_from_db()
+        self.assertTrue(order.is_paid)
+
+
+@override_settings(
+    ESEWA_VERIFY_URL='https://esewa.test/api/epay/transaction/status/',
+    PAYMENT_GATEWAY_MODE='production',
+    PAYMENT_QUEUE_VERIFICATION=True,
+)
+class EsewaQueuedVerificationTests(TestCase):
+    """The verification task retries answers that may change and fails orders only on terminal ones"""
+
+    def setUp(self):
+        celery_app.conf.task_always_eager = True
+        cache.clear()
+        reset_rate_limiter()
+
+    def verify(self, status=None, side_effect=None):
+        """Send a legacy callback for a new order while the status API answers ``status``"""
+        order = Order.objects.create(name='Test Customer', total_price=1000)
+        transaction_uuid = get_gateway('esewa').generate_payment_data(order)['transaction_uuid']
+        answer = EsewaStatus(transaction_uuid, status, total_amount='1000.0', ref_id='REF1')
+        with mock.patch.object(
+            EsewaPaymentGateway, 'transaction_status', return_value=answer, side_effect=side_effect,
+        ) as lookup:
+            self.client.get(reverse('esewa_success'), {'oid': order.order_id, 'amt': '1000.0', 'refId': 'REF1'})
+        order.refresh_from_db()
+        return order, lookup.call_count
+
+    def assertFailedLogged(self, order, reason):
+        log = PaymentLog.objects.get(order=order, status='Failed')
+        self.assertEqual(log.gateway_response, {'reason': reason})
+
+    def test_complete_settles(self):
+        order, calls = self.verify('COMPLETE')
+        self.assertTrue(order.is_paid)
+        self.assertEqual(calls, 1)
+
+    def test_pending_ambiguous_and_errors_are_retried_then_released(self):
+        cases = {'PENDING': None, 'AMBIGUOUS': None, 'ERROR': None, 'network': requests.ConnectionError('down')}
+        for status, error in cases.items():
+            with self.subTest(status):
+                order, calls = self.verify(status, side_effect=error)
+                self.assertEqual(calls, 6)  # First try plus PAYMENT_VERIFY_MAX_RETRIES
+                self.assertEqual(order.status, 'pending')
+                self.assertFalse(PaymentLog.objects.filter(order=order, status='Failed').exists())
+
+    def test_not_found_fails_once_retries_run_out(self):
+        order, calls = self.verify('NOT_FOUND')
+        self.assertEqual(calls, 6)
+        self.assertEqual(order.status, 'failed')
+        self.assertFailedLogged(order, 'Transaction not found')
+
+    def test_cancelled_and_refunded_fail_without_retrying(self):
+        for status in ('CANCELED', 'FULL_REFUND'):
+            with self.subTest(status):
+                order, calls = self.verify(status)
+                self.assertEqual(calls, 1)
+                self.assertEqual(order.status, 'failed')
+                self.assertFailedLogged(order, f'API verification failed: {status}')
+
+
+class RateLimitTests(TestCase):
+    """Token buckets per client IP and per order answer 429 with Retry-After"""
+
+    def setUp(self):
+        reset_rate_limiter()
+        self.order = Order.objects.create(name='Ram', total_price=100)
+
+    @override_settings(RATE_LIMITS={'payment_status': [{'scope': 'ip', 'rate': '60/m', 'burst': 2}]})
+    def test_ip_bucket_limits_and_sets_retry_after(self):
+        url = reverse('payment_status', args=[self.order.id])
+        codes = [self.client.get(url).status_code for _ in range(3)]
+        self.assertEqual(codes, [200, 200, 429])
+        response = self.client.get(url)
+        self.assertEqual(response['Retry-After'], '1')
+        # Another client has its own bucket
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    @override_settings(RATE_LIMITS={'order_checkout': [{'scope': 'order', 'rate': '1/h', 'burst': 1, 'methods': ['POST']}]})
+    def test_order_bucket_applies_to_listed_methods_only(self):
+        url = reverse('order_checkout', args=[self.order.id])
+        self.assertEqual(self.client.post(url, {'payment_method': 'paypal'}).status_code, 200)
+        self.assertEqual(self.client.post(url, {'payment_method': 'paypal'}, REMOTE_ADDR='10.0.0.2').status_code, 429)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_memory_bucket_refills(self):
+        backend = MemoryBackend()
+        with mock.patch('paymentgateway.rate_limit.time.monotonic', side_effect=[0, 0, 0.5, 1.0]):
+            decisions = [backend.take('key', rate=1, capacity=1) for _ in range(4)]
+        self.assertEqual([allowed for allowed, _ in decisions], [True, False, False, True])
+        self.assertAlmostEqual(decisions[2][1], 0.5)
+
+    @override_settings(RATE_LIMIT_TRUSTED_PROXIES=1)
+    def test_client_ip_behind_proxy(self):
+        request = RequestFactory().get('/', HTTP_X_FORWARDED_FOR='1.1.1.1, 2.2.2.2', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(RateLimiter.client_ip(request), '2.2.2.2')
+
+
+class OrderStatsTests(TestCase):
+    """Counters follow order saves and match a full rebuild"""
+
+    def test_incremental_counters_match_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            paid = Order.objects.create(name='Paid', total_price=700)
+            Order.objects.create(name='Pending', total_price=300)
+
+            paid = Order.objects.get(pk=paid.pk)
+            paid.is_paid = True
+            paid.paid_amount = 700
+            paid.payment_method = 'Khalti'
+            paid.save()
+            paid.save()  # Unchanged saves must not double count
+
+        expected = {'total': 2, 'paid': 1, 'pending': 1, 'revenue': 700}
+        self.assertEqual(order_totals(), expected)
+        rebuild_stats()
+        self.assertEqual(order_totals(), expected)
+
+        stats = self.client.get(reverse('order_stats')).json()
+        self.assertEqual(stats['totals'], expected)
+
+    def test_counters_wait_for_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(name='Ram', total_price=700)
+        before = order_totals()
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks, mock.patch(
+            'paymentgateway.settlement.PaymentSettlement.objects.create', side_effect=IntegrityError,
+        ):
+            # The settlement fails after the order row was saved as paid and rolls back
+            outcome = settle_payment(order.order_id, 'Khalti', 'TXN1', 70000, {})
+
+        self.assertEqual(outcome, TRANSACTION_REUSED)
+        self.assertEqual(callbacks, [])
+        self.assertEqual(order_totals(), before)
+        self.assertFalse(Order.objects.get(pk=order.pk).is_paid)
+
+        with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as queries:
+            self.assertEqual(settle_payment(order.order_id, 'Khalti', 'TXN1', 70000, {}), SETTLED)
+        # The settlement transaction never touched (and so never locked) a counter row
+        self.assertFalse([query for query in queries if OrderStat._meta.db_table in query['sql']])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(order_totals()['paid'], before['paid'] + 1)
+
+
+class PaymentStatusCacheTests(TestCase):
+    """Status polling is served from the cache and revalidated with ETags"""
+
+    def setUp(self):
+        cache.clear()
+        self.order = Order.objects.create(name='Test Customer', total_price=1000)
+        self.url = reverse('payment_status', args=[self.order.id])
+
+    def test_repeat_polls_skip_the_database_and_revalidate(self):
+        with self.assertNumQueries(1):
+            first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(second.status_code, 304)
+
+    def test_saving_payment_fields_invalidates(self):
+        self.assertFalse(self.client.get(self.url).json()['is_paid'])
+
+        self.order.is_paid = True
+        self.order.paid_amount = 1000
+        self.order.save()
+
+        self.assertTrue(self.client.get(self.url).json()['is_paid'])
+
+    def test_bulk_status(self):
+        other = Order.objects.create(name='Other', total_price=50)
+        response = self.client.get(reverse('payment_status_bulk'), {'ids': f'{self.order.id},{other.id},999999'})
+        data = response.json()
+
+        self.assertEqual(set(data['orders']), {str(self.order.id), str(other.id)})
+        self.assertEqual(data['missing'], [999999])
+        with self.assertNumQueries(0):
+            self.client.get(reverse('payment_status_bulk'), {'ids': f'{self.order.id},{other.id}'})
+
+
+class PaymentEventsTests(TestCase):
+    """Status changes are pushed to subscribers and streamed as SSE"""
+
+    def setUp(self):
+        cache.clear()
+        self.order = Order.objects.create(name='Test Customer', total_price=1000)
+
+    def test_settling_publishes_after_commit(self):
+        subscription = get_broker().subscribe([order_channel(self.order.pk)])
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.order.is_paid = True
+                self.order.save()
+            event = subscription.get(timeout=0)
+        finally:
+            subscription.close()
+        self.assertEqual(event['id'], self.order.pk)
+        self.assertTrue(event['is_paid'])
+        self.assertEqual(event['order_status'], 'paid')
+
+    async def test_stream_ends_once_order_is_settled(self):
+        await Order.objects.filter(pk=self.order.pk).aupdate(is_paid=True, status='paid')
+        response = await self.async_client.get(reverse('order_payment_events', args=[self.order.pk]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertTrue(body.startswith('retry: '))
+        self.assertIn('event: status\ndata: ', body)
+        self.assertIn('"is_paid": true', body)
+        # The stream gave its slot back when it ended
+        self.assertEqual(events._open_streams, 0)
+
+    def test_wsgi_requests_are_told_to_poll(self):
+        response = self.client.get(reverse('order_payment_events', args=[self.order.pk]))
+        self.assertEqual(response.status_code, 204)
+
+    @override_settings(PAYMENT_EVENTS_MAX_STREAMS=1)
+    async def test_streams_past_the_cap_are_refused(self):
+        slot = events.acquire_stream_slot()
+        try:
+            response = await self.async_client.get(reverse('order_payment_events', args=[self.order.pk]))
+        finally:
+            slot.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(events._open_streams, 0)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class DatabaseRoutingTests(TransactionTestCase):
+    """Reads opt in to replicas; writes and reads right after them use the primary"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_reads_use_replica_only_when_asked(self):
+        self.assertEqual(Order.objects.all().db, 'default')
+        with replica_reads():
+            self.assertEqual(Order.objects.all().db, 'replica_1')
+            self.assertEqual(Order.objects.select_for_update().db, 'default')
+            with transaction.atomic():
+                self.assertEqual(Order.objects.all().db, 'default')
+
+    def test_request_stays_on_primary_after_writing_or_when_pinned(self):
+        try:
+            start_request()
+            with replica_reads():
+                self.assertEqual(Order.objects.all().db, 'replica_1')
+                Order.objects.create(name='Test Customer', total_price=1000)
+                self.assertEqual(Order.objects.all().db, 'default')
+
+            start_request(pinned=True)
+            with replica_reads():
+                self.assertEqual(Order.objects.all().db, 'default')
+        finally:
+            end_request()
+
+    def test_writing_request_pins_the_client(self):
+        response = self.client.post(reverse('create_test_order'), {'name': 'Test Customer', 'amount': 1000})
+        self.assertEqual(response.cookies['db_pin']['max-age'], 5)
+        self.assertNotIn('db_pin', self.client.get(reverse('create_test_order')).cookies)
+
+    def test_status_reads_stay_on_primary_after_a_change(self):
+        order = Order.objects.create(name='Test Customer', total_price=1000)
+        with replica_reads():
+            self.assertEqual(_status_rows([order.pk]).db, 'replica_1')
+            invalidate_payment_status(order.pk)  # Outside a transaction on_commit runs at once
+            self.assertEqual(_status_rows([order.pk]).db, 'default')
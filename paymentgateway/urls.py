@@ -1,23 +1,37 @@
 from django.urls import path
-from paymentgateway import views
+from django.conf import settings
+from paymentgateway import views, async_views
+
+# Under ASGI the checkout, callback and status views can be served by their
+# async counterparts so gateway round-trips don't hold a worker thread.
+gateway_views = async_views if getattr(settings, 'PAYMENT_ASYNC_VIEWS', False) else views
 
 urlpatterns = [
     path("", views.order_list, name="order_list"),
     path("order-list/", views.order_list, name="order_list"),
-    path("order-checkout/<int:order_id>/", views.order_checkout, name="order_checkout"),
+    path("order-checkout/<int:order_id>/", gateway_views.order_checkout, name="order_checkout"),
     path("order-success/<int:order_id>/", views.order_success, name="order_success"),
+    path("payment-processing/<int:order_id>/", views.payment_processing, name="payment_processing"),
     
     # eSewa URLs
-    path("esewa-success/", views.esewa_success, name="esewa_success"),
+    path("esewa-success/", gateway_views.esewa_success, name="esewa_success"),
     path("esewa-failure/", views.esewa_failure, name="esewa_failure"),
     
     # Khalti URLs
-    path("khalti-success/", views.khalti_success, name="khalti_success"),
+    path("khalti-success/", gateway_views.khalti_success, name="khalti_success"),
     path("khalti-failure/", views.khalti_failure, name="khalti_failure"),
     path("khalti-webhook/", views.khalti_webhook, name="khalti_webhook"),
     
     # API URLs
-    path("payment-status/<int:order_id>/", views.PaymentStatusView.as_view(), name="payment_status"),
+    path("api/orders/", views.OrderListAPIView.as_view(), name="order_list_api"),
+    path("api/orders/<int:order_id>/", views.OrderDetailAPIView.as_view(), name="order_detail_api"),
+    path("api/stats/", views.OrderStatsView.as_view(), name="order_stats"),
+    path("payment-status/<int:order_id>/", gateway_views.PaymentStatusView.as_view(), name="payment_status"),
+    path("payment-events/", views.PaymentEventsView.as_view(), name="payment_events"),
+    path("payment-events/<int:order_id>/", views.PaymentEventsView.as_view(), name="order_payment_events"),
+    path("payment-status/bulk/", views.PaymentStatusBulkView.as_view(), name="payment_status_bulk"),
+    path("gateway-http-stats/", views.GatewayHTTPStatsView.as_view(), name="gateway_http_stats"),
+    path("export/<str:kind>/", views.export, name="export"),
     
     # Test order creation
     path("create-test-order/", views.create_test_order, name="create_test_order"),
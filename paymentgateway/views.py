@@ -1,75 +1,152 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+from django.contrib.admin.views.decorators import staff_member_required
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.conf import settings
+from django.core.cache import cache
 import json
-from .models import Order, PaymentLog
-from .payment_gateways import EsewaPaymentGateway, KhaltiPaymentGateway
+import hmac
+import hashlib
+import logging
+from .db_routing import read_from_replica
+from .models import Order
+from .pagination import paginate_keyset
+from .stats import order_totals, stats_summary
+from .status_cache import (
+    combined_validators, get_payment_status, get_payment_statuses, last_modified, status_response
+)
+from .events import DASHBOARD_CHANNEL, SlotStream, acquire_stream_slot, aevent_stream, order_channel
+from .gateway_registry import get_gateway
+from .http_client import get_http_client
+from .circuit_breaker import circuit_states
+from .metrics import render_metrics
+from .history import payment_history, with_payment_history
+from .export import FORMATS, ExportError, astream_export, export_queryset, stream_export
+from .tasks import mark_order_processing, process_khalti_webhook, verify_esewa_payment, verify_khalti_payment
+
+logger = logging.getLogger(__name__)
 
 # Create your views here.
 
+# Columns the order list needs; skips wide fields such as ``address``
+ORDER_LIST_FIELDS = ('id', 'order_id', 'name', 'total_price', 'is_paid', 'status', 'payment_method', 'created_at')
+
+
+def _order_page(request, max_page_size=100):
+    page_size = getattr(settings, 'ORDER_LIST_PAGE_SIZE', 25)
+    try:
+        page_size = max(1, min(int(request.GET.get('limit', page_size)), max_page_size))
+    except ValueError:
+        pass
+    return paginate_keyset(
+        Order.objects.only(*ORDER_LIST_FIELDS),
+        cursor=request.GET.get('cursor'),
+        page_size=page_size,
+    )
+
+
+def _order_summary(order):
+    return {
+        'id': order.id,
+        'order_id': order.order_id,
+        'name': order.name,
+        'total_price': order.total_price,
+        'is_paid': order.is_paid,
+        'order_status': order.status,
+        'payment_method': order.payment_method,
+        'created_at': order.created_at.isoformat(),
+    }
+
+
+@read_from_replica
 def order_list(request):
-    """Display list of all orders"""
-    orders = Order.objects.all()
-    return render(request, "orders.html", {"orders": orders})
+    """Display a page of orders, newest first"""
+    page = _order_page(request)
+    return render(request, "orders.html", {"orders": page.items, "page": page, "stats": order_totals()})
+
+
+def checkout_response(request, order, gateway, success, response):
+    """Send the customer on to the gateway, or back to checkout with an error"""
+    if not success:
+        if response.get('circuit_open'):
+            messages.error(request, response['error'])
+        else:
+            messages.error(request, f"{gateway.name} payment initiation failed: {response}")
+        return redirect('order_checkout', order_id=order.id)
+    
+    if response.get('form') is None:
+        return redirect(response['payment_url'])
+    
+    # Gateways that take a form POST get an auto-submitting page
+    return render(request, "payment_form.html", {
+        'order': order,
+        'payment_data': response['form'],
+        'payment_url': response['payment_url'],
+        'payment_method': gateway.method,
+        'gateway_mode': getattr(settings, 'PAYMENT_GATEWAY_MODE', 'sandbox'),
+    })
 
 
 def order_checkout(request, order_id):
     """Handle order checkout with payment gateway selection"""
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(with_payment_history(Order.objects.all()), id=order_id)
     
     if request.method == "POST":
         payment_method = request.POST.get('payment_method')
+        gateway = get_gateway(payment_method)
         
-        if payment_method == 'esewa':
-            # Initialize eSewa payment
-            esewa = EsewaPaymentGateway()
-            payment_data = esewa.generate_payment_data(order)
-            
-            # Check if we're in sandbox or production mode
-            gateway_mode = getattr(settings, 'PAYMENT_GATEWAY_MODE', 'sandbox')
-            
-            context = {
-                'order': order,
-                'payment_data': payment_data,
-                'payment_url': esewa.payment_url,
-                'payment_method': 'esewa',
-                'gateway_mode': gateway_mode
-            }
-            return render(request, "payment_form.html", context)
-            
-        elif payment_method == 'khalti':
-            # Initialize Khalti payment
-            khalti = KhaltiPaymentGateway()
-            success, response = khalti.initiate_payment(order)
-            
-            if success:
-                # Redirect to Khalti payment page
-                return redirect(response['payment_url'])
-            else:
-                messages.error(request, f"Khalti payment initiation failed: {response}")
-                return redirect('order_checkout', order_id=order_id)
+        if gateway is None:
+            messages.error(request, "Please choose a supported payment method")
+        else:
+            success, response = gateway.start_checkout(order)
+            return checkout_response(request, order, gateway, success, response)
     
     return render(request, "order_checkout.html", {"order": order})
 
 
 def order_success(request, order_id):
-    """Display order success page"""
-    order = get_object_or_404(Order, id=order_id)
+    """Display order success page with the order's payment history"""
+    order = get_object_or_404(with_payment_history(Order.objects.all()), id=order_id)
     return render(request, "order_success.html", {"order": order})
 
 
+def payment_processing(request, order_id):
+    """Waiting page shown while a payment is verified in the background"""
+    order = get_object_or_404(Order, id=order_id)
+    if order.is_paid:
+        return redirect('order_success', order_id=order.id)
+    return render(request, "payment_processing.html", {"order": order})
+
+
 def esewa_success(request):
     """Handle eSewa payment success callback"""
-    esewa = EsewaPaymentGateway()
-    success, message = esewa.verify_payment(request)
+    esewa = get_gateway('esewa')
+    params = esewa.parse_callback(request.GET)
+    if params is None:
+        messages.error(request, "Payment verification failed: Missing or invalid payment details")
+        return redirect('order_list')
+    oid, amt, refId, transaction_uuid = params
+    
+    # Hand verification to the task queue and let the browser poll for the result
+    if getattr(settings, 'PAYMENT_QUEUE_VERIFICATION', True):
+        try:
+            order = Order.objects.get(order_id=oid)
+        except Order.DoesNotExist:
+            messages.error(request, "Order not found")
+            return redirect('order_list')
+        
+        mark_order_processing(order)
+        verify_esewa_payment.delay(oid, amt, refId, transaction_uuid)
+        return redirect('payment_processing', order_id=order.id)
+    
+    success, message = esewa.verify_transaction(oid, amt, refId, transaction_uuid=transaction_uuid)
     
     if success:
-        oid = request.GET.get('oid')
         try:
             order = Order.objects.get(order_id=oid)
             messages.success(request, "Payment completed successfully!")
@@ -77,6 +154,9 @@ def esewa_success(request):
         except Order.DoesNotExist:
             messages.error(request, "Order not found")
             return redirect('order_list')
+    elif success is None:
+        messages.warning(request, f"eSewa reports this payment as {message}; it will be checked again shortly")
+        return redirect('order_list')
     else:
         messages.error(request, f"Payment verification failed: {message}")
         return redirect('order_list')
@@ -91,56 +171,30 @@ def esewa_failure(request):
 def khalti_success(request):
     """Handle Khalti payment success callback"""
     pidx = request.GET.get('pidx')
-    transaction_id = request.GET.get('transaction_id')
     purchase_order_id = request.GET.get('purchase_order_id')
-    amount = request.GET.get('amount')
-    status = request.GET.get('status')
     
     if not pidx:
         messages.error(request, "Invalid payment session")
         return redirect('order_list')
     
-    # If status is already 'Completed' from URL params, we can process directly
-    if status == 'Completed' and purchase_order_id:
+    # Hand verification to the task queue and let the browser poll for the result.
+    # Khalti redirects paid orders with status=Completed; those are looked up too.
+    if getattr(settings, 'PAYMENT_QUEUE_VERIFICATION', True) and purchase_order_id:
         try:
             order = Order.objects.get(order_id=purchase_order_id)
-            
-            # Update order status
-            order.is_paid = True
-            order.paid_amount = int(amount) // 100 if amount else order.total_price  # Convert paisa to rupees
-            order.payment_method = 'Khalti'
-            order.transaction_id = transaction_id
-            order.save()
-            
-            # Log payment
-            PaymentLog.objects.create(
-                order=order,
-                payment_method='Khalti',
-                transaction_id=transaction_id,
-                amount=order.paid_amount,
-                status='Success',
-                gateway_response={
-                    'pidx': pidx,
-                    'transaction_id': transaction_id,
-                    'purchase_order_id': purchase_order_id,
-                    'amount': amount,
-                    'status': status
-                }
-            )
-            
-            messages.success(request, "Payment completed successfully!")
-            return redirect('order_success', order_id=order.id)
-            
         except Order.DoesNotExist:
             messages.error(request, "Order not found")
             return redirect('order_list')
+        
+        mark_order_processing(order)
+        verify_khalti_payment.delay(pidx, purchase_order_id)
+        return redirect('payment_processing', order_id=order.id)
     
-    # Fallback to API verification if needed
-    khalti = KhaltiPaymentGateway()
-    success, response = khalti.verify_payment(pidx)
+    # Without the queue, look the payment up now; redirect parameters are never trusted
+    success, response = get_gateway('khalti').verify_payment(pidx, order_id=purchase_order_id)
     
     if success:
-        order_id = response.get('purchase_order_id')
+        order_id = response.get('purchase_order_id') or purchase_order_id
         try:
             order = Order.objects.get(order_id=order_id)
             messages.success(request, "Payment completed successfully!")
@@ -159,36 +213,238 @@ def khalti_failure(request):
     return redirect('order_list')
 
 
+def _valid_webhook_signature(request):
+    """Check the HMAC-SHA256 of the raw body when a webhook secret is configured"""
+    secret = getattr(settings, 'KHALTI_WEBHOOK_SECRET', None)
+    if not secret:
+        # Unsigned events are still confirmed with a lookup before anything is settled
+        return True
+    header = getattr(settings, 'KHALTI_WEBHOOK_SIGNATURE_HEADER', 'X-Khalti-Signature')
+    expected = hmac.new(secret.encode(), request.body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, request.headers.get(header, ''))
+
+
 @csrf_exempt
+@require_http_methods(["POST"])
 def khalti_webhook(request):
-    """Handle Khalti webhook notifications"""
-    if request.method == 'POST':
-        try:
-            data = json.loads(request.body)
-            # Process webhook data
-            # This is for additional verification and logging
-            return JsonResponse({'status': 'success'})
-        except Exception as e:
-            return JsonResponse({'status': 'error', 'message': str(e)})
+    """Handle Khalti webhook notifications
+    
+    Acknowledges as soon as the event is checked and queued; the lookup and
+    settlement happen in a task, so bursts and redeliveries stay cheap.
+    """
+    if not _valid_webhook_signature(request):
+        logger.warning("Rejected Khalti webhook with an invalid signature")
+        return JsonResponse({'status': 'error', 'message': 'Invalid signature'}, status=401)
     
-    return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    
+    pidx = data.get('pidx') if isinstance(data, dict) else None
+    if not pidx:
+        return JsonResponse({'status': 'error', 'message': 'pidx is required'}, status=400)
+    
+    # Khalti redelivers until it gets a 2xx; only the first copy of an event is queued
+    dedupe_key = f"khalti-webhook:{pidx}:{data.get('status', '')}"
+    if not cache.add(dedupe_key, 1, getattr(settings, 'KHALTI_WEBHOOK_DEDUPE_TTL', 86400)):
+        return JsonResponse({'status': 'success', 'duplicate': True})
+    
+    try:
+        process_khalti_webhook.delay(pidx, data.get('purchase_order_id'))
+    except Exception as e:
+        # Let the redelivery try again
+        cache.delete(dedupe_key)
+        logger.error("Queueing Khalti webhook for %s failed: %s", pidx, e, extra={'gateway': 'Khalti', 'pidx': pidx})
+        return JsonResponse({'status': 'error', 'message': 'Temporarily unavailable'}, status=503)
+    
+    return JsonResponse({'status': 'success'})
 
 
 # API Views for AJAX requests
+@method_decorator(read_from_replica, name='get')
 class PaymentStatusView(View):
     """API endpoint to check payment status"""
     
     def get(self, request, order_id):
-        try:
-            order = Order.objects.get(id=order_id)
-            return JsonResponse({
-                'status': 'success',
-                'is_paid': order.is_paid,
-                'payment_method': order.payment_method,
-                'transaction_id': order.transaction_id
-            })
-        except Order.DoesNotExist:
+        entry = get_payment_status(order_id)
+        if entry is None:
             return JsonResponse({'status': 'error', 'message': 'Order not found'})
+        return status_response(request, entry['payload'], entry['etag'], last_modified(entry))
+
+
+class PaymentEventsView(View):
+    """Server-Sent Events stream of status changes for one order, or every order when no id is given.
+
+    Streams are only served under ASGI: a WSGI worker would be held for the
+    whole stream. Elsewhere, and past PAYMENT_EVENTS_MAX_STREAMS, the answer
+    is an error EventSource doesn't retry, and pages poll instead.
+    """
+    
+    def get(self, request, order_id=None):
+        if not isinstance(request, ASGIRequest):
+            return HttpResponse(status=204)
+        if order_id is None:
+            channels, snapshot, until = [DASHBOARD_CHANNEL], None, None
+        else:
+            if get_payment_status(order_id) is None:
+                return JsonResponse({'status': 'error', 'message': 'Order not found'}, status=404)
+            channels = [order_channel(order_id)]
+            
+            def snapshot():
+                entry = get_payment_status(order_id)
+                return [{'id': order_id, **entry['payload']}] if entry else []
+            
+            def until(event):
+                # Nothing more to report once the order is settled either way
+                return event['is_paid'] or event['order_status'] == 'failed'
+        
+        slot = acquire_stream_slot()
+        if slot is None:
+            response = JsonResponse({'status': 'error', 'message': 'Too many open event streams'}, status=503)
+            response['Retry-After'] = str(getattr(settings, 'PAYMENT_EVENTS_MAX_AGE', 300))
+            return response
+        stream = SlotStream(aevent_stream(channels, snapshot, until), slot)
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+@method_decorator(read_from_replica, name='get')
+class PaymentStatusBulkView(View):
+    """API endpoint to check the payment status of many orders at once (?ids=1,2,3)"""
+    
+    def get(self, request):
+        try:
+            order_ids = [int(value) for value in request.GET.get('ids', '').split(',') if value.strip()]
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'ids must be a comma-separated list of integers'}, status=400)
+        
+        limit = getattr(settings, 'PAYMENT_STATUS_BULK_LIMIT', 100)
+        if len(order_ids) > limit:
+            return JsonResponse({'status': 'error', 'message': f'At most {limit} ids per request'}, status=400)
+        
+        entries = get_payment_statuses(order_ids)
+        etag, modified = combined_validators(entries, order_ids)
+        payload = {
+            'orders': {str(pk): entry['payload'] for pk, entry in entries.items()},
+            'missing': [pk for pk in order_ids if pk not in entries]
+        }
+        return status_response(request, payload, etag, modified)
+
+
+@method_decorator(read_from_replica, name='get')
+class OrderListAPIView(View):
+    """API endpoint returning a cursor-paginated page of orders"""
+    
+    def get(self, request):
+        page = _order_page(request)
+        return JsonResponse({
+            'status': 'success',
+            'orders': [_order_summary(order) for order in page.items],
+            'next_cursor': page.next_cursor,
+            'has_next': page.has_next
+        })
+
+
+class OrderDetailAPIView(View):
+    """API endpoint returning one order with its payment history.
+
+    ``?include=gateway_response`` adds the raw gateway payloads and
+    ``?archived=1`` adds logs moved out by the retention job; both are for
+    staff only.
+    """
+    
+    def get(self, request, order_id):
+        gateway_response = request.GET.get('include') == 'gateway_response'
+        archived = request.GET.get('archived') in ('1', 'true')
+        if (gateway_response or archived) and not request.user.is_staff:
+            return JsonResponse(
+                {'status': 'error', 'message': 'Gateway responses and archived logs are for staff only'}, status=403,
+            )
+        order = with_payment_history(Order.objects.all(), gateway_response).filter(id=order_id).first()
+        if order is None:
+            return JsonResponse({'status': 'error', 'message': 'Order not found'}, status=404)
+        return JsonResponse({
+            'status': 'success',
+            'order': {
+                **_order_summary(order),
+                'paid_amount': order.paid_amount,
+                'currency': order.currency,
+                'transaction_id': order.transaction_id,
+                'updated_at': order.updated_at.isoformat(),
+            },
+            'payment_history': payment_history(order, gateway_response, archived=archived),
+        })
+
+
+class OrderStatsView(View):
+    """API endpoint returning precomputed order and payment statistics"""
+    
+    def get(self, request):
+        try:
+            days = max(1, min(int(request.GET.get('days', 30)), 366))
+        except ValueError:
+            days = 30
+        return JsonResponse({'status': 'success', **stats_summary(days)})
+
+
+class GatewayHTTPStatsView(View):
+    """API endpoint exposing gateway HTTP pool counters to staff and the metrics scraper"""
+    
+    def get(self, request):
+        if not (request.user.is_staff or _has_metrics_token(request)):
+            return HttpResponse(status=401)
+        return JsonResponse({
+            'status': 'success',
+            'hosts': get_http_client().get_stats(),
+            'circuits': circuit_states(),
+        })
+
+
+@staff_member_required
+@require_http_methods(["GET"])
+@read_from_replica
+def export(request, kind):
+    """Stream orders or payment logs as CSV/JSONL, optionally gzipped, for finance reports"""
+    fmt = request.GET.get('format', 'csv')
+    gzip = request.GET.get('gzip') in ('1', 'true')
+    try:
+        queryset, columns = export_queryset(
+            kind,
+            start=request.GET.get('start'),
+            end=request.GET.get('end'),
+            gateway=request.GET.get('gateway'),
+            status=request.GET.get('status'),
+        )
+        # Pick the database now; the stream is read after this view has returned
+        chunks = stream_export(queryset.using(queryset.db), columns, fmt=fmt, gzip=gzip)
+    except ExportError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    if isinstance(request, ASGIRequest):
+        chunks = astream_export(chunks)
+    filename = f"{kind}.{fmt}" + ('.gz' if gzip else '')
+    response = StreamingHttpResponse(chunks, content_type='application/gzip' if gzip else FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _has_metrics_token(request):
+    """Whether the request carries ``Authorization: Bearer <METRICS_TOKEN>``"""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    return bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """Prometheus metrics for gateway calls, views and payment outcomes, for staff and the scraper"""
+    if not (request.user.is_staff or _has_metrics_token(request)):
+        return HttpResponse(status=401)
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
 
 
 def create_test_order(request):
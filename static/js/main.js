@@ -49,14 +49,14 @@ document.addEventListener('DOMContentLoaded', function() {
             });
         });
 
-        // Payment status checker
-        const orderStatusElements = document.querySelectorAll('[data-order-id]');
-        orderStatusElements.forEach(element => {
-            const orderId = element.dataset.orderId;
-            if (orderId) {
-                checkPaymentStatus(orderId);
-            }
-        });
+        // Payment status checker (one bulk request for every order on the page)
+        const orderIds = Array.from(document.querySelectorAll('[data-order-id]'))
+            .map(element => element.dataset.orderId)
+            .filter(orderId => orderId);
+        if (orderIds.length) {
+            checkPaymentStatuses(orderIds);
+            watchPaymentStatuses(orderIds);
+        }
 
         // Smooth scroll for anchor links
         document.querySelectorAll('a[href^="#"]').forEach(anchor => {
@@ -100,9 +100,61 @@ function createRipple(element, event) {
     }, 600);
 }
 
+// Check payment status for many orders at once; unchanged results come back as 304s
+function checkPaymentStatuses(orderIds) {
+    fetch(`/payment/payment-status/bulk/?ids=${orderIds.join(',')}`, { cache: 'no-cache' })
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'success') {
+                Object.entries(data.orders).forEach(([orderId, status]) => {
+                    updatePaymentStatus(orderId, status);
+                });
+            }
+        })
+        .catch(error => {
+            console.error('Error checking payment status:', error);
+        });
+}
+
+// Apply status changes pushed by the server for the order on the page. Pages
+// listing several orders poll in bulk rather than holding a stream for each.
+function watchPaymentStatuses(orderIds) {
+    if (orderIds.length !== 1 || !window.EventSource) {
+        pollPaymentStatuses(orderIds);
+        return;
+    }
+
+    const orderId = orderIds[0];
+    const source = new EventSource(`/payment/payment-events/${orderId}/`);
+    let failures = 0;
+    source.onopen = () => { failures = 0; };
+    source.addEventListener('status', event => {
+        const data = JSON.parse(event.data);
+        updatePaymentStatus(orderId, data);
+        if (data.is_paid || data.order_status === 'failed') {
+            source.close();
+        }
+    });
+    source.onerror = () => {
+        // The server refused the stream (no ASGI, or too many open) or keeps dropping it
+        if (source.readyState === EventSource.CLOSED || ++failures >= 3) {
+            source.close();
+            pollPaymentStatuses(orderIds);
+        }
+    };
+}
+
+// Poll with a growing interval; unchanged results come back as 304s
+function pollPaymentStatuses(orderIds, delay = 5000) {
+    setTimeout(() => {
+        checkPaymentStatuses(orderIds);
+        pollPaymentStatuses(orderIds, Math.min(delay * 1.5, 30000));
+    }, delay);
+}
+
 // Check payment status
 function checkPaymentStatus(orderId) {
-    fetch(`/payment/payment-status/${orderId}/`)
+    fetch(`/payment/payment-status/${orderId}/`, { cache: 'no-cache' })
         .then(response => response.json())
         .then(data => {
             if (data.status === 'success') {
@@ -455,9 +507,61 @@ function createRipple(element, event) {
     }, 600);
 }
 
+// Check payment status for many orders at once; unchanged results come back as 304s
+function checkPaymentStatuses(orderIds) {
+    fetch(`/payment/payment-status/bulk/?ids=${orderIds.join(',')}`, { cache: 'no-cache' })
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'success') {
+                Object.entries(data.orders).forEach(([orderId, status]) => {
+                    updatePaymentStatus(orderId, status);
+                });
+            }
+        })
+        .catch(error => {
+            console.error('Error checking payment status:', error);
+        });
+}
+
+// Apply status changes pushed by the server for the order on the page. Pages
+// listing several orders poll in bulk rather than holding a stream for each.
+function watchPaymentStatuses(orderIds) {
+    if (orderIds.length !== 1 || !window.EventSource) {
+        pollPaymentStatuses(orderIds);
+        return;
+    }
+
+    const orderId = orderIds[0];
+    const source = new EventSource(`/payment/payment-events/${orderId}/`);
+    let failures = 0;
+    source.onopen = () => { failures = 0; };
+    source.addEventListener('status', event => {
+        const data = JSON.parse(event.data);
+        updatePaymentStatus(orderId, data);
+        if (data.is_paid || data.order_status === 'failed') {
+            source.close();
+        }
+    });
+    source.onerror = () => {
+        // The server refused the stream (no ASGI, or too many open) or keeps dropping it
+        if (source.readyState === EventSource.CLOSED || ++failures >= 3) {
+            source.close();
+            pollPaymentStatuses(orderIds);
+        }
+    };
+}
+
+// Poll with a growing interval; unchanged results come back as 304s
+function pollPaymentStatuses(orderIds, delay = 5000) {
+    setTimeout(() => {
+        checkPaymentStatuses(orderIds);
+        pollPaymentStatuses(orderIds, Math.min(delay * 1.5, 30000));
+    }, delay);
+}
+
 // Check payment status
 function checkPaymentStatus(orderId) {
-    fetch(`/payment/payment-status/${orderId}/`)
+    fetch(`/payment/payment-status/${orderId}/`, { cache: 'no-cache' })
         .then(response => response.json())
         .then(data => {
             if (data.status === 'success') {